@@ -0,0 +1,74 @@
+"""Benchmark of text cleaning: the original uncompiled chain against clean_text and clean_texts.
+
+    python3 -m benchmarks.clean_text --articles 5000 --n-process 4
+
+Uses CNN/DailyMail articles from `dataset_split_loading` (`--dataset`), or synthetic CNN-like articles otherwise.
+"""
+import argparse
+import random
+import re
+import time
+from src.data_preparation.preprocess import clean_text, clean_texts
+
+
+def legacy_clean_text(text):
+    text = re.sub(r"Copyright \d{4} Reuters.", "", text)
+    text = re.sub(r"All rights reserved.", "", text)
+    text = re.sub(r"This material may not be published, broadcast, rewritten, or redistributed.", "", text)
+    text = re.sub(r"E-mail to a friend.", "", text)
+    text = re.sub(r"\n", "", text)
+    text = ". ".join(sentence for sentence in text.split(".") if "CLICK HERE" not in sentence)
+    text = re.sub(r" +", " ", text)
+    text = re.sub(r'By . (\w+ |\w+, ){1,}. (PUBLISHED: . \d+:\d+ EST, \d+ \w+ \d+ )?(. \| . )?(UPDATED: . \d+:\d+ '
+                  r'EST, \d+ \w+ \d+ . )?', "", text)
+    text = re.sub(r'(\w+)?( |, )?(\w+)?( )?\(CNN\)( -- )?', "", text)
+    return text
+
+
+SENTENCES = [
+    "The government announced new measures on Tuesday.", "Officials said the plan would cost $3.5 billion.",
+    "Residents were told to stay indoors until the storm passed.", "The company's shares fell 4 percent.",
+    "She said:  'We are looking forward to the next season.'", "Police are appealing for witnesses.",
+    "CLICK HERE for the full story.", "The match ended 2-1 after extra time.",
+]
+HEADERS = ["(CNN) -- ", "LONDON, England (CNN) -- ", "By . Daily Mail Reporter . ",
+           "By . Emma Reynolds . PUBLISHED: . 10:15 EST, 3 May 2013 . | . UPDATED: . 11:20 EST, 3 May 2013 . ", ""]
+FOOTER = "E-mail to a friend . Copyright 2007 Reuters. All rights reserved."
+
+
+def synthetic_articles(count, seed=0):
+    rng = random.Random(seed)
+    articles = []
+    for _ in range(count):
+        body = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(20, 60)))
+        body = body.replace(". ", ".\n", rng.randint(0, 5))
+        articles.append(rng.choice(HEADERS) + body + (" " + FOOTER if rng.random() < 0.1 else ""))
+    return articles
+
+
+def timed(name, function, articles):
+    start = time.perf_counter()
+    result = function(articles)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {elapsed:8.3f}s {len(articles) / elapsed:10.0f} articles/s")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--n-process", type=int, default=4)
+    parser.add_argument("--dataset", action="store_true", help="Use CNN/DailyMail articles instead of synthetic ones")
+    args = parser.parse_args()
+
+    if args.dataset:
+        from src.data_preparation.dataset_loading import dataset_split_loading
+        articles = dataset_split_loading(end=args.articles)['article']
+    else:
+        articles = synthetic_articles(args.articles)
+
+    legacy = timed("legacy chain", lambda texts: [legacy_clean_text(text) for text in texts], articles)
+    compiled = timed("clean_text", lambda texts: [clean_text(text) for text in texts], articles)
+    pooled = timed(f"clean_texts (n_process={args.n_process})",
+                   lambda texts: clean_texts(texts, n_process=args.n_process), articles)
+    assert legacy == compiled == pooled, "cleaning outputs differ"
@@ -0,0 +1,93 @@
+"""Benchmark of WordCorruption and LetterMasking: the original per-sentence loops against the batched NumPy attacks.
+
+    python3 -m benchmarks.corruption --articles 2000 --sentences 40
+"""
+import argparse
+import random
+import time
+from src.attacks.attack import LetterMasking, WordCorruption
+from benchmarks.clean_text import SENTENCES
+
+
+def legacy_word_corruption(attack, sentences):
+    new_sentences = []
+    changes = 0
+    left = int(len(' '.join(sentences).split()) * attack.percentage)
+    for sentence in sentences:
+        words = sentence.split()
+        indices = []
+        if left > 0:
+            number_of_words = min(random.randint(0, left), len(words))
+            left -= number_of_words
+            indices = random.sample(range(len(words)), number_of_words)
+        for index in indices:
+            if words[index].strip('.,?!') != words[index]:
+                words[index] = attack.corrupted_word + words[index].strip(words[index].strip('.,?!'))
+            else:
+                words[index] = attack.corrupted_word
+            changes += 1
+        new_sentences.append(" ".join(words))
+    return ' '.join(new_sentences), changes
+
+
+def legacy_letter_masking(attack, sentences):
+    new_sentences = []
+    changes = 0
+    left = int(len(' '.join(sentences).split()) * attack.percentage)
+    for sentence in sentences:
+        words = sentence.split()
+        indices = []
+        if left > 0:
+            number_of_words = min(random.randint(0, left), len(words))
+            left -= number_of_words
+            indices = random.sample(range(len(words)), number_of_words)
+        for index in indices:
+            new_word = ""
+            for letter in words[index]:
+                if letter.lower() in attack.masking_dictionary:
+                    new_word += random.choice(attack.masking_dictionary[letter.lower()])
+                else:
+                    new_word += letter
+            words[index] = new_word
+            changes += 1
+        new_sentences.append(" ".join(words))
+    return ' '.join(new_sentences), changes
+
+
+def synthetic_documents(count, sentences, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice(SENTENCES) for _ in range(sentences)] for _ in range(count)]
+
+
+def timed(name, function, documents, repeats=5):
+    # best of several runs, single runs are noisy on shared machines
+    elapsed = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(documents)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{name:<32} {elapsed:8.3f}s {len(documents) / elapsed:10.0f} documents/s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--sentences", type=int, default=40)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--percentage", type=float, default=0.2)
+    args = parser.parse_args()
+
+    documents = synthetic_documents(args.articles, args.sentences)
+    keys = list(range(len(documents)))
+    attacks = [(WordCorruption(args.percentage, 'MASK', seed=0), legacy_word_corruption),
+               (LetterMasking(args.percentage, seed=0), legacy_letter_masking)]
+    for attack, legacy in attacks:
+        before = timed(f"legacy {attack.name}", lambda docs: [legacy(attack, sentences) for sentences in docs],
+                       documents)
+        after = timed(f"{attack.name}.attack_batch",
+                      lambda docs: [result for start in range(0, len(docs), args.chunk_size)
+                                    for result in attack.attack_batch(docs[start:start + args.chunk_size],
+                                                                      keys[start:start + args.chunk_size])],
+                      documents)
+        print(f"{attack.name} speedup: {before / after:.1f}x")
@@ -0,0 +1,303 @@
+from carl.experiments.experiment import Experiment
+from carl.backends.backend import Backend
+from typing import Any, Dict, List, Optional
+import ast
+import csv
+import inspect
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+from carl.gin.config import make_gin_bindings
+import joblib as jl
+import gin
+import pyarrow.parquet as pq
+from jobs import FullPipeline
+from jobs.checkpoint import fingerprint
+from jobs.full_pipeline import FullPipeline as FullPipelineClass
+from jobs.result_store import ResultStore
+from src.utils.cache import DiskCache
+sys.setrecursionlimit(8000)
+
+# bindings the backend sets for every shard, an experiment must not set them itself
+SHARD_BINDINGS = ('dataset_split_loading.num_shards', 'dataset_split_loading.shard_index')
+# tables of the Parquet result store, merged part by part
+RESULT_TABLES = ('documents', 'results', 'metrics', 'stylometrix')
+# memory a worker running the full pipeline is assumed to need, every worker loads its own models
+WORKER_MEMORY_BYTES = 4 * 2 ** 30
+
+
+def default_workers() -> int:
+    """Number of workers that fit in the physical memory, at most one per CPU"""
+    cpus = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return min(cpus, 2)
+    return max(1, min(cpus, memory // WORKER_MEMORY_BYTES))
+
+
+def config_value(config: Dict[str, Any], key: str) -> Any:
+    """Python value of a gin binding in an experiment config, the FullPipeline default when it is not bound"""
+    if key not in config:
+        return inspect.signature(FullPipelineClass.__init__).parameters[key.split('.')[-1]].default
+    value = config[key]
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def worker_cache_path(path: str, name: str) -> str:
+    """Attack cache of one worker process, processes do not write to the same SQLite file"""
+    root, extension = os.path.splitext(path)
+    return f"{root}_{name}{extension}"
+
+
+def seed_worker_caches(path: str, names: List[str], max_size_bytes: Optional[int] = None) -> None:
+    """Copies the shared attack cache into the cache of every worker before the workers start"""
+    if not os.path.exists(path):
+        return
+    for name in names:
+        cache = DiskCache(worker_cache_path(path, name), max_size_bytes=max_size_bytes)
+        cache.merge([path])
+        cache.close()
+
+
+def merge_worker_caches(path: str, names: List[str], max_size_bytes: Optional[int] = None) -> None:
+    """Merges the caches of the workers into the shared attack cache once they finished"""
+    cache = DiskCache(path, max_size_bytes=max_size_bytes)
+    cache.merge([worker_cache_path(path, name) for name in names])
+    cache.close()
+
+
+def shard_config(config: Dict[str, Any], shard_index: int, num_shards: int) -> Dict[str, Any]:
+    """Config of one shard: a contiguous part of the dataset written to its own outputs and checkpoints"""
+    output_dir = config_value(config, 'jobs.FullPipeline.output_dir')
+    shard_dir = os.path.splitext(output_dir)[0] + "_shards"
+    name = f"shard_{shard_index:05d}"
+    shard = dict(config)
+    shard.update({
+        'dataset_split_loading.num_shards': num_shards,
+        'dataset_split_loading.shard_index': shard_index,
+        'jobs.FullPipeline.output_dir': repr(os.path.join(shard_dir, f"{name}.csv")),
+        'jobs.FullPipeline.run_analysis': False,
+        # the shards already use every core, processes inside a shard would only oversubscribe them
+        'jobs.FullPipeline.segmentation_n_process': 1,
+        'jobs.FullPipeline.cleaning_n_process': 1,
+        'jobs.FullPipeline.attack_workers': 1,
+    })
+    if config_value(config, 'jobs.FullPipeline.stylometrix_path') is not None:
+        shard['jobs.FullPipeline.stylometrix_path'] = repr(os.path.join(shard_dir, f"{name}_stylometrix"))
+    # shards hold different rows, sharing checkpoints would make them overwrite each other's
+    for key in ('jobs.FullPipeline.checkpoint_dir', 'jobs.FullPipeline.preparation_checkpoint_dir'):
+        directory = config_value(config, key)
+        if directory is not None:
+            shard[key] = repr(os.path.join(directory, name))
+    # one SQLite attack cache per shard, merged into the shared one when the shards finish
+    attack_cache_path = config_value(config, 'jobs.FullPipeline.attack_cache_path')
+    if attack_cache_path is not None:
+        shard['jobs.FullPipeline.attack_cache_path'] = repr(worker_cache_path(attack_cache_path, name))
+    # shards share the rate limits of the summarization API
+    for key in ('jobs.FullPipeline.requests_per_minute', 'jobs.FullPipeline.tokens_per_minute'):
+        shard[key] = max(1, config_value(config, key) // num_shards)
+    return shard
+
+
+def merge_csv(paths: List[str], target: str) -> int:
+    """Concatenates CSV files written with an index column, shifting the index of every file past the previous ones.
+
+    Records are copied field by field, so values are written exactly as the shards wrote them. Returns the number
+    of merged rows.
+    """
+    csv.field_size_limit(sys.maxsize)
+    offset = 0
+    header_written = False
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    with open(target, 'w', newline='') as out:
+        writer = csv.writer(out, lineterminator='\n')
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                if not header_written:
+                    writer.writerow(header)
+                    header_written = True
+                rows = 0
+                for row in reader:
+                    row[0] = str(int(row[0]) + offset)
+                    writer.writerow(row)
+                    rows += 1
+                offset += rows
+    return offset
+
+
+def merge_result_stores(stores: List[ResultStore], target: ResultStore) -> None:
+    """Copies the parts of every store into the target in order, shifting row indices past the previous stores"""
+    for table in RESULT_TABLES:
+        partitions = sorted({partition for store in stores for partition in store.partitions(table)}) or [None]
+        number_of_parts = 0
+        for partition in partitions:
+            offset = 0
+            part = 0
+            for store in stores:
+                for path in store.parts(table, partition):
+                    df = pq.read_table(path, memory_map=True, use_pandas_metadata=True).to_pandas()
+                    df.index = df.index + offset
+                    offset += len(df)
+                    target.write(table, df, partition=partition, part=part)
+                    part += 1
+            number_of_parts = max(number_of_parts, part)
+        target.prune(table, number_of_parts)
+
+
+class QueueWriter:
+    """Standard output of a shard worker, forwarded line by line to the backend"""
+
+    def __init__(self, progress: multiprocessing.Queue, shard_index: int):
+        self.progress = progress
+        self.shard_index = shard_index
+        self.buffer = ''
+
+    def write(self, text: str) -> int:
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            if line:
+                self.progress.put(('log', self.shard_index, line))
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def run_shard(config: Dict[str, Any], shard_index: int, n_threads: int, progress: multiprocessing.Queue) -> None:
+    """Entry point of a shard worker process: parses the shard config and runs one FullPipeline on the shard"""
+    sys.stdout = QueueWriter(progress, shard_index)
+    try:
+        import torch
+        torch.set_num_threads(n_threads)
+        gin.parse_config_files_and_bindings(['configs/empty.gin'], make_gin_bindings(config))
+        job = FullPipeline()
+        job.run()
+        progress.put(('done', shard_index, job.metric_fingerprint))
+    except BaseException:
+        progress.put(('error', shard_index, traceback.format_exc()))
+        raise
+
+
+class LocalParallelBackend(Backend):
+    """Runs an experiment on `n_workers` processes, each running the full pipeline on a contiguous dataset shard.
+
+    Workers are spawned, so every one parses its own gin config and loads its models once. Shards write their
+    outputs and checkpoints next to `output_dir` (`<output>_shards/shard_00000.csv`, ...), a rerun resumes every
+    shard from its checkpoints. Preparation checkpoints also get one directory per shard. The attack cache, when
+    set, is copied to one file per shard and the shard caches are merged back into it when the shards finish. By
+    default there are as many workers as fit in memory (`WORKER_MEMORY_BYTES` each), at most one per CPU. When all
+    shards finish, their outputs are merged in shard order into `output_dir` (and `stylometrix_path`), so the merged
+    results do not depend on which shard finished first, and the analysis runs on the merged results.
+    """
+
+    def __init__(self, n_workers: Optional[int] = None) -> None:
+        super().__init__()
+        self.n_workers = n_workers or default_workers()
+
+    def validate_experiment(self, experiment: Experiment) -> None:
+        if 'jobs.FullPipeline.output_dir' not in experiment.base_config:
+            raise ValueError("local-parallel backend needs jobs.FullPipeline.output_dir to place the shard outputs")
+        for key in SHARD_BINDINGS:
+            if key in experiment.base_config:
+                raise ValueError(f"{key} is set by the local-parallel backend, remove it from the experiment")
+
+    def run_experiment(self, experiment: Experiment) -> None:
+        config = experiment.base_config
+        gin.parse_config_files_and_bindings(['configs/empty.gin'], make_gin_bindings(config))
+        print(make_gin_bindings(config))
+
+        # Log experiment hyperparameters
+        storage_path = 'storage'
+        os.makedirs(storage_path, exist_ok=True)
+        tmp_config = config.copy()
+        tmp_config['pwd'] = os.getcwd()
+        tmp_config['n_workers'] = self.n_workers
+        tmp_config = {f'hyperparams/{k}': v for k, v in tmp_config.items()}
+        jl.dump(tmp_config, os.path.join(storage_path, 'hyperparams.attr'))
+
+        shard_configs = [shard_config(config, index, self.n_workers) for index in range(self.n_workers)]
+        attack_cache_path = config_value(config, 'jobs.FullPipeline.attack_cache_path')
+        if attack_cache_path is not None:
+            names = [f"shard_{index:05d}" for index in range(self.n_workers)]
+            max_size_bytes = config_value(config, 'jobs.FullPipeline.attack_cache_max_size')
+            seed_worker_caches(attack_cache_path, names, max_size_bytes)
+        try:
+            metric_fingerprints = self.run_shards(shard_configs)
+        finally:
+            if attack_cache_path is not None:
+                merge_worker_caches(attack_cache_path, names, max_size_bytes)
+
+        print("Merging shards...")
+        job = FullPipeline()
+        shard_outputs = [config_value(shard, 'jobs.FullPipeline.output_dir') for shard in shard_configs]
+        if job.results is None:
+            merge_csv(shard_outputs, job.output_dir)
+            merge_csv([path.replace(".csv", "_metrics.csv") for path in shard_outputs],
+                      job.output_dir.replace(".csv", "_metrics.csv"))
+            if job.stylometrix_path is not None:
+                shard_dirs = [config_value(shard, 'jobs.FullPipeline.stylometrix_path') for shard in shard_configs]
+                files = sorted({file for directory in shard_dirs if os.path.isdir(directory)
+                                for file in os.listdir(directory) if file.endswith('.csv')})
+                for file in files:
+                    merge_csv([os.path.join(directory, file) for directory in shard_dirs],
+                              os.path.join(job.stylometrix_path, file))
+        else:
+            merge_result_stores([ResultStore(os.path.splitext(path)[0]) for path in shard_outputs], job.results)
+
+        job.analyze(fingerprint('shards', metric_fingerprints))
+
+    def run_shards(self, shard_configs: List[Dict[str, Any]]) -> List[str]:
+        """Runs every shard in its own spawned process and returns their metric fingerprints in shard order"""
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        n_threads = max(1, (os.cpu_count() or 1) // len(shard_configs))
+        processes = [context.Process(target=run_shard, args=(shard, index, n_threads, progress),
+                                     name=f"shard-{index}")
+                     for index, shard in enumerate(shard_configs)]
+        start = time.time()
+        for process in processes:
+            process.start()
+
+        metric_fingerprints = [None] * len(processes)
+        finished = set()
+        failed = {}
+        try:
+            while len(finished) + len(failed) < len(processes):
+                try:
+                    kind, index, payload = progress.get(timeout=1.0)
+                except queue.Empty:
+                    # a worker killed without reporting (e.g. out of memory) never sends its result
+                    for index, process in enumerate(processes):
+                        if process.exitcode not in (None, 0) and index not in finished and index not in failed:
+                            failed[index] = f"process exited with code {process.exitcode}"
+                    continue
+                if kind == 'log':
+                    print(f"[shard {index}/{len(processes)}] {payload}")
+                elif kind == 'done':
+                    finished.add(index)
+                    metric_fingerprints[index] = payload
+                    print(f"Shard {index} finished after {time.time() - start:.0f}s "
+                          f"({len(finished)}/{len(processes)} done)")
+                else:
+                    failed[index] = payload
+                    print(f"Shard {index} failed:\n{payload}")
+        finally:
+            for process in processes:
+                if failed:
+                    process.terminate()
+                process.join()
+
+        if failed:
+            raise RuntimeError(f"Shards {sorted(failed)} failed, rerun to resume them from their checkpoints")
+        return metric_fingerprints
@@ -0,0 +1,174 @@
+from carl.experiments.experiment import Experiment, SweepExperiment
+from carl.backends.backend import Backend
+from carl.backends.local_parallel import (QueueWriter, config_value, default_workers, merge_worker_caches,
+                                          seed_worker_caches, worker_cache_path)
+from typing import Any, Dict, List, Optional, Tuple
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+from carl.gin.config import make_gin_bindings
+import joblib as jl
+import gin
+from jobs import FullPipeline
+sys.setrecursionlimit(8000)
+
+# bindings that decide which preparation checkpoints a run reads, runs agreeing on them share the preparation
+PREPARATION_BINDINGS = ('jobs.FullPipeline.chunk_size', 'jobs.FullPipeline.preparation_checkpoint_dir')
+
+# progress queue and name of a sweep worker process, set by its initializer
+_progress = None
+_worker_name = None
+
+
+def preparation_key(config: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((key, repr(value)) for key, value in config.items()
+                        if key.startswith('dataset_split_loading.') or key in PREPARATION_BINDINGS))
+
+
+def worker_names(n_workers: int) -> List[str]:
+    return [f"worker_{index:05d}" for index in range(n_workers)]
+
+
+def _init_worker(progress: multiprocessing.Queue, n_threads: int, started) -> None:
+    global _progress, _worker_name
+    _progress = progress
+    with started.get_lock():
+        _worker_name = f"worker_{started.value:05d}"
+        started.value += 1
+    import torch
+    torch.set_num_threads(n_threads)
+
+
+def _run_sweep_run(index: int, config: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+    """Runs one configuration of a sweep, models loaded by earlier runs of the worker are reused"""
+    sys.stdout = QueueWriter(_progress, index)
+    attack_cache_path = config_value(config, 'jobs.FullPipeline.attack_cache_path')
+    if attack_cache_path is not None:
+        # every worker writes its own copy of the attack cache, merged into the shared one after the sweep
+        config = {**config, 'jobs.FullPipeline.attack_cache_path': repr(worker_cache_path(attack_cache_path,
+                                                                                          _worker_name))}
+    try:
+        gin.clear_config()
+        gin.parse_config_files_and_bindings(['configs/empty.gin'], make_gin_bindings(config))
+        FullPipeline().run()
+        return index, None
+    except Exception:
+        return index, traceback.format_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stdout = sys.__stdout__
+
+
+class LocalSweepBackend(Backend):
+    """Runs every configuration of a SweepExperiment on a pool of `n_workers` processes.
+
+    Data preparation (loading, cleaning, segmentation) is computed once per distinct dataset config before the runs
+    start, every run reads it from the shared preparation checkpoints. Workers are spawned once and run
+    configurations one after another, so models loaded by one run (kept in the process-wide model registry) are
+    reused by the following runs of the same worker. Every worker writes to its own copy of the attack cache, the
+    copies are merged into the shared cache when the sweep ends. A failed run does not stop the others.
+    """
+
+    def __init__(self, n_workers: Optional[int] = None) -> None:
+        super().__init__()
+        self.n_workers = n_workers
+
+    def validate_experiment(self, experiment: Experiment) -> None:
+        if not isinstance(experiment, SweepExperiment):
+            raise ValueError("local-sweep backend runs SweepExperiment, use local-sequential for a single config")
+        if 'jobs.FullPipeline.output_dir' not in experiment.base_config:
+            raise ValueError("local-sweep backend needs jobs.FullPipeline.output_dir to name the outputs of runs")
+        for key, values in experiment.grid.items():
+            if not values:
+                raise ValueError(f"Sweep grid of {key} has no values")
+
+    def run_experiment(self, experiment: SweepExperiment) -> None:
+        runs = experiment.expand()
+        print(f"Sweep {experiment.name}: {len(runs)} runs")
+
+        # Log experiment hyperparameters
+        storage_path = 'storage'
+        os.makedirs(storage_path, exist_ok=True)
+        tmp_config = experiment.base_config.copy()
+        tmp_config['pwd'] = os.getcwd()
+        tmp_config['grid'] = experiment.grid
+        tmp_config['runs'] = [run.name for run in runs]
+        tmp_config = {f'hyperparams/{k}': v for k, v in tmp_config.items()}
+        jl.dump(tmp_config, os.path.join(storage_path, 'hyperparams.attr'))
+
+        self.prepare(runs)
+        self.run_pool(runs)
+
+    @staticmethod
+    def prepare(runs: List[Experiment]) -> None:
+        """Fills the preparation checkpoints once for every distinct dataset config of the runs"""
+        prepared = set()
+        for run in runs:
+            key = preparation_key(run.base_config)
+            if key in prepared:
+                continue
+            prepared.add(key)
+            print(f"Preparing data for {run.name}...")
+            gin.clear_config()
+            gin.parse_config_files_and_bindings(['configs/empty.gin'], make_gin_bindings(run.base_config))
+            FullPipeline().prepare()
+        gin.clear_config()
+
+    def run_pool(self, runs: List[Experiment]) -> None:
+        n_workers = max(1, min(self.n_workers or default_workers(), len(runs)))
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        caches = {config_value(run.base_config, 'jobs.FullPipeline.attack_cache_path'): config_value(
+            run.base_config, 'jobs.FullPipeline.attack_cache_max_size') for run in runs}
+        caches.pop(None, None)
+        for path, max_size_bytes in caches.items():
+            seed_worker_caches(path, worker_names(n_workers), max_size_bytes)
+        try:
+            failed = self.run_workers(context, progress, runs, n_workers, n_threads)
+        finally:
+            for path, max_size_bytes in caches.items():
+                merge_worker_caches(path, worker_names(n_workers), max_size_bytes)
+
+        if failed:
+            raise RuntimeError(f"Runs {[runs[index].name for index in sorted(failed)]} failed, rerun the sweep to "
+                               f"resume them from their checkpoints")
+
+    def run_workers(self, context, progress: multiprocessing.Queue, runs: List[Experiment], n_workers: int,
+                    n_threads: int) -> Dict[int, str]:
+        """Runs the configurations on the worker pool and returns the errors of the failed runs"""
+        start = time.time()
+        failed = {}
+        started = context.Value('i', 0)
+        with context.Pool(n_workers, initializer=_init_worker, initargs=(progress, n_threads, started)) as pool:
+            # runs differing only in the last grid values are submitted next to each other and tend to share models
+            pending = [pool.apply_async(_run_sweep_run, (index, run.base_config)) for index, run in enumerate(runs)]
+            finished = 0
+            while finished < len(runs):
+                self.print_progress(progress, runs, timeout=0.5)
+                for result in [result for result in pending if result.ready()]:
+                    pending.remove(result)
+                    index, error = result.get()
+                    finished += 1
+                    if error is None:
+                        print(f"Run {runs[index].name} finished after {time.time() - start:.0f}s "
+                              f"({finished}/{len(runs)} done)")
+                    else:
+                        failed[index] = error
+                        print(f"Run {runs[index].name} failed:\n{error}")
+            # lines written just before the last runs returned
+            while self.print_progress(progress, runs, timeout=0.1):
+                pass
+        return failed
+
+    @staticmethod
+    def print_progress(progress: multiprocessing.Queue, runs: List[Experiment], timeout: float) -> bool:
+        try:
+            _, index, line = progress.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        print(f"[run {index}/{len(runs)} {runs[index].name}] {line}")
+        return True
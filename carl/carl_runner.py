@@ -7,6 +7,8 @@ sys.setrecursionlimit(8000)
 import tempfile
 
 from carl.backends.local_sequential import LocalSequentialBackend
+from carl.backends.local_parallel import LocalParallelBackend
+from carl.backends.local_sweep import LocalSweepBackend
 from carl.experiments.experiment import Experiment
 import joblib as jl
 
@@ -31,13 +33,17 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--backend", type=str, choices=["local-sequential"], default="local-sequential")
+        "--backend", type=str, choices=["local-sequential", "local-parallel", "local-sweep"], default="local-sequential")
+    parser.add_argument(
+        "--workers", type=int, default=None, help='Number of worker processes of local-parallel and local-sweep, by default as many as fit in memory (4 GB each), at most one per CPU')
     parser.add_argument(
         "--experiment", type=str, help='Path to experiment config file or path to experiment.joblib file')
     args = parser.parse_args()
 
     backend = {
         'local-sequential': LocalSequentialBackend,
+        'local-parallel': lambda: LocalParallelBackend(n_workers=args.workers),
+        'local-sweep': lambda: LocalSweepBackend(n_workers=args.workers),
     }[args.backend]()
 
     experiment = load_experiment(args.experiment)
@@ -1,8 +1,59 @@
-from dataclasses import dataclass
-from typing import Any, Dict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+import ast
+import itertools
+import os
+import re
 
 
 @dataclass
 class Experiment:
     name: str
     base_config: Dict[str, Any]
+
+
+def value_slug(value: Any) -> str:
+    """Short file name friendly form of a gin binding value"""
+    slug = re.sub(r'[^A-Za-z0-9.]+', '-', str(value)).strip('-')
+    return slug[:32] or 'none'
+
+
+@dataclass
+class SweepExperiment(Experiment):
+    """Experiment run once for every combination of the values in `grid`, a dict of gin binding to values.
+
+    Every run writes to `output_dir` (and `stylometrix_path`, `checkpoint_dir`) with a suffix naming its grid values.
+    Loading, cleaning and segmentation are checkpointed to `<output>_sweep_preparation`, so runs on the same dataset
+    share them, and attack outputs go to a shared attack cache unless the experiment sets its own (the backend gives
+    every worker its own copy and merges them into it).
+    """
+    grid: Dict[str, List[Any]] = field(default_factory=dict)
+
+    def sweep_root(self) -> str:
+        return os.path.splitext(ast.literal_eval(self.base_config['jobs.FullPipeline.output_dir']))[0] + "_sweep"
+
+    def expand(self) -> List[Experiment]:
+        keys = list(self.grid)
+        shared = {
+            'jobs.FullPipeline.preparation_checkpoint_dir': repr(self.sweep_root() + "_preparation"),
+            'jobs.FullPipeline.attack_cache_path': repr(self.sweep_root() + "_attack_cache.sqlite"),
+        }
+        runs = []
+        suffixes = set()
+        for index, values in enumerate(itertools.product(*(self.grid[key] for key in keys))):
+            suffix = '_'.join(f"{key.split('.')[-1]}-{value_slug(value)}" for key, value in zip(keys, values))
+            if not suffix or suffix in suffixes:
+                # slugs of different values can collide, the index keeps the outputs of runs apart
+                suffix = f"{suffix}_{index:03d}" if suffix else f"{index:03d}"
+            suffixes.add(suffix)
+
+            config = {**shared, **self.base_config, **dict(zip(keys, values))}
+            output_dir = ast.literal_eval(config['jobs.FullPipeline.output_dir'])
+            root, extension = os.path.splitext(output_dir)
+            config['jobs.FullPipeline.output_dir'] = repr(f"{root}_{suffix}{extension}")
+            for key in ('jobs.FullPipeline.stylometrix_path', 'jobs.FullPipeline.checkpoint_dir'):
+                value = ast.literal_eval(config[key]) if isinstance(config.get(key), str) else None
+                if value is not None:
+                    config[key] = repr(os.path.join(value, suffix))
+            runs.append(Experiment(name=f"{self.name}_{suffix}", base_config=config))
+        return runs
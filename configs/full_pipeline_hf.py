@@ -21,8 +21,14 @@ base_config = {
     'jobs.FullPipeline.metrics_org': '[@metrics.Stylometrix, @metrics.NovelNGrams]',
     'jobs.FullPipeline.produce_summaries': True,
     'jobs.FullPipeline.output_dir': "'data/summaries_with_metrics_chat.csv'",
-    'jobs.FullPipeline.summarizer': "@summarizers.HFSummarizer",
-    'HFSummarizer.prompt': "'Generate a summary of the following text: '",
-    'HFSummarizer.temperature': 0.7,
-    'HFSummarizer.model_name': "'t5-base'"
-}
\ No newline at end of file
+    'jobs.FullPipeline.summarizer': "@summarizers.HfSummarizer",
+    'HfSummarizer.prompt': "'Generate a summary of the following text: '",
+    'HfSummarizer.temperature': 0.7,
+    'HfSummarizer.model_name': "'t5-base'",
+    'HfSummarizer.batch_size': 8,
+}
+
+experiment = Experiment(
+    name='test',
+    base_config=base_config,
+)
\ No newline at end of file
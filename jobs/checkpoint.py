@@ -0,0 +1,97 @@
+from typing import Any, Dict, Optional, Tuple
+import os
+import pickle
+import shutil
+import gin
+import pandas as pd
+from src.utils.cache import make_key
+
+# bumped when the layout of stored stages changes, invalidates every existing checkpoint
+CHECKPOINT_VERSION = 1
+
+
+def fingerprint(*parts: Any) -> str:
+    """Content fingerprint of a stage input: upstream fingerprints, data hashes and config"""
+    return make_key(CHECKPOINT_VERSION, *parts)
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    return make_key(list(df.columns), pd.util.hash_pandas_object(df, index=True).values.tobytes().hex())
+
+
+def describe_configurable(configurable, module: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """Name and gin bindings of a configurable, the part of its config a fingerprint depends on"""
+    name = configurable.__name__
+    try:
+        bindings = gin.get_bindings(f"{module}.{name}" if module else name)
+    except ValueError:
+        bindings = {}
+    return name, bindings
+
+
+class CheckpointStore:
+    """Pickled stage outputs and columns, each stored with the fingerprint of the inputs it was computed from"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.pkl")
+
+    def column_path(self, stage: str, column: str) -> str:
+        # column names may contain path separators (e.g. Stylometrix/original_text), files are named by their hash
+        return os.path.join(self.directory, stage, f"{make_key(column)}.pkl")
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f"Couldn't read checkpoint {path}: {e}")
+            return None
+
+    @staticmethod
+    def _write(path: str, payload: dict) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated checkpoint behind
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    def load(self, stage: str, stage_fingerprint: str) -> Optional[Any]:
+        payload = self._read(self.path(stage))
+        if payload is None or payload.get('fingerprint') != stage_fingerprint:
+            return None
+        return payload['data']
+
+    def save(self, stage: str, stage_fingerprint: str, data: Any) -> None:
+        self._write(self.path(stage), {'fingerprint': stage_fingerprint, 'data': data})
+
+    def load_columns(self, stage: str) -> Dict[str, Tuple[str, Any]]:
+        """Every stored column of a stage as `{name: (fingerprint, values)}`"""
+        directory = os.path.join(self.directory, stage)
+        if not os.path.isdir(directory):
+            return {}
+        columns = {}
+        for file in sorted(os.listdir(directory)):
+            if not file.endswith('.pkl'):
+                continue
+            payload = self._read(os.path.join(directory, file))
+            if payload is not None:
+                columns[payload['column']] = (payload['fingerprint'], payload['data'])
+        return columns
+
+    def save_column(self, stage: str, column: str, column_fingerprint: str, data: Any) -> None:
+        self._write(self.column_path(stage, column), {'column': column, 'fingerprint': column_fingerprint,
+                                                      'data': data})
+
+    def clear(self, stage: str) -> None:
+        if os.path.exists(self.path(stage)):
+            os.remove(self.path(stage))
+        if os.path.isdir(os.path.join(self.directory, stage)):
+            shutil.rmtree(os.path.join(self.directory, stage))
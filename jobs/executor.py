@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import multiprocessing
+import gin
+import src.attacks
+from src.attacks import Attack
+
+# attacks constructed by the initializer of a worker process, keyed by attack name
+_worker_attacks: Dict[str, Attack] = {}
+
+
+def make_attack(attack_class: type, seed: Optional[int] = None) -> Attack:
+    """Constructs an attack, stochastic attacks without a seed of their own get the given one"""
+    attack = attack_class()
+    if attack.seed is None:
+        attack.seed = seed
+    return attack
+
+
+def _init_worker(gin_config: str, attack_names: Sequence[str], seed: Optional[int]) -> None:
+    # spawned workers start with an empty gin config, bindings of configurables other than the attacks are skipped
+    gin.parse_config(gin_config, skip_unknown=True)
+    for attack_name in attack_names:
+        _worker_attacks[attack_name] = make_attack(getattr(src.attacks, attack_name), seed)
+
+
+def _run_worker_chunk(attack_name: str, documents: List[List[str]], keys: List[Any]) -> List[Tuple[str, int]]:
+    return _worker_attacks[attack_name].attack_batch(documents, keys)
+
+
+class AttackExecutor:
+    """Runs parallelizable attacks on a pool of spawned worker processes.
+
+    Every worker parses the gin config of the parent and constructs the attacks once in its initializer, with `seed`
+    for attacks without a seed of their own. Attacks are looked up by name in `src.attacks`, where every attack is
+    registered.
+    Documents are sent in chunks of `chunk_size` together with their keys, chunks of all submitted attacks share the
+    pool so independent attacks run concurrently. Seeded attacks draw from per-document generators, so results do
+    not depend on the number of workers.
+    """
+
+    def __init__(self, attack_classes: Sequence[type], n_workers: int, chunk_size: int = 256,
+                 seed: Optional[int] = None):
+        self.chunk_size = chunk_size
+        # spawn instead of fork, forking a process that runs threads (e.g. of tokenizers or torch) can deadlock
+        context = multiprocessing.get_context('spawn')
+        attack_names = [attack_class.__name__ for attack_class in attack_classes]
+        self.pool = context.Pool(n_workers, initializer=_init_worker, initargs=(gin.config_str(), attack_names, seed))
+
+    def submit(self, attack_name: str, documents: List[List[str]], keys: List[Any]) -> list:
+        return [self.pool.apply_async(_run_worker_chunk, (attack_name, documents[start:start + self.chunk_size],
+                                                          keys[start:start + self.chunk_size]))
+                for start in range(0, len(documents), self.chunk_size)]
+
+    @staticmethod
+    def gather(handle: list) -> List[Tuple[str, int]]:
+        results = []
+        for chunk in handle:
+            results.extend(chunk.get())
+        return results
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            self.pool.terminate()
+        self.close()
@@ -1,24 +1,40 @@
 import os
 from jobs import Job
+from jobs.executor import AttackExecutor, make_attack
+from jobs.checkpoint import CheckpointStore, describe_configurable, fingerprint, frame_fingerprint
+from jobs.profiling import StageProfiler, StageRecord
+from jobs.result_store import ResultStore
 import gin
+import spacy
 from src.attacks import Attack
-from src.data_preparation.preprocess import clean_text, get_sentences, text_normalization
+from src.attacks.cache import AttackCache
+from src.data_preparation.preprocess import SENTENCE_MODEL, clean_texts, pipe_sentences, text_normalization
 from src.metrics import MetricOriginalTextToSummary, MetricSummarytoSummary
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 import pandas as pd
-from src.data_preparation.dataset_loading import dataset_loading
+from src.data_preparation.dataset_loading import dataset_split_loading
 from src.summarization import Summarizer
-import time
-import openai
+from src.summarization.async_engine import AsyncSummarizationEngine
+from src.utils.cache import text_hash
+from src.utils.model_registry import model_registry
 from scipy.stats import mannwhitneyu, ks_2samp
 
 
 @gin.configurable
 class FullPipeline(Job):
+    """Runs the load, clean, segment, attack, summarize, metric and analyze stages, checkpointing each one"""
 
     def __init__(self, attacks: List[Attack], metrics_sum: List[MetricSummarytoSummary],
             metrics_org: List[MetricOriginalTextToSummary], produce_summaries: bool,
-            summarizer: Summarizer, output_dir: str, stylometrix_path: str) -> None:
+            summarizer: Summarizer, output_dir: str, stylometrix_path: str, max_models: int = None,
+            segmentation_batch_size: int = 64, segmentation_n_process: int = 1,
+            attack_chunk_size: int = 256, attack_cache_path: str = None, attack_cache_max_size: int = None,
+            summarization_concurrency: int = 8, requests_per_minute: int = 3500, tokens_per_minute: int = 90000,
+            summarization_timeout: float = 60.0, summarization_max_retries: int = 6,
+            summarization_chunk_size: int = 64, checkpoint_dir: str = None, chunk_size: int = None,
+            output_format: str = 'csv', parquet_compression: str = 'zstd', cleaning_n_process: int = 1,
+            attack_workers: int = 1, attack_seed: int = None, run_analysis: bool = True,
+            preparation_checkpoint_dir: str = None, profiler: str = None) -> None:
         self.name = 'Full Pipeline'
         self.attacks = attacks
         self.metrics_sum = metrics_sum
@@ -27,9 +43,51 @@ class FullPipeline(Job):
         self.output_dir = output_dir
         self.summarizer = summarizer
         self.stylometrix_path = stylometrix_path
+        self.max_models = max_models
+        self.segmentation_batch_size = segmentation_batch_size
+        self.segmentation_n_process = segmentation_n_process
+        self.attack_chunk_size = attack_chunk_size
+        self.attack_cache_path = attack_cache_path
+        self.attack_cache_max_size = attack_cache_max_size
+        self.summarization_concurrency = summarization_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.summarization_timeout = summarization_timeout
+        self.summarization_max_retries = summarization_max_retries
+        self.summarization_chunk_size = summarization_chunk_size
+        self.cleaning_n_process = cleaning_n_process
+        self.attack_workers = attack_workers
+        self.attack_seed = attack_seed
+        self.run_analysis = run_analysis
+        if checkpoint_dir is None:
+            checkpoint_dir = os.path.splitext(output_dir)[0] + "_checkpoints"
+        self.checkpoint_dir = checkpoint_dir
+        self.preparation_checkpoint_dir = preparation_checkpoint_dir or checkpoint_dir
+        self.chunk_size = chunk_size
+        if output_format not in ('csv', 'parquet'):
+            raise ValueError(f"Unknown output format {output_format}, expected 'csv' or 'parquet'")
+        self.output_format = output_format
+        self.results = None
+        if output_format == 'parquet':
+            self.results = ResultStore(os.path.splitext(output_dir)[0], compression=parquet_compression)
+        self.part = 0
+        self.checkpoints = None
+        self.preparation_checkpoints = None
+        self.stylometrix_dir = stylometrix_path
+        self.instances = {}
+        self.attack_cache = None
+        self.engine = None
+        self.executor = None
+        # set by run, `analyze` takes it to run a skipped analysis later
+        self.metric_fingerprint = None
+        self.profiler = profiler
+        self.profile_dir = os.path.splitext(output_dir)[0] + "_profile"
+        self.stage_profiler = StageProfiler(profiler, self.profile_dir)
 
     def run(self):
 
+        model_registry.set_max_models(self.max_models)
+
         print("Running attacks...")
         if self.attacks is None:
             self.attacks = []
@@ -41,139 +99,623 @@ class FullPipeline(Job):
             self.metrics_org = []
         print(f"Metrics: {' '.join(metric.__name__ for metric in self.metrics_org)} ")
 
-        attacks = list(map(lambda x: x(), self.attacks))
-        metrics_sum = list(map(lambda x: x(), self.metrics_sum))
-        metrics_org = list(map(lambda x: x(), self.metrics_org))
+        self.instances = {}
+        self.engine = None
+        self.executor = None
+        self.attack_cache = None
+        if self.attack_cache_path is not None:
+            self.attack_cache = AttackCache(self.attack_cache_path, max_size_bytes=self.attack_cache_max_size)
+
+        self.stage_profiler = StageProfiler(self.profiler, self.profile_dir)
+        try:
+            self.run_stages()
+        finally:
+            # a failed run still reports the stages it went through
+            self.write_profile()
+
+    def run_stages(self) -> None:
+        try:
+            if self.chunk_size is None:
+                self.checkpoints = CheckpointStore(self.checkpoint_dir)
+                self.preparation_checkpoints = CheckpointStore(self.preparation_checkpoint_dir)
+                self.part = 0
+                train, load_fingerprint = self.load_stage()
+                metric_fingerprint = self.process(train, load_fingerprint, first=True)
+                number_of_parts = 1
+            else:
+                chunk_fingerprints = []
+                for index, train in enumerate(self.iter_chunks()):
+                    print(f"Processing chunk {index} ({len(train)} rows)...")
+                    chunk_dir = os.path.join(self.checkpoint_dir, f"chunk_{index:05d}")
+                    self.checkpoints = CheckpointStore(chunk_dir)
+                    self.preparation_checkpoints = CheckpointStore(
+                        os.path.join(self.preparation_checkpoint_dir, f"chunk_{index:05d}"))
+                    self.part = index
+                    self.stylometrix_dir = os.path.join(chunk_dir, "stylometrix")
+                    # references of other chunks are never looked up again, only the memory bound of a chunk remains
+                    for instance in self.instances.values():
+                        if isinstance(instance, MetricSummarytoSummary):
+                            instance.clear_reference_cache()
+                    chunk_fingerprints.append(self.process(train, frame_fingerprint(train), first=index == 0))
+                    if self.results is None:
+                        self.append_stylometrix(first=index == 0)
+                self.stage_profiler.chunk = None
+                self.checkpoints = CheckpointStore(self.checkpoint_dir)
+                self.stylometrix_dir = self.stylometrix_path
+                metric_fingerprint = fingerprint('chunks', chunk_fingerprints)
+                number_of_parts = len(chunk_fingerprints)
+        finally:
+            if self.executor is not None:
+                self.executor.close()
+                self.executor = None
+
+        if self.results is not None:
+            for table in ('documents', 'results', 'metrics', 'stylometrix'):
+                self.results.prune(table, number_of_parts)
+
+        self.metric_fingerprint = metric_fingerprint
+        if self.run_analysis:
+            self.analyze_stage(metric_fingerprint)
+
+    def prepare(self) -> None:
+        """Runs only loading, cleaning and segmentation, filling the preparation checkpoints for later runs"""
+        if self.chunk_size is None:
+            self.preparation_checkpoints = CheckpointStore(self.preparation_checkpoint_dir)
+            train, load_fingerprint = self.load_stage()
+            df, clean_fingerprint = self.clean_stage(train, load_fingerprint)
+            self.segment_stage(df, clean_fingerprint)
+            return
+        for index, train in enumerate(self.iter_chunks()):
+            print(f"Preparing chunk {index} ({len(train)} rows)...")
+            self.preparation_checkpoints = CheckpointStore(
+                os.path.join(self.preparation_checkpoint_dir, f"chunk_{index:05d}"))
+            df, clean_fingerprint = self.clean_stage(train, frame_fingerprint(train))
+            self.segment_stage(df, clean_fingerprint)
+
+    def analyze(self, metric_fingerprint: str) -> None:
+        """Analyzes results already written to the outputs, e.g. shards merged by a parallel backend"""
+        self.attacks = self.attacks or []
+        self.metrics_sum = self.metrics_sum or []
+        self.metrics_org = self.metrics_org or []
+        self.checkpoints = CheckpointStore(self.checkpoint_dir)
+        self.stage_profiler = StageProfiler(self.profiler, self.profile_dir)
+        try:
+            self.analyze_stage(metric_fingerprint)
+        finally:
+            self.write_profile()
+
+    def write_profile(self) -> None:
+        json_path = self.output_dir.replace(".csv", "_profile.json")
+        os.makedirs(os.path.dirname(json_path) or '.', exist_ok=True)
+        self.stage_profiler.write(json_path, self.output_dir.replace(".csv", "_profile.csv"))
+        print(f"Profile written to {json_path}")
+
+    def process(self, train: pd.DataFrame, load_fingerprint: str, first: bool) -> str:
+        """Runs the stages from cleaning to metrics on the loaded rows and writes their results"""
+        df, clean_fingerprint = self.clean_stage(train, load_fingerprint)
+        segment_fingerprint = self.segment_stage(df, clean_fingerprint)
+        attack_fingerprints = self.attack_stage(df, segment_fingerprint)
+
+        if self.produce_summaries:
+            self.summarize_stage(df, attack_fingerprints)
+        else:
+            print("Skipping summarization...")
+
+        # chunks after the first one are appended to the outputs of the previous ones
+        mode, header = ('w', True) if first else ('a', False)
+        if self.results is None:
+            df.to_csv(self.output_dir, mode=mode, header=header)
+        else:
+            self.write_results(df)
+
+        metric_columns, metric_fingerprint = self.metric_stage(df, attack_fingerprints, clean_fingerprint)
 
-        train, _, _ = dataset_loading()
-        
-        train = pd.DataFrame(train)
+        print("Saving results...")
+
+        # make new df only with metrics
+        df_metrics = df[metric_columns]
+
+        if self.results is None:
+            df_metrics.to_csv(self.output_dir.replace(".csv", "_metrics.csv"), mode=mode, header=header)
+        else:
+            for attack_class in self.attacks:
+                prefix = f"{attack_class.__name__}_"
+                columns = [column for column in metric_columns if column.startswith(prefix)]
+                self.results.write('metrics', df_metrics[columns].rename(columns=lambda column: column[len(prefix):]),
+                                   partition=attack_class.__name__, part=self.part)
+        return metric_fingerprint
+
+    def write_results(self, df: pd.DataFrame) -> None:
+        self.results.write('documents', df[['id', 'text', 'summary', 'sentences']], part=self.part)
+        for attack_class in self.attacks:
+            name = attack_class.__name__
+            columns = {'id': 'id', name: 'text', f"{name}_changes": 'changes', f"{name}_summary": 'summary'}
+            columns = {source: target for source, target in columns.items() if source in df.columns}
+            self.results.write('results', df[list(columns)].rename(columns=columns), partition=name, part=self.part)
+
+    def instance(self, configurable):
+        """Constructs a configured attack, summarizer or metric once per run, chunks share the instance"""
+        if configurable not in self.instances:
+            self.instances[configurable] = configurable()
+        return self.instances[configurable]
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        with self.stage_profiler.stage('load'):
+            train = dataset_split_loading()
+        columns = ['article', 'highlights', 'id']
+        start = 0
+        if hasattr(train, 'iter'):
+            # datasets are memory-mapped Arrow tables, only the current chunk is materialized
+            batches = train.iter(batch_size=self.chunk_size)
+        else:
+            train = pd.DataFrame(train)
+            batches = (train.iloc[offset:offset + self.chunk_size]
+                       for offset in range(0, len(train), self.chunk_size))
+        for index, batch in enumerate(batches):
+            self.stage_profiler.chunk = index
+            with self.stage_profiler.stage('load') as record:
+                chunk = pd.DataFrame({column: list(batch[column]) for column in columns})
+                record.items = len(chunk)
+            chunk.index = range(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+    def append_stylometrix(self, first: bool) -> None:
+        if self.stylometrix_path is None or not os.path.isdir(self.stylometrix_dir):
+            return
+        os.makedirs(self.stylometrix_path, exist_ok=True)
+        for file in sorted(os.listdir(self.stylometrix_dir)):
+            stylo = pd.read_csv(os.path.join(self.stylometrix_dir, file), index_col=0)
+            stylo.to_csv(os.path.join(self.stylometrix_path, file), mode='w' if first else 'a', header=first)
 
+    def load_stage(self) -> Tuple[pd.DataFrame, str]:
         print("Loading dataset...")
+        with self.stage_profiler.stage('load', hook=True) as record:
+            stage_fingerprint = fingerprint('load', describe_configurable(dataset_split_loading))
+            df = self.preparation_checkpoints.load('load', stage_fingerprint)
+            if df is None:
+                train = dataset_split_loading()
+                train = train.to_pandas() if hasattr(train, 'to_pandas') else pd.DataFrame(train)
+                df = train[['article', 'highlights', 'id']].reset_index(drop=True)
+                self.preparation_checkpoints.save('load', stage_fingerprint, df)
+            else:
+                print("Dataset loaded from checkpoint...")
+                record.from_checkpoint = True
+            record.items = len(df)
+        # later stages depend on the content of the dataset, not on how it was loaded
+        return df, frame_fingerprint(df)
 
-        df = pd.DataFrame()
-        df['text'] = train['article'].apply(clean_text)
-        df['summary'] = train['highlights']
-        df['id'] = train['id']
-        df['text'] = train['text'].apply(text_normalization)
+    def clean_stage(self, train: pd.DataFrame, load_fingerprint: str) -> Tuple[pd.DataFrame, str]:
+        print("Cleaning texts...")
+        with self.stage_profiler.stage('clean', items=len(train), hook=True) as record:
+            stage_fingerprint = fingerprint('clean', load_fingerprint)
+            df = self.preparation_checkpoints.load('clean', stage_fingerprint)
+            if df is None:
+                df = pd.DataFrame()
+                df['text'] = pd.Series(clean_texts(train['article'], n_process=self.cleaning_n_process),
+                                       index=train.index)
+                df['summary'] = train['highlights']
+                df['id'] = train['id']
+                df['text'] = df['text'].apply(text_normalization)
+                self.preparation_checkpoints.save('clean', stage_fingerprint, df)
+            else:
+                print("Cleaned texts loaded from checkpoint...")
+                record.from_checkpoint = True
+        return df, stage_fingerprint
 
-        df['sentences'] = df['text'].apply(lambda x: get_sentences(x))
+    def segment_stage(self, df: pd.DataFrame, clean_fingerprint: str) -> str:
+        print("Splitting sentences...")
+        with self.stage_profiler.stage('segment', items=len(df), hook=True) as record:
+            stage_fingerprint = fingerprint('segment', clean_fingerprint, SENTENCE_MODEL, spacy.__version__)
+            sentences = self.preparation_checkpoints.load('segment', stage_fingerprint)
+            if sentences is None:
+                sentences = list(pipe_sentences(df['text'], batch_size=self.segmentation_batch_size,
+                                                n_process=self.segmentation_n_process))
+                self.preparation_checkpoints.save('segment', stage_fingerprint, sentences)
+            else:
+                print("Sentences loaded from checkpoint...")
+                record.from_checkpoint = True
+        df['sentences'] = sentences
+        return stage_fingerprint
 
+    def attack_stage(self, df: pd.DataFrame, segment_fingerprint: str) -> Dict[str, str]:
         print("Running attacks...")
+        with self.stage_profiler.stage('attack', items=len(df), hook=True) as stage_record:
+            attack_fingerprints = self.run_attacks(df, segment_fingerprint)
+            stage_record.from_checkpoint = all(record.from_checkpoint for record in self.stage_profiler.records
+                                               if record.stage == 'attack' and record.name is not None
+                                               and record.chunk == stage_record.chunk)
+        return attack_fingerprints
 
-        for attack_ in attacks:
-            print(f"Running attack: {type(attack_).__name__}...")
-            df[type(attack_).__name__] = df['sentences'].apply(lambda x: attack_(x))
+    def run_attacks(self, df: pd.DataFrame, segment_fingerprint: str) -> Dict[str, str]:
+        stored = self.checkpoints.load_columns('attack')
+        attack_cache = self.attack_cache
+        profiler = self.stage_profiler
 
-        if self.produce_summaries:
-            self.summarizer = self.summarizer()
-            print("Producing summarization...")
-            for attack_ in attacks:
-                print(f"Producing summarization for attack: {type(attack_).__name__}...")
-                # add waiting until rate limit resets (one minute) and retry your request
-                for index, row in df.iterrows():
+        documents = df['sentences'].tolist()
+        # stochastic attacks draw from a generator per document key, results do not depend on chunking or workers
+        keys = df['id'].tolist()
+        attack_fingerprints = {}
+        pending = {}
+        for attack_class in self.attacks:
+            name = attack_class.__name__
+            column_fingerprint = fingerprint('attack', segment_fingerprint,
+                                             describe_configurable(attack_class, 'attacks'),
+                                             None if attack_class.deterministic else self.attack_seed)
+            attack_fingerprints[name] = column_fingerprint
+            if name in stored and stored[name][0] == column_fingerprint:
+                print(f"Attack {name} is up to date, skipping...")
+                profiler.record('attack', name).from_checkpoint = True
+            else:
+                pending[name] = attack_class
+
+        # parallelizable attacks are sent to the worker pool first, they run while the other attacks run here
+        submitted = {}
+        if self.attack_workers > 1:
+            for name, attack_class in pending.items():
+                if attack_class.parallelizable:
+                    print(f"Submitting attack to {self.attack_workers} workers: {name}...")
+                    with profiler.stage('attack', name, items=len(documents)) as record:
+                        hits, misses = self.attack_cache_counts()
+                        submitted[name] = self.submit_attack(attack_class, documents, keys)
+                        self.count_attack_cache(record, hits, misses)
+
+        for name, attack_class in pending.items():
+            if name in submitted:
+                continue
+            print(f"Running attack: {name}...")
+            with profiler.stage('attack', name, items=len(documents)) as record:
+                hits, misses = self.attack_cache_counts()
+                attack_ = self.attack_instance(attack_class)
+                results = []
+                for start in range(0, len(documents), self.attack_chunk_size):
+                    chunk = documents[start:start + self.attack_chunk_size]
+                    chunk_keys = keys[start:start + self.attack_chunk_size]
+                    if attack_cache is not None:
+                        results.extend(attack_cache.attack_batch(attack_, chunk, chunk_keys))
+                    else:
+                        results.extend(attack_.attack_batch(chunk, chunk_keys))
+                self.count_attack_cache(record, hits, misses)
+            stored[name] = (attack_fingerprints[name], results)
+            self.checkpoints.save_column('attack', name, attack_fingerprints[name], results)
+
+        for name, (lookup, handle) in submitted.items():
+            print(f"Collecting attack: {name}...")
+            # time spent waiting for the workers, they ran while the attacks above were running
+            with profiler.stage('attack', name):
+                results = self.executor.gather(handle)
+                if lookup is not None:
+                    results = attack_cache.merge(*lookup, results)
+            stored[name] = (attack_fingerprints[name], results)
+            self.checkpoints.save_column('attack', name, attack_fingerprints[name], results)
+
+        for attack_class in self.attacks:
+            name = attack_class.__name__
+            results = stored[name][1]
+            df[name] = [text for text, _ in results]
+            df[f"{name}_changes"] = [changes for _, changes in results]
+
+        if attack_cache is not None:
+            print(f"Attack cache: {attack_cache.hits} hits, {attack_cache.misses} misses")
+        return attack_fingerprints
+
+    def attack_cache_counts(self) -> Tuple[int, int]:
+        if self.attack_cache is None:
+            return 0, 0
+        return self.attack_cache.hits, self.attack_cache.misses
+
+    def count_attack_cache(self, record: StageRecord, hits: int, misses: int) -> None:
+        """Adds the attack cache lookups made since `attack_cache_counts` returned `hits` and `misses`"""
+        new_hits, new_misses = self.attack_cache_counts()
+        record.count('cache_hits', new_hits - hits)
+        record.count('cache_misses', new_misses - misses)
+
+    def submit_attack(self, attack_class, documents: List[List[str]], keys: list):
+        """Sends the documents (only the ones missing from the attack cache) to the worker pool"""
+        if self.executor is None:
+            self.executor = AttackExecutor([attack for attack in self.attacks if attack.parallelizable],
+                                           n_workers=self.attack_workers, chunk_size=self.attack_chunk_size,
+                                           seed=self.attack_seed)
+        lookup = None
+        if self.attack_cache is not None and self.attack_instance(attack_class).is_cacheable():
+            lookup = self.attack_cache.lookup(self.attack_instance(attack_class), documents, keys)
+            documents = [documents[index] for index in lookup[2]]
+            keys = [keys[index] for index in lookup[2]]
+        return lookup, self.executor.submit(attack_class.__name__, documents, keys)
+
+    def attack_instance(self, attack_class) -> Attack:
+        if attack_class not in self.instances:
+            self.instances[attack_class] = make_attack(attack_class, self.attack_seed)
+        return self.instances[attack_class]
+
+    def summarize_stage(self, df: pd.DataFrame, attack_fingerprints: Dict[str, str]) -> None:
+        print("Producing summarization...")
+        with self.stage_profiler.stage('summarize', hook=True) as stage_record:
+            self.summarize_attacks(df, attack_fingerprints)
+            stage_record.from_checkpoint = stage_record.items == 0
+
+    def summarize_attacks(self, df: pd.DataFrame, attack_fingerprints: Dict[str, str]) -> None:
+        stored = self.checkpoints.load_columns('summarize')
+        summarizer_description = describe_configurable(self.summarizer, 'summarizers')
+        summarizer = self.instances.get(self.summarizer)
+        for attack_class in self.attacks:
+            name = attack_class.__name__
+            column_fingerprint = fingerprint('summarize', attack_fingerprints[name], summarizer_description)
+            if name in stored and stored[name][0] == column_fingerprint:
+                summaries = list(stored[name][1])
+            else:
+                summaries = [None] * len(df)
+            # only texts without a summary are sent, failed generations from a previous run are retried
+            missing = [index for index, summary in enumerate(summaries) if summary is None]
+            if not missing:
+                print(f"Summaries for attack {name} are up to date, skipping...")
+                self.stage_profiler.record('summarize', name).from_checkpoint = True
+            else:
+                with self.stage_profiler.stage('summarize', name, items=len(missing)) as record:
+                    if summarizer is None:
+                        summarizer = self.instance(self.summarizer)
+                        if hasattr(summarizer, 'agenerate'):
+                            self.engine = AsyncSummarizationEngine(
+                                summarizer, max_concurrency=self.summarization_concurrency,
+                                requests_per_minute=self.requests_per_minute,
+                                tokens_per_minute=self.tokens_per_minute, timeout=self.summarization_timeout,
+                                max_retries=self.summarization_max_retries)
+                    print(f"Producing summarization for attack: {name} ({len(missing)} texts)...")
+                    counts = self.summarization_counts(summarizer)
+                    texts = df[name].tolist()
+                    generated = self.summarize_texts(summarizer, self.engine, [texts[index] for index in missing])
+                    for counter, value in self.summarization_counts(summarizer).items():
+                        record.count(counter, value - counts[counter])
+                    record.count('failures', sum(summary is None for summary in generated))
+                self.stage_profiler.record('summarize').items += len(missing)
+                for index, summary in zip(missing, generated):
+                    summaries[index] = summary
+                stored[name] = (column_fingerprint, summaries)
+                self.checkpoints.save_column('summarize', name, column_fingerprint, summaries)
+            df[f"{name}_summary"] = summaries
+
+        if self.engine is not None:
+            print(f"Summarization: {self.engine.retries} retries, {self.engine.failures} failures")
+        if summarizer is not None and summarizer.cache is not None:
+            print(f"Summary cache: {summarizer.cache.hits} hits, {summarizer.cache.misses} misses")
+
+    def summarization_counts(self, summarizer: Summarizer) -> Dict[str, int]:
+        """Summary cache lookups and API retries so far, the profile records how much every attack added"""
+        counts = {'cache_hits': 0, 'cache_misses': 0, 'retries': 0}
+        if summarizer.cache is not None:
+            counts['cache_hits'], counts['cache_misses'] = summarizer.cache.hits, summarizer.cache.misses
+        if self.engine is not None:
+            counts['retries'] = self.engine.retries
+        return counts
+
+    def summarize_texts(self, summarizer: Summarizer, engine: Optional[AsyncSummarizationEngine],
+                        texts: List[str]) -> List[Optional[str]]:
+        if engine is not None:
+            return engine.run(texts)
+        summaries = []
+        for start in range(0, len(texts), self.summarization_chunk_size):
+            chunk = texts[start:start + self.summarization_chunk_size]
+            try:
+                summaries.extend(summarizer.summarize_batch(chunk))
+            except Exception as e:
+                print(e)
+                print("Couldn't generate summaries for the chunk, retrying one by one...")
+                for text in chunk:
                     try:
-                        df.loc[index, f"{type(attack_).__name__}_summary"] = self.summarizer.generate_summary(
-                            text=row[f"{type(attack_).__name__}"])
-                    except openai.error.RateLimitError as e:
-                        print(e)
-                        print("Waiting for rate limit to reset...")
-                        time.sleep(60)
-                        print("Retrying...")
-                        df.loc[index, f"{type(attack_).__name__}_summary"] = self.summarizer.generate_summary(
-                                text=row[f"{type(attack_).__name__}"])
+                        summaries.append(summarizer.summarize(text=text))
                     except Exception as e:
                         print(e)
                         print("Couldn't generate summary...")
-                        df.loc[index, f"{type(attack_).__name__}_summary"] = None
-        else:
-            print("Skipping summarization...")
-
-        df.to_csv(self.output_dir)
+                        summaries.append(None)
+        return summaries
 
+    def metric_stage(self, df: pd.DataFrame, attack_fingerprints: Dict[str, str],
+                     clean_fingerprint: str) -> Tuple[List[str], str]:
         print("Computing metrics...")
-        for metric in metrics_sum:
-            print(f"Computing metric: {type(metric).__name__}...")
-            for attack_ in attacks:
-                df[f"{type(attack_).__name__}_{type(metric).__name__}"] = df.apply(
-                    lambda x: metric.compute(x[f"{type(attack_).__name__}_summary"], x['NoAttack_summary']), axis=1)
-
-        original_text_stylo = False
-        for metric in metrics_org:
-            print(f"Computing metric: {type(metric).__name__}...")
-            for attack_ in attacks:
-                if type(metric).__name__ == "Stylometrix":
-                    if self.stylometrix_path is None:
-                        raise ValueError("Stylometrix path is None!")
-                    if not original_text_stylo:
-                        print("Computing stylometrix for original text...")
-                        original_text_stylo = True
-                        stylo = metric.compute(df['text'])
-                        stylo.to_csv(self.stylometrix_path + "original_text.csv")
-                    stylo = metric.compute(df[f"{type(attack_).__name__}_summary"])
-                    stylo.to_csv(f"{self.stylometrix_path}/{type(attack_).__name__}_summary.csv")
+        with self.stage_profiler.stage('metric', hook=True) as stage_record:
+            metric_columns, metric_fingerprint = self.compute_metrics(df, attack_fingerprints, clean_fingerprint)
+            stage_record.from_checkpoint = stage_record.items == 0
+        return metric_columns, metric_fingerprint
 
-                else:
-                    df[f"{type(attack_).__name__}_{type(metric).__name__}"] = df.apply(
-                        lambda x: metric.compute(x[f"{type(attack_).__name__}"], x['text']), axis=1)
+    def compute_metrics(self, df: pd.DataFrame, attack_fingerprints: Dict[str, str],
+                        clean_fingerprint: str) -> Tuple[List[str], str]:
+        stored = self.checkpoints.load_columns('metric')
+        stage_record = self.stage_profiler.record('metric')
+        metric_columns = []
+        column_fingerprints = []
 
-        print("Saving results...")
+        # metrics depend on the summaries themselves, a retried summary invalidates the scores computed from it
+        summary_fingerprints = {}
+        if self.metrics_sum or any(metric.__name__ == "Stylometrix" for metric in self.metrics_org):
+            summary_fingerprints = {attack_class.__name__: text_hash(df[f"{attack_class.__name__}_summary"].tolist())
+                                    for attack_class in self.attacks}
 
-        # make new df only with metrics
-        df_metrics = pd.DataFrame()
-        for attack_ in attacks:
-            for metric in metrics_sum:
-                df_metrics[f"{type(attack_).__name__}_{type(metric).__name__}"] = df[f"{type(attack_).__name__}_{type(metric).__name__}"]
-            for metric in metrics_org:
-                if type(metric).__name__ == "Stylometrix":
-                    continue
+        def store(key: str, column_fingerprint: str, columns: Dict[str, list]) -> None:
+            stored[key] = (column_fingerprint, columns)
+            self.checkpoints.save_column('metric', key, column_fingerprint, columns)
+
+        for metric_class in self.metrics_sum:
+            metric_name = metric_class.__name__
+            print(f"Computing metric: {metric_name}...")
+            description = describe_configurable(metric_class, 'metrics')
+            metric = None
+            with self.stage_profiler.stage('metric', metric_name) as record:
+                pending = []
+                for attack_class in self.attacks:
+                    name = attack_class.__name__
+                    column = f"{name}_{metric_name}"
+                    column_fingerprint = fingerprint('metric', description, summary_fingerprints[name],
+                                                     summary_fingerprints['NoAttack'])
+                    if column not in stored or stored[column][0] != column_fingerprint:
+                        pending.append((name, column, column_fingerprint))
+                    column_fingerprints.append(column_fingerprint)
+                if pending:
+                    metric = self.instance(metric_class)
+                    scores = {column: [] for _, column, _ in pending}
+                    references = df['NoAttack_summary'].tolist()
+                    batch_size = getattr(metric, 'batch_size', None) or max(len(df), 1)
+                    # every attack is compared against the same NoAttack references, a batch of references is
+                    # represented once for all attacks and only one batch of representations is held at a time
+                    for start in range(0, len(df), batch_size):
+                        batch_references = references[start:start + batch_size]
+                        reference_representations = metric.prepare_references(batch_references)
+                        for name, column, _ in pending:
+                            batch_scores = metric.compute_batch(
+                                df[f"{name}_summary"].iloc[start:start + batch_size].tolist(), batch_references,
+                                reference_representations)
+                            record.items += len(batch_references)
+                            # metrics returning several variants (e.g. RougeScore) get one column per variant
+                            if isinstance(batch_scores, dict):
+                                if not scores[column]:
+                                    scores[column] = {f"{column}_{variant}": [] for variant in batch_scores}
+                                for variant, values in batch_scores.items():
+                                    scores[column][f"{column}_{variant}"].extend(values)
+                            else:
+                                scores[column].extend(batch_scores)
+                    for _, column, column_fingerprint in pending:
+                        columns = scores[column] if isinstance(scores[column], dict) else {column: scores[column]}
+                        store(column, column_fingerprint, columns)
+                for attack_class in self.attacks:
+                    for column_name, values in stored[f"{attack_class.__name__}_{metric_name}"][1].items():
+                        df[column_name] = values
+                        metric_columns.append(column_name)
+                record.from_checkpoint = metric is None
+            stage_record.items += record.items
+
+        for metric_class in self.metrics_org:
+            metric_name = metric_class.__name__
+            print(f"Computing metric: {metric_name}...")
+            description = describe_configurable(metric_class, 'metrics')
+            metric = None
+            with self.stage_profiler.stage('metric', metric_name) as record:
+                if metric_name == "Stylometrix":
+                    if self.stylometrix_path is None and self.results is None:
+                        raise ValueError("Stylometrix path is None!")
+                    if self.results is None:
+                        os.makedirs(self.stylometrix_dir, exist_ok=True)
+                    targets = [('original_text', 'text', clean_fingerprint)]
+                    targets += [(f"{attack_class.__name__}_summary", f"{attack_class.__name__}_summary",
+                                 summary_fingerprints[attack_class.__name__]) for attack_class in self.attacks]
+                    for file_name, source_column, source_fingerprint in targets:
+                        key = f"{metric_name}/{file_name}"
+                        if self.results is None:
+                            path = os.path.join(self.stylometrix_dir, f"{file_name}.csv")
+                        else:
+                            path = self.results.part_path('stylometrix', file_name, self.part)
+                        column_fingerprint = fingerprint('stylometrix', description, source_fingerprint)
+                        column_fingerprints.append(column_fingerprint)
+                        if key in stored and stored[key][0] == column_fingerprint and os.path.exists(path):
+                            continue
+                        if metric is None:
+                            metric = self.instance(metric_class)
+                        print(f"Computing stylometrix for {file_name}...")
+                        stylo = metric.compute(df[source_column])
+                        record.items += len(df)
+                        stylo.index = df.index
+                        if self.results is None:
+                            stylo.to_csv(path)
+                        else:
+                            self.results.write('stylometrix', stylo, partition=file_name, part=self.part)
+                        store(key, column_fingerprint, {})
                 else:
-                    df_metrics[f"{type(attack_).__name__}_{type(metric).__name__}"] = df[f"{type(attack_).__name__}_{type(metric).__name__}"]
+                    for attack_class in self.attacks:
+                        name = attack_class.__name__
+                        column = f"{name}_{metric_name}"
+                        column_fingerprint = fingerprint('metric', description, attack_fingerprints[name],
+                                                         clean_fingerprint)
+                        if column not in stored or stored[column][0] != column_fingerprint:
+                            if metric is None:
+                                metric = self.instance(metric_class)
+                            store(column, column_fingerprint,
+                                  {column: metric.compute_batch(df[name].tolist(), df['text'].tolist())})
+                            record.items += len(df)
+                        df[column] = stored[column][1][column]
+                        metric_columns.append(column)
+                        column_fingerprints.append(column_fingerprint)
+                record.from_checkpoint = metric is None
+            stage_record.items += record.items
+
+        return metric_columns, fingerprint('metrics', column_fingerprints)
+
+    def stylometrix_columns(self, name: str) -> Optional[List[str]]:
+        if self.results is not None:
+            return self.results.columns('stylometrix', name) or None
+        path = os.path.join(self.stylometrix_path or "", f"{name}.csv")
+        if self.stylometrix_path is None or not os.path.exists(path):
+            return None
+        return pd.read_csv(path, nrows=0).columns.tolist()
 
-        df_metrics.to_csv(self.output_dir.replace(".csv", "_metrics.csv"))
+    def read_stylometrix(self, name: str, columns: List[str]) -> Optional[pd.DataFrame]:
+        """Reads only the given Stylometrix features of a summary column, None when they were not computed"""
+        if self.results is not None:
+            if not self.results.parts('stylometrix', name):
+                return None
+            return self.results.read('stylometrix', name, columns=columns)
+        path = os.path.join(self.stylometrix_path, f"{name}.csv")
+        if not os.path.exists(path):
+            return None
+        return pd.read_csv(path, usecols=columns)
+
+    def analyze_stage(self, metric_fingerprint: str) -> None:
+        with self.stage_profiler.stage('analyze', hook=True) as record:
+            record.from_checkpoint = self.analyze_results(metric_fingerprint)
+
+    def analyze_results(self, metric_fingerprint: str) -> bool:
+        """Writes the report, returns True when an up to date report was already there"""
+        raport_path = self.output_dir.replace(".csv", "_raport.txt")
+        stage_fingerprint = fingerprint('analyze', metric_fingerprint,
+                                        [attack.__name__ for attack in self.attacks],
+                                        [metric.__name__ for metric in self.metrics_sum + self.metrics_org])
+        if self.checkpoints.load('analyze', stage_fingerprint) is not None and os.path.exists(raport_path):
+            print("Analysis is up to date, skipping...")
+            return True
 
         raport_info = []
 
         # analyzing results
         print("Analyzing results...")
         # we want to do statistical analysis for each stylometrix feature with respect to NoAttack
-        files = os.listdir(self.stylometrix_path)
-        reference_stylo = pd.read_csv(self.stylometrix_path + "/NoAttack_summary.csv")
-        ommit_columns = ['text']
-        columns = [column for column in reference_stylo.columns if column not in ommit_columns]
-        for file in files:
-            if file in ['NoAttack_summary.csv', 'original_text.csv']:
-                continue
-            df = pd.read_csv(self.stylometrix_path + "/" + file)
-            for column in columns:
-                U1, p = mannwhitneyu(reference_stylo[column], df[column])
-                if p < 0.05:
-                    raport_info.append(f"{file} {column} is statistically different from NoAttack (Mann-Whitney U "
-                                       f"test, p={p})")
-
-                U1, p = ks_2samp(reference_stylo[column], df[column])
-                if p < 0.05:
-                    raport_info.append(f"{file} {column} is statistically different from NoAttack (Kolmogorov-Smirnov "
-                                       f"test, p={p})")
+        columns = self.stylometrix_columns("NoAttack_summary")
+        if columns is not None:
+            ommit_columns = ['text']
+            columns = [column for column in columns if column not in ommit_columns]
+            reference_stylo = self.read_stylometrix("NoAttack_summary", columns)
+            for attack in self.attacks:
+                file = f"{attack.__name__}_summary"
+                if file == 'NoAttack_summary':
+                    continue
+                df = self.read_stylometrix(file, columns)
+                if df is None:
+                    continue
+                for column in columns:
+                    U1, p = mannwhitneyu(reference_stylo[column], df[column])
+                    if p < 0.05:
+                        raport_info.append(f"{file} {column} is statistically different from NoAttack (Mann-Whitney "
+                                           f"U test, p={p})")
+
+                    U1, p = ks_2samp(reference_stylo[column], df[column])
+                    if p < 0.05:
+                        raport_info.append(f"{file} {column} is statistically different from NoAttack "
+                                           f"(Kolmogorov-Smirnov test, p={p})")
 
         # create raport
-        with open(self.output_dir.replace(".csv", "_raport.txt"), "w") as f:
+        with open(raport_path, "w") as f:
             f.write("Raport\n")
             f.write("======\n\n")
             f.write("Attacks:\n")
-            for attack in attacks:
-                f.write(f"{type(attack).__name__}\n")
-            f.write("\n")       
-            df['text'] = train['article'].apply(clean_text)
-            df['summary'] = train['highlights']
-            df['id'] = train['id']
+            for attack in self.attacks:
+                f.write(f"{attack.__name__}\n")
+            f.write("\n")
             f.write("Metrics:\n")
-            for metric in metrics_sum:
-                f.write(f"{type(metric).__name__}\n")
-            for metric in metrics_org:
-                f.write(f"{type(metric).__name__}\n")
+            for metric in self.metrics_sum:
+                f.write(f"{metric.__name__}\n")
+            for metric in self.metrics_org:
+                f.write(f"{metric.__name__}\n")
             f.write("\n")
             f.write("Results:\n")
             f.write("--------\n\n")
             for info in raport_info:
                 f.write(info + "\n")
+
+        self.checkpoints.save('analyze', stage_fingerprint, raport_info)
+        return False
@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+import csv
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # not available on Windows, memory is not reported there
+    resource = None
+
+# profilers that can be attached to every stage of a run
+PROFILERS = ('cprofile', 'pyinstrument')
+# counters reported as their own columns, `<name>_hits`/`<name>_misses` pairs also get a hit rate
+COUNTERS = ('cache_hits', 'cache_misses', 'retries', 'failures')
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the process so far in MiB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def hit_rate(hits: int, misses: int) -> Optional[float]:
+    lookups = hits + misses
+    return hits / lookups if lookups else None
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one stage (or of one attack, summarizer or metric inside it) on one chunk.
+
+    `cpu_time` counts the threads of this process only, work done by worker processes shows up as wall time.
+    `process_peak_rss_mb` is the peak RSS of the whole process so far (ru_maxrss) when the stage ended, not a peak of
+    the stage, `rss_growth_mb` is how much the stage raised it.
+    """
+    stage: str
+    name: Optional[str] = None
+    chunk: Optional[int] = None
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    items: int = 0
+    process_peak_rss_mb: Optional[float] = None
+    rss_growth_mb: Optional[float] = None
+    from_checkpoint: bool = False
+    counters: Dict[str, int] = field(default_factory=dict)
+
+    def count(self, counter: str, value: int) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @property
+    def items_per_second(self) -> Optional[float]:
+        return self.items / self.wall_time if self.items and self.wall_time > 0 else None
+
+    def row(self) -> Dict[str, Any]:
+        row = {'stage': self.stage, 'name': self.name, 'chunk': self.chunk, 'wall_time': self.wall_time,
+               'cpu_time': self.cpu_time, 'items': self.items, 'items_per_second': self.items_per_second,
+               'process_peak_rss_mb': self.process_peak_rss_mb, 'rss_growth_mb': self.rss_growth_mb,
+               'from_checkpoint': self.from_checkpoint}
+        row.update({counter: self.counters.get(counter, 0) for counter in COUNTERS})
+        row.update(self.counters)
+        row['cache_hit_rate'] = hit_rate(row['cache_hits'], row['cache_misses'])
+        return row
+
+
+class StageProfiler:
+    """Records wall time, CPU time, memory, throughput and counters of pipeline stages.
+
+    Stages are measured with the `stage` context manager, entering the same stage twice on the same chunk adds to
+    its record. With `profiler` set to 'cprofile' or 'pyinstrument', stages entered with `hook=True` are also
+    profiled, every one to its own file in `profile_dir`.
+    """
+
+    def __init__(self, profiler: Optional[str] = None, profile_dir: Optional[str] = None):
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+        if profiler is not None and profile_dir is None:
+            raise ValueError("A profiler needs a directory for its output")
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.records: List[StageRecord] = []
+        self.chunk = None
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+
+    def record(self, stage: str, name: Optional[str] = None) -> StageRecord:
+        for record in self.records:
+            if (record.stage, record.name, record.chunk) == (stage, name, self.chunk):
+                return record
+        record = StageRecord(stage, name, self.chunk)
+        self.records.append(record)
+        return record
+
+    @contextmanager
+    def stage(self, stage: str, name: Optional[str] = None, items: int = 0,
+              hook: bool = False) -> Iterator[StageRecord]:
+        record = self.record(stage, name)
+        record.items += items
+        rss_before = peak_rss_mb()
+        profiler = self.start_profiler() if hook and self.profiler is not None else None
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_time += time.perf_counter() - wall_time
+            record.cpu_time += time.process_time() - cpu_time
+            if profiler is not None:
+                self.stop_profiler(profiler, record)
+            record.process_peak_rss_mb = peak_rss_mb()
+            if rss_before is not None:
+                record.rss_growth_mb = (record.rss_growth_mb or 0.0) + record.process_peak_rss_mb - rss_before
+
+    def start_profiler(self):
+        if self.profiler == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        return profiler
+
+    def stop_profiler(self, profiler, record: StageRecord) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        file_name = record.stage if record.chunk is None else f"{record.stage}_chunk_{record.chunk:05d}"
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            # a stage entered again on the same chunk overwrites its previous profile
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{file_name}.prof"))
+        else:
+            profiler.stop()
+            with open(os.path.join(self.profile_dir, f"{file_name}.html"), "w") as f:
+                f.write(profiler.output_html())
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals of the run and the records of every stage summed over chunks"""
+        totals = {}
+        for record in self.records:
+            key = (record.stage, record.name)
+            if key not in totals:
+                totals[key] = StageRecord(record.stage, record.name, from_checkpoint=True)
+            total = totals[key]
+            total.wall_time += record.wall_time
+            total.cpu_time += record.cpu_time
+            total.items += record.items
+            total.from_checkpoint = total.from_checkpoint and record.from_checkpoint
+            if record.process_peak_rss_mb is not None:
+                total.process_peak_rss_mb = max(total.process_peak_rss_mb or 0.0, record.process_peak_rss_mb)
+                total.rss_growth_mb = (total.rss_growth_mb or 0.0) + record.rss_growth_mb
+            for counter, value in record.counters.items():
+                total.count(counter, value)
+        return {
+            'wall_time': time.perf_counter() - self.start_wall_time,
+            'cpu_time': time.process_time() - self.start_cpu_time,
+            'process_peak_rss_mb': peak_rss_mb(),
+            'stages': [{key: value for key, value in total.row().items() if key != 'chunk'}
+                       for total in totals.values()],
+        }
+
+    def write(self, json_path: str, csv_path: str) -> None:
+        """Writes the summary as JSON and the record of every stage and chunk as CSV"""
+        with open(json_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        rows = [record.row() for record in self.records]
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        with open(csv_path, "w", newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,91 @@
+from typing import List, Optional
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def flatten_dict_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Splits columns holding dicts (e.g. NovelNGrams counts per n) into one column per key"""
+    flat = {}
+    for column in df.columns:
+        values = df[column]
+        # NaN is the only value not equal to itself, lists read back from Parquet are arrays and compare elementwise
+        first = next((value for value in values
+                      if value is not None and not (isinstance(value, float) and value != value)), None)
+        if isinstance(first, dict):
+            for key in first:
+                flat[f"{column}_{key}"] = [value.get(key) if isinstance(value, dict) else None for value in values]
+        else:
+            flat[column] = values
+    return pd.DataFrame(flat, index=df.index)
+
+
+class ResultStore:
+    """Pipeline results stored as compressed Parquet tables partitioned by attack.
+
+    Every table lives in its own directory with one `attack=<name>` subdirectory per partition. A write adds one part
+    file, so chunks of a streaming run are appended as new parts and rewriting a part replaces it. Reads go through
+    memory mapping and load only the requested columns.
+    """
+
+    def __init__(self, directory: str, compression: str = 'zstd'):
+        self.directory = directory
+        self.compression = compression
+
+    def partition_dir(self, table: str, partition: Optional[str] = None) -> str:
+        if partition is None:
+            return os.path.join(self.directory, table)
+        return os.path.join(self.directory, table, f"attack={partition}")
+
+    def part_path(self, table: str, partition: Optional[str] = None, part: int = 0) -> str:
+        return os.path.join(self.partition_dir(table, partition), f"part-{part:05d}.parquet")
+
+    def write(self, table: str, df: pd.DataFrame, partition: Optional[str] = None, part: int = 0) -> str:
+        path = self.part_path(table, partition, part)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrow_table = pa.Table.from_pandas(flatten_dict_columns(df), preserve_index=True)
+        temporary_path = path + '.tmp'
+        pq.write_table(arrow_table, temporary_path, compression=self.compression)
+        os.replace(temporary_path, path)
+        return path
+
+    def parts(self, table: str, partition: Optional[str] = None) -> List[str]:
+        directory = self.partition_dir(table, partition)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith('.parquet')]
+
+    def partitions(self, table: str) -> List[str]:
+        directory = self.partition_dir(table)
+        if not os.path.isdir(directory):
+            return []
+        return [name[len('attack='):] for name in sorted(os.listdir(directory)) if name.startswith('attack=')]
+
+    def columns(self, table: str, partition: Optional[str] = None) -> List[str]:
+        parts = self.parts(table, partition)
+        if not parts:
+            return []
+        schema = pq.read_schema(parts[0])
+        index_columns = set(schema.pandas_metadata.get('index_columns', [])) if schema.pandas_metadata else set()
+        return [name for name in schema.names if name not in index_columns]
+
+    def read(self, table: str, partition: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        parts = self.parts(table, partition)
+        if not parts:
+            raise FileNotFoundError(f"No results stored in {self.partition_dir(table, partition)}")
+        # parts are converted one by one, a column that is entirely null in one part has no type to unify with
+        return pd.concat([pq.read_table(path, columns=columns, memory_map=True, use_pandas_metadata=True).to_pandas()
+                          for path in parts])
+
+    def prune(self, table: str, number_of_parts: int) -> None:
+        """Removes parts left over from an earlier run that wrote more of them"""
+        partitions = self.partitions(table) or [None]
+        for partition in partitions:
+            for path in self.parts(table, partition):
+                if int(os.path.basename(path)[len('part-'):-len('.parquet')]) >= number_of_parts:
+                    os.remove(path)
+
+    def clear(self, table: str) -> None:
+        shutil.rmtree(self.partition_dir(table), ignore_errors=True)
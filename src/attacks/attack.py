@@ -1,21 +1,74 @@
 from abc import ABC
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import random
-from transformers import AutoTokenizer, AutoModelForTokenClassification
-from transformers import pipeline
+from transformers import AutoModelForTokenClassification
 import copy
-import json
-import spacy
+import hashlib
 import re
+import numpy as np
+from src.utils.cache import text_hash
+from src.attacks.corruption import WORD_PUNCTUATION, MaskingTable, TokenizedBatch
+from src.attacks.substitution import DictionarySubstitution, load_dictionary
+from src.utils.model_registry import get_hf_pipeline, get_spacy_model
 
 class Attack(ABC):
-    def __init__(self):
+    # deterministic attacks always produce the same output for the same input and can be cached
+    deterministic = True
+    # pure-Python attacks that are cheap to construct can run in worker processes
+    parallelizable = False
+
+    def __init__(self, seed: Optional[int] = None):
         self.name = None
+        self.seed = seed
 
     def attack(self, sentences: List[str]) -> Tuple[str, int]:
         changes = 0
         return ' '.join(sentences), changes
 
+    def attack_batch(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        """Attacks many documents, stochastic attacks draw from a generator derived from the key of each document"""
+        if self.deterministic:
+            return [self.attack(sentences) for sentences in documents]
+        if keys is None:
+            keys = [None] * len(documents)
+        return [self.attack(sentences, key=key) for sentences, key in zip(documents, keys)]
+
+    def document_key(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        """Stable key of a document: the given key (e.g. the dataset id) or a hash of its sentences"""
+        return str(key) if key is not None else text_hash(sentences)
+
+    def rng(self, sentences: List[str], key: Optional[Any] = None) -> random.Random:
+        """Random generator of a document, seeded from the attack seed, the attack class and the document key.
+
+        Outputs do not depend on the order, chunking or process the documents are attacked in. Without a seed the
+        generator is seeded from system randomness.
+        """
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{type(self).__name__}:{self.document_key(sentences, key)}")
+
+    def stream_seeds(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> np.ndarray:
+        """64-bit seeds of the counter-based NumPy draws of documents, derived like `rng`"""
+        if keys is None:
+            keys = [None] * len(documents)
+        if self.seed is None:
+            return np.array([random.getrandbits(64) for _ in documents], dtype=np.uint64)
+        seeds = [f"{self.seed}:{type(self).__name__}:{self.document_key(sentences, key)}".encode()
+                 for sentences, key in zip(documents, keys)]
+        return np.array([int.from_bytes(hashlib.blake2b(seed, digest_size=8).digest(), 'little') for seed in seeds],
+                        dtype=np.uint64)
+
+    def get_params(self) -> Dict[str, Any]:
+        """Constructor parameters that influence the output of the attack"""
+        return {}
+
+    def model_revision(self) -> Optional[str]:
+        """Version of the model or resource the attack depends on"""
+        return None
+
+    def is_cacheable(self) -> bool:
+        return self.deterministic or self.seed is not None
+
     def __call__(self, sentences: List[str]) -> str:
         return self.attack(sentences)
 
@@ -24,6 +77,8 @@ class Attack(ABC):
 
 
 class NoAttack(Attack):
+    parallelizable = True
+
     def __init__(self):
         super().__init__()
         self.name = "NoAttack"
@@ -33,13 +88,17 @@ class NoAttack(Attack):
 
 
 class ShuffleAttack(Attack):
-    def __init__(self):
-        super().__init__()
+    deterministic = False
+    parallelizable = True
+
+    def __init__(self, seed: Optional[int] = None):
+        super().__init__(seed)
         self.name = "Shuffle"
 
-    def attack(self, sentences: List[str]) -> str:
+    def attack(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        rng = self.rng(sentences, key)
         new_sentences = copy.deepcopy(sentences)
-        random.shuffle(new_sentences)
+        rng.shuffle(new_sentences)
 
         changes = 0
         for s, s_new in zip(sentences, new_sentences):
@@ -49,188 +108,194 @@ class ShuffleAttack(Attack):
         return ' '.join(new_sentences), changes
 
 
-class BritishToAmericanEnglish(Attack):
+class DictionaryAttack(Attack):
+    """Replaces words with their variants from a JSON dictionary"""
+
+    parallelizable = True
+
     def __init__(self, dictionary_path):
         super().__init__()
-        self.name = "BritishToAmericanEnglish"
-        self.dictionary = json.load(open(dictionary_path))
-        # TODO: check lemmatization
+        self.dictionary_path = dictionary_path
+        self.dictionary, self.dictionary_revision = load_dictionary(dictionary_path)
+        self.substitution = DictionarySubstitution(self.dictionary)
+
+    def get_params(self) -> Dict[str, Any]:
+        return {'dictionary_path': self.dictionary_path}
+
+    def model_revision(self) -> Optional[str]:
+        return self.dictionary_revision
 
     def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        changes = 0
-        for sentence in sentences:
-            new_sentence = []
-            for word in sentence.split():
-                punctuation_flag = False
-                org_word = word
-                # if word is arounded by puntuation, strip the puntuation but add it later
-                if word.strip('.,?!') != word:
-                    punctuation_flag = True
-                    word = word.strip('.,?!')
-
-                if word in self.dictionary:
-                    if punctuation_flag:
-                        new_sentence.append(self.dictionary[word] + org_word.strip(word))
-                        changes += 1
-                    else:
-                        new_sentence.append(self.dictionary[word])
-                        changes += 1
-                else:
-                    if punctuation_flag:
-                        new_sentence.append(org_word)
-                    else:
-                        new_sentence.append(word)
-                          
-            new_sentences.append(" ".join(new_sentence))
-        return ' '.join(new_sentences), changes
+        return self.substitution.substitute_sentences(sentences)
 
 
-class AmericanToBritishEnglish(Attack):
+class BritishToAmericanEnglish(DictionaryAttack):
     def __init__(self, dictionary_path):
-        super().__init__()
-        self.name = "AmericanToBritishEnglish"
-        self.dictionary = json.load(open(dictionary_path))
+        super().__init__(dictionary_path)
+        self.name = "BritishToAmericanEnglish"
+        # TODO: check lemmatization
 
-    def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        changes = 0
-        for sentence in sentences:
-            new_sentence = []
-            for word in sentence.split():
-                punctuation_flag = False
-                org_word = word
-                # if word is arounded by puntuation, strip the puntuation but add it later
-                if word.strip('.,?!') != word:
-                    punctuation_flag = True
-                    word = word.strip('.,?!')
-
-                if word in self.dictionary:
-                    if punctuation_flag:
-                        new_sentence.append(self.dictionary[word] + org_word.strip(word))
-                        changes += 1
-                    else:
-                        new_sentence.append(self.dictionary[word])
-                        changes += 1
-                else:
-                    if punctuation_flag:
-                        new_sentence.append(org_word)
-                    else:
-                        new_sentence.append(word)
 
-            new_sentences.append(" ".join(new_sentence))
-        return ' '.join(new_sentences), changes
+class AmericanToBritishEnglish(DictionaryAttack):
+    def __init__(self, dictionary_path):
+        super().__init__(dictionary_path)
+        self.name = "AmericanToBritishEnglish"
 
 
 class NamedEntities(Attack):
     name = "NamedEntities"
 
-    def __init__(self, model_name):
+    def __init__(self, model_name, batch_size: int = 32):
         super().__init__()
         self.name = "NamedEntities"
-        ner_tokenizer = AutoTokenizer.from_pretrained(model_name)
-        ner_model = AutoModelForTokenClassification.from_pretrained(model_name)
-        self.ner = pipeline("ner", model=ner_model, tokenizer=ner_tokenizer)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.ner = get_hf_pipeline("ner", model_name, AutoModelForTokenClassification)
         # Example ner output:
         # [{'entity': 'B-PER', 'score': 0.9990139, 'index': 4, 'word': 'Wolfgang', 'start': 11, 'end': 19},
         # {'entity': 'B-LOC', 'score': 0.999645, 'index': 9, 'word': 'Berlin', 'start': 34, 'end': 40}]
 
-    def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        entity_types = set()
-        changes = 0
-        for sentence in sentences:
-            entities = self.ner(sentence)
-            for entity in entities:
-                entity_types.add(entity['entity'].split('-')[1])
-            new_sentence = ""
-            characters_to_pass = 0
-            current_entity = None
-            for i, character in enumerate(sentence):
-                if i in [entity['start'] for entity in entities]:
-                    current_entity = [entity for entity in entities if entity['start'] == i][0]
-                    new_sentence += current_entity['entity'].split('-')[1]
-                    characters_to_pass = current_entity['end'] - current_entity['start'] - 1
-                elif characters_to_pass > 0:
-                    characters_to_pass -= 1
-                else:
-                    new_sentence += character
+    def get_params(self) -> Dict[str, Any]:
+        return {'model_name': self.model_name}
 
-            for entity_type in entity_types:
-                # use regex
-                new_sentence = re.sub(rf'({entity_type}){{2,}}', entity_type, new_sentence)
+    def model_revision(self) -> Optional[str]:
+        return getattr(self.ner.model.config, '_commit_hash', None)
 
-            for w, w_ in zip(sentence.split(), new_sentence.split()):
-                if w != w_:
-                    changes += 1
+    def attack(self, sentences: List[str]) -> str:
+        return self.attack_batch([sentences])[0]
+
+    def attack_batch(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        # run NER over the sentences of all documents in a single batched pipeline call
+        flat_sentences = [sentence for sentences in documents for sentence in sentences]
+        flat_entities = self.ner(flat_sentences, batch_size=self.batch_size) if flat_sentences else []
+
+        results = []
+        offset = 0
+        for sentences in documents:
+            new_sentences = []
+            entity_types = set()
+            changes = 0
+            for sentence, entities in zip(sentences, flat_entities[offset:offset + len(sentences)]):
+                new_sentence, sentence_changes = self.replace_entities(sentence, entities, entity_types)
+                new_sentences.append(new_sentence)
+                changes += sentence_changes
+            offset += len(sentences)
+            results.append((' '.join(new_sentences), changes))
+        return results
+
+    @staticmethod
+    def replace_entities(sentence: str, entities: List[dict], entity_types: set) -> Tuple[str, int]:
+        """Replaces entities in a sentence with their types. `entity_types` is shared by all sentences of a
+        document and updated in place."""
+        # the first entity starting at a given position wins
+        entity_at = {}
+        for entity in entities:
+            entity_type = entity['entity'].split('-')[1]
+            entity_types.add(entity_type)
+            entity_at.setdefault(entity['start'], (entity['end'], entity_type))
+
+        # single pass over the spans sorted by start, text between spans is copied unless an earlier span covers it
+        parts = []
+        previous_start = -1
+        skip_until = 0
+        for start in sorted(entity_at):
+            if start < 0:
+                continue
+            if start >= len(sentence):
+                break
+            end, entity_type = entity_at[start]
+            parts.append(sentence[max(previous_start + 1, skip_until):start])
+            parts.append(entity_type)
+            previous_start = start
+            skip_until = max(end, start + 1)
+        parts.append(sentence[max(previous_start + 1, skip_until):])
+        new_sentence = "".join(parts)
+
+        # merge sub-word pieces of one entity, e.g. PERPER -> PER
+        for entity_type in entity_types:
+            new_sentence = re.sub(rf'({entity_type}){{2,}}', entity_type, new_sentence)
 
-            new_sentences.append(new_sentence)
-        return ' '.join(new_sentences), changes
+        changes = 0
+        for w, w_ in zip(sentence.split(), new_sentence.split()):
+            if w != w_:
+                changes += 1
+        return new_sentence, changes
 
 
 class WordCorruption(Attack):
-    def __init__(self, percent_of_words_to_corrupt: float, corrupted_word: str):
-        super().__init__()
+    deterministic = False
+    parallelizable = True
+
+    def __init__(self, percent_of_words_to_corrupt: float, corrupted_word: str, seed: Optional[int] = None):
+        super().__init__(seed)
         self.name = "WordCorruption"
         self.percentage = percent_of_words_to_corrupt
         self.corrupted_word = corrupted_word
 
-    def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        changes = 0
-        full_text = ' '.join(sentences)
-        number_of_words_to_corrupt = int(len(full_text.split()) * self.percentage)
-        left = number_of_words_to_corrupt
-        for sentence in sentences:
-            words = sentence.split()
-            if left > 0:
-                # randomly choose how many words to corrupt in this sentence
-                number_of_words_to_corrupt_ = random.randint(0, left)
-                left -= number_of_words_to_corrupt_
-                indeces_of_words_to_corrupt = random.sample(range(len(words)), number_of_words_to_corrupt_)
-            else:
-                indeces_of_words_to_corrupt = []
+    def get_params(self) -> Dict[str, Any]:
+        return {'percent_of_words_to_corrupt': self.percentage, 'corrupted_word': self.corrupted_word}
 
-            for index_of_word_to_corrupt in indeces_of_words_to_corrupt:
-                if words[index_of_word_to_corrupt].strip('.,?!') != words[index_of_word_to_corrupt]:
-                    org_word = words[index_of_word_to_corrupt]
-                    # word is arounded by puntuation, strip the puntuation but add it later
-                    words[index_of_word_to_corrupt] = self.corrupted_word + org_word.strip(org_word.strip('.,?!'))
-                else:
-                    words[index_of_word_to_corrupt] = self.corrupted_word
-                changes += 1
-            new_sentences.append(" ".join(words))
-        return ' '.join(new_sentences), changes
+    def attack(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        return self.attack_batch([sentences], [key])[0]
+
+    def attack_batch(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        batch = TokenizedBatch(documents)
+        chosen = batch.choose_words(self.percentage, self.stream_seeds(documents, keys))
+        tokens = batch.tokens
+        replacements = {}
+        for index in chosen.tolist():
+            word = tokens[index]
+            if word not in replacements:
+                core = word.strip(WORD_PUNCTUATION)
+                # word is arounded by puntuation, strip the puntuation but add it later
+                replacements[word] = self.corrupted_word + word.strip(core) if core != word else self.corrupted_word
+            tokens[index] = replacements[word]
+        changes = np.bincount(batch.token_documents[chosen], minlength=len(documents))
+        return list(zip(batch.join(), changes.tolist()))
 
 
 class Lemmatization(Attack):
-    def __init__(self):
+    def __init__(self, batch_size: int = 256):
         super().__init__()
         self.name = "Lemmatization"
-        self.nlp = spacy.load("en_core_web_sm")
-        self.lemmatizer = self.nlp.get_pipe("lemmatizer")
+        self.nlp = get_spacy_model("en_core_web_sm")
+        self.batch_size = batch_size
 
-    def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        changes = 0
-        for sentence in sentences:
-            doc = self.nlp(sentence)
-            processed = self.lemmatizer(doc)
-            new_sentence = " ".join([token.lemma_ for token in processed])
-            # delete spaces before punctuation
-            new_sentence = re.sub(r'\s([?.!"](?:\s|$))', r'\1', new_sentence)
-            new_sentences.append(new_sentence)
-
-        for w, w_ in zip(' '.join(sentences).split(), ' '.join(new_sentences).split()):
-            if w != w_:
-                changes += 1
+    def model_revision(self) -> Optional[str]:
+        return f"{self.nlp.meta.get('lang')}_{self.nlp.meta.get('name')}-{self.nlp.meta.get('version')}"
 
-        return ' '.join(new_sentences), changes
+    def attack(self, sentences: List[str]) -> str:
+        return self.attack_batch([sentences])[0]
+
+    def attack_batch(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        # lemmatize the sentences of all documents in one nlp.pipe pass, lemmas do not depend on parser and ner
+        flat_sentences = [sentence for sentences in documents for sentence in sentences]
+        disable = [name for name in ("parser", "ner") if name in self.nlp.pipe_names]
+        docs = self.nlp.pipe(flat_sentences, batch_size=self.batch_size, disable=disable)
+
+        results = []
+        for sentences in documents:
+            new_sentences = []
+            for _, doc in zip(sentences, docs):
+                new_sentence = " ".join([token.lemma_ for token in doc])
+                # delete spaces before punctuation
+                new_sentence = re.sub(r'\s([?.!"](?:\s|$))', r'\1', new_sentence)
+                new_sentences.append(new_sentence)
+
+            changes = 0
+            for w, w_ in zip(' '.join(sentences).split(), ' '.join(new_sentences).split()):
+                if w != w_:
+                    changes += 1
+            results.append((' '.join(new_sentences), changes))
+        return results
 
 
 class LetterMasking(Attack):
-    def __init__(self, percentage_of_letters_to_mask: float):
-        super().__init__()
+    deterministic = False
+    parallelizable = True
+
+    def __init__(self, percentage_of_letters_to_mask: float, seed: Optional[int] = None):
+        super().__init__(seed)
         self.name = "LetterMasking"
         self.masking_dictionary = {
             'a': ['@', '4'],
@@ -260,49 +325,42 @@ class LetterMasking(Attack):
             'y': ['`/'],
             'z': ['2', '7']
         }
+        self.masking_table = MaskingTable(self.masking_dictionary)
         self.percentage = percentage_of_letters_to_mask
 
-    def attack(self, sentences: List[str]) -> str:
-        new_sentences = []
-        changes = 0
-        full_text = ' '.join(sentences)
-        number_of_words_to_corrupt = int(len(full_text.split()) * self.percentage)
-        left = number_of_words_to_corrupt
-        for sentence in sentences:
-            words = sentence.split()
-            if left > 0:
-                # randomly choose how many words to corrupt in this sentence
-                number_of_words_to_mask = random.randint(0, left)
-                left -= number_of_words_to_mask
-                indeces_of_words_to_mask = random.sample(range(len(words)), number_of_words_to_mask)
-            else:
-                indeces_of_words_to_mask = []
-
-            for index_of_word_to_mask in indeces_of_words_to_mask:
-                word = words[index_of_word_to_mask]
-                new_word = ""
-                for letter in word:
-                    if letter.lower() in self.masking_dictionary:
-                        new_word += random.choice(self.masking_dictionary[letter.lower()])
-                    else:
-                        new_word += letter
-                words[index_of_word_to_mask] = new_word
-                changes += 1
-            new_sentences.append(" ".join(words))
-        return ' '.join(new_sentences), changes
+    def get_params(self) -> Dict[str, Any]:
+        return {'percentage_of_letters_to_mask': self.percentage}
+
+    def attack(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        return self.attack_batch([sentences], [key])[0]
+
+    def attack_batch(self, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        batch = TokenizedBatch(documents)
+        seeds = self.stream_seeds(documents, keys)
+        chosen = batch.choose_words(self.percentage, seeds).tolist()
+        masked = self.masking_table.mask([batch.tokens[index] for index in chosen], batch.token_documents[chosen],
+                                         seeds)
+        for index, word in zip(chosen, masked):
+            batch.tokens[index] = word
+        changes = np.bincount(batch.token_documents[chosen], minlength=len(documents))
+        return list(zip(batch.join(), changes.tolist()))
 
 
 class WinkyEmoji(Attack):
-    def __init__(self):
-        super().__init__()
+    deterministic = False
+    parallelizable = True
+
+    def __init__(self, seed: Optional[int] = None):
+        super().__init__(seed)
         self.name = "WinkyEmoji"
         self.winky_emoji = ";)"
 
-    def attack(self, sentences: List[str]) -> str:
+    def attack(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        rng = self.rng(sentences, key)
         new_sentences = []
         changes = 0
         for sentence in sentences:
-            if random.random() < 0.5:
+            if rng.random() < 0.5:
                 new_sentences.append(sentence.strip('.?!') + ' ' + self.winky_emoji)
                 changes += 1
             else:
@@ -311,19 +369,23 @@ class WinkyEmoji(Attack):
 
 
 class ExclamationMark(Attack):
-    def __init__(self):
-        super().__init__()
+    deterministic = False
+    parallelizable = True
+
+    def __init__(self, seed: Optional[int] = None):
+        super().__init__(seed)
         self.name = "ExclamationMark"
         self.exclamation_mark = "!"
 
-    def attack(self, sentences: List[str]) -> str:
+    def attack(self, sentences: List[str], key: Optional[Any] = None) -> str:
+        rng = self.rng(sentences, key)
         new_sentences = []
         changes = 0
         for index, sentence in enumerate(sentences):
             if index < 3 or index > len(sentences) - 3:
                 new_sentences.append(sentence)
             else:
-                if random.random() < 0.5:
+                if rng.random() < 0.5:
                     # change dot to exclamation mark at the end of the sentence
                     if sentence[-1] == '.':
                         new_sentences.append(sentence[:-1] + self.exclamation_mark)
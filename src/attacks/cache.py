@@ -0,0 +1,60 @@
+from typing import Any, Dict, List, Optional, Tuple
+from src.attacks.attack import Attack
+from src.utils.cache import DiskCache, make_key, text_hash
+
+
+class AttackCache:
+    """On-disk cache of attack outputs keyed by attack name, constructor params, model revision and document hash"""
+
+    def __init__(self, path: str, max_size_bytes: Optional[int] = None):
+        self.store = DiskCache(path, max_size_bytes=max_size_bytes)
+
+    @staticmethod
+    def keys(attack: Attack, documents: List[List[str]], keys: Optional[List[Any]] = None) -> List[str]:
+        name, params, revision = attack.name, attack.get_params(), attack.model_revision()
+        if attack.deterministic:
+            return [make_key(name, params, revision, text_hash(sentences)) for sentences in documents]
+        # seeded stochastic attacks produce the output drawn for the seed and the key of the document
+        if keys is None:
+            keys = [None] * len(documents)
+        return [make_key(name, params, revision, attack.seed, attack.document_key(sentences, key), text_hash(sentences))
+                for sentences, key in zip(documents, keys)]
+
+    def lookup(self, attack: Attack, documents: List[List[str]],
+               document_keys: Optional[List[Any]] = None) -> Tuple[List[str], Dict[str, Any], List[int]]:
+        """Cache keys of the documents, the cached results and the indices of the documents that are missing"""
+        keys = self.keys(attack, documents, document_keys)
+        cached = self.store.get_many(keys)
+        return keys, cached, [index for index, key in enumerate(keys) if key not in cached]
+
+    def merge(self, keys: List[str], cached: Dict[str, Any], missing: List[int],
+              computed: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Stores the results computed for the missing documents and returns results for all of them"""
+        new_items = {keys[index]: list(result) for index, result in zip(missing, computed)}
+        self.store.set_many(new_items.items())
+        cached.update(new_items)
+        return [tuple(cached[key]) for key in keys]
+
+    def attack_batch(self, attack: Attack, documents: List[List[str]],
+                     document_keys: Optional[List[Any]] = None) -> List[Tuple[str, int]]:
+        """Runs `attack.attack_batch` only on the documents that are not cached yet"""
+        if not attack.is_cacheable():
+            return attack.attack_batch(documents, document_keys)
+
+        keys, cached, missing = self.lookup(attack, documents, document_keys)
+        if document_keys is None:
+            document_keys = [None] * len(documents)
+        computed = attack.attack_batch([documents[index] for index in missing],
+                                       [document_keys[index] for index in missing]) if missing else []
+        return self.merge(keys, cached, missing, computed)
+
+    @property
+    def hits(self) -> int:
+        return self.store.hits
+
+    @property
+    def misses(self) -> int:
+        return self.store.misses
+
+    def stats(self):
+        return self.store.stats()
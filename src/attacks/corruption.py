@@ -0,0 +1,175 @@
+from typing import Dict, List
+import numpy as np
+
+# punctuation kept after a corrupted word
+WORD_PUNCTUATION = '.,?!'
+# whitespace as str.split sees it, every whitespace character is below U+3001 (the last entry covers the others)
+WHITESPACE = np.array([chr(code).isspace() for code in range(0x3001)] + [False])
+# code points looked up directly in the masking tables, other characters go through str.lower
+ASCII_SIZE = 128
+# separate streams of draws of a document: words per sentence, words in a sentence and letter replacements
+BUDGET_STREAM = np.uint64(0)
+WORD_STREAM = np.uint64(0x9E3779B97F4A7C15)
+LETTER_STREAM = np.uint64(0x5851F42D4C957F2D)
+
+
+def splitmix64(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, a bijective mix of 64-bit integers (uint64 arithmetic wraps around)"""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def counter_uniform(seeds: np.ndarray, counters: np.ndarray, stream: np.uint64) -> np.ndarray:
+    """Uniform draws in [0, 1), draw `counters[i]` of the stream of the document seeded with `seeds[i]`.
+
+    Every draw is a hash of the 64-bit seed of its document and its counter, so draws of a document do not depend on
+    the other documents of the batch.
+    """
+    with np.errstate(over='ignore'):
+        values = (seeds ^ stream) + counters.astype(np.uint64) * np.uint64(0xD1B54A32D192ED03)
+        return (splitmix64(values) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def exclusive_cumsum(values: np.ndarray) -> np.ndarray:
+    return np.cumsum(values) - values
+
+
+def ranks_within(document_ids: np.ndarray) -> np.ndarray:
+    """Position of every element among the elements of its document, `document_ids` must be sorted"""
+    return np.arange(len(document_ids)) - np.searchsorted(document_ids, document_ids)
+
+
+class TokenizedBatch:
+    """Whitespace tokens of a batch of documents, flattened into one list.
+
+    A sentence without words is kept as an empty token, so joining the tokens of a document with spaces gives the
+    sentences joined with single spaces between their words, as the attacks always did. Words per sentence are
+    counted on the code points of the joined sentences.
+    """
+
+    def __init__(self, documents: List[List[str]]):
+        sentences = [sentence for sentences in documents for sentence in sentences]
+        text = ' '.join(sentences)
+        sentence_counts = np.fromiter(map(len, documents), dtype=np.int64, count=len(documents))
+        sentence_lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+        if text.isascii():
+            space = np.take(WHITESPACE, np.frombuffer(text.encode('ascii'), dtype=np.uint8))
+        else:
+            space = np.take(WHITESPACE, np.minimum(np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32),
+                                                   len(WHITESPACE) - 1))
+        # cumulative count of word starts, a word starts at a non-whitespace character after whitespace
+        starts = np.zeros(len(text) + 2, dtype=bool)
+        np.logical_not(space, out=starts[1:-1])
+        starts[2:-1] &= space[:-1]
+        starts = np.cumsum(starts, dtype=np.int64)
+        sentence_starts = exclusive_cumsum(sentence_lengths + 1)
+        self.sentence_words = starts[sentence_starts + sentence_lengths] - starts[sentence_starts]
+        self.sentence_documents = np.repeat(np.arange(len(documents)), sentence_counts)
+        first_sentences = exclusive_cumsum(sentence_counts)
+        self.sentence_positions = np.arange(len(sentences)) - first_sentences[self.sentence_documents]
+        self.document_words = np.bincount(self.sentence_documents, weights=self.sentence_words,
+                                          minlength=len(documents)).astype(np.int64)
+
+        self.tokens = text.split()
+        token_counts = np.maximum(self.sentence_words, 1)
+        blanks = np.flatnonzero(self.sentence_words == 0)
+        for token in (exclusive_cumsum(token_counts)[blanks]).tolist():
+            self.tokens.insert(token, '')
+        self.token_sentences = np.repeat(np.arange(len(sentences)), token_counts)
+        self.token_documents = self.sentence_documents[self.token_sentences]
+        document_tokens = np.bincount(self.sentence_documents, weights=token_counts, minlength=len(documents))
+        self.bounds = np.concatenate(([0], np.cumsum(document_tokens))).astype(np.int64).tolist()
+
+    def choose_words(self, percentage: float, seeds: np.ndarray) -> np.ndarray:
+        """Indices of the attacked tokens of all documents, in order.
+
+        The budget of `percentage` of the words of a document is split over its sentences in order, every sentence
+        takes a random part of what is left (randint(0, left)), at most as many words as it has, and these words are
+        chosen uniformly in the sentence.
+        """
+        documents = len(self.document_words)
+        budgets = (self.document_words * percentage).astype(np.int64)
+        max_sentences = int(self.sentence_positions.max()) + 1 if len(self.sentence_positions) else 0
+        words = np.zeros((documents, max_sentences), dtype=np.int64)
+        words[self.sentence_documents, self.sentence_positions] = self.sentence_words
+        draws = counter_uniform(seeds[:, None], np.arange(max_sentences)[None, :], BUDGET_STREAM)
+        taken = np.zeros_like(words)
+        left = budgets
+        for position in range(max_sentences):
+            if not left.any():
+                break
+            # a draw of 0 words when nothing is left
+            taken[:, position] = np.minimum((draws[:, position] * (left + 1)).astype(np.int64), words[:, position])
+            left = left - taken[:, position]
+        taken = taken[self.sentence_documents, self.sentence_positions]
+
+        token_taken = taken[self.token_sentences]
+        chosen = (token_taken > 0) & (token_taken == self.sentence_words[self.token_sentences])
+        # sentences attacked only in part: rank their words by their draws, one sort for the whole batch
+        partial = np.flatnonzero((token_taken > 0) & ~chosen)
+        if len(partial):
+            documents_of_partial = self.token_documents[partial]
+            counters = partial - np.searchsorted(self.token_documents, documents_of_partial)
+            word_draws = counter_uniform(seeds[documents_of_partial], counters, WORD_STREAM)
+            order = partial[np.argsort(word_draws + 2.0 * self.token_sentences[partial], kind='stable')]
+            sentences = self.token_sentences[order]
+            chosen[order[ranks_within(sentences) < taken[sentences]]] = True
+        return np.flatnonzero(chosen)
+
+    def join(self) -> List[str]:
+        tokens, bounds = self.tokens, self.bounds
+        return [' '.join(tokens[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class MaskingTable:
+    """Replacements of letters as one array of code points, indexed by letter and option"""
+
+    def __init__(self, masking_dictionary: Dict[str, List[str]]):
+        self.letter_ids = {letter: index for index, letter in enumerate(masking_dictionary)}
+        self.option_counts = np.array([len(options) for options in masking_dictionary.values()], dtype=np.int64)
+        width = int(self.option_counts.max())
+        options = [option for options in masking_dictionary.values() for option in options]
+        self.pool = np.frombuffer(''.join(options).encode('utf-32-le'), dtype=np.uint32)
+        # option k of letter i is pool[starts[i, k]:starts[i, k] + lengths[i, k]]
+        self.lengths = np.zeros((len(masking_dictionary), width), dtype=np.int64)
+        for index, letter_options in enumerate(masking_dictionary.values()):
+            self.lengths[index, :len(letter_options)] = [len(option) for option in letter_options]
+        self.starts = exclusive_cumsum(self.lengths.ravel()).reshape(self.lengths.shape)
+        self.ascii_ids = np.array([self.letter_ids.get(chr(code).lower(), -1) for code in range(ASCII_SIZE)],
+                                  dtype=np.int64)
+
+    def ids(self, codes: np.ndarray) -> np.ndarray:
+        """Letter ids of code points, -1 for characters that are not masked"""
+        ids = self.ascii_ids[np.minimum(codes, ASCII_SIZE - 1)]
+        other = codes >= ASCII_SIZE - 1
+        for code in np.unique(codes[other]).tolist():
+            ids[other & (codes == code)] = self.letter_ids.get(chr(code).lower(), -1)
+        return ids
+
+    def mask(self, words: List[str], document_ids: np.ndarray, seeds: np.ndarray) -> List[str]:
+        """Replaces every maskable letter of the words with one of its replacements chosen uniformly.
+
+        `document_ids` (sorted) maps the words to the seeds of the documents their draws come from, the n-th masked
+        letter of a document takes draw n of its letter stream.
+        """
+        if not words:
+            return []
+        codes = np.frombuffer(' '.join(words).encode('utf-32-le'), dtype=np.uint32)
+        ids = self.ids(codes)
+        letters = np.flatnonzero(ids >= 0)
+        # words contain no whitespace, the spaces of the text are exactly the separators between them
+        letter_documents = document_ids[np.cumsum(codes == ord(' '))[letters]]
+        draws = counter_uniform(seeds[letter_documents], ranks_within(letter_documents), LETTER_STREAM)
+        ids = ids[letters]
+        options = (draws * self.option_counts[ids]).astype(np.int64)
+
+        # every character emits itself, or the code points of its replacement from the pool
+        lengths = np.ones(len(codes), dtype=np.int64)
+        lengths[letters] = self.lengths[ids, options]
+        sources = np.arange(len(codes))
+        sources[letters] = len(codes) + self.starts[ids, options]
+        ends = np.cumsum(lengths)
+        output = np.concatenate((codes, self.pool))[np.repeat(sources - ends + lengths, lengths) +
+                                                    np.arange(ends[-1])]
+        return output.tobytes().decode('utf-32-le').split(' ')
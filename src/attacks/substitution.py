@@ -0,0 +1,64 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import re
+from src.attacks.corruption import WORD_PUNCTUATION
+
+TOKEN_PATTERN = re.compile(r"\S+")
+
+
+@lru_cache(maxsize=None)
+def load_dictionary(dictionary_path: str) -> Tuple[Dict[str, str], str]:
+    """Dictionary stored as JSON and its content hash, loaded once per process"""
+    with open(dictionary_path) as f:
+        dictionary = json.load(f)
+    revision = hashlib.sha256(json.dumps(dictionary, sort_keys=True).encode()).hexdigest()
+    return dictionary, revision
+
+
+class DictionarySubstitution:
+    """Replaces the words of a text found in a dictionary in one pass over its whitespace-separated tokens.
+
+    Punctuation from `WORD_PUNCTUATION` around a word stays where it was. Words that are not in the dictionary as
+    they are, but whose lowercase form is, are replaced when they are capitalized or upper case, keeping the case.
+    """
+
+    def __init__(self, dictionary: Dict[str, str]):
+        self.dictionary = dictionary
+
+    def replace_word(self, word: str) -> Optional[str]:
+        replacement = self.dictionary.get(word)
+        if replacement is not None:
+            return replacement
+        lowercase = word.lower()
+        if lowercase == word or lowercase not in self.dictionary:
+            return None
+        replacement = self.dictionary[lowercase]
+        if word.isupper():
+            return replacement.upper()
+        if word[0].isupper() and word[1:] == lowercase[1:]:
+            return replacement[:1].upper() + replacement[1:]
+        return None
+
+    def substitute(self, text: str) -> Tuple[str, int]:
+        changes = 0
+
+        def replace(match):
+            nonlocal changes
+            token = match.group()
+            start = len(token) - len(token.lstrip(WORD_PUNCTUATION))
+            end = len(token.rstrip(WORD_PUNCTUATION))
+            if start >= end:
+                return token
+            replacement = self.replace_word(token[start:end])
+            if replacement is None:
+                return token
+            changes += 1
+            return token[:start] + replacement + token[end:]
+
+        return TOKEN_PATTERN.sub(replace, text), changes
+
+    def substitute_sentences(self, sentences: List[str]) -> Tuple[str, int]:
+        # sentences are joined with single spaces between their words, as the attacks always did
+        return self.substitute(' '.join(' '.join(sentence.split()) for sentence in sentences))
@@ -1,6 +1,74 @@
-from datasets import load_dataset
+import os
+from contextlib import contextmanager
+from typing import List, Optional, Tuple, Union
+import gin
+import numpy as np
+import datasets
+import huggingface_hub
+from datasets import Dataset, DatasetDict, load_dataset, load_from_disk
 
 
-def dataset_loading():
-    dataset = load_dataset("cnn_dailymail", "3.0.0")
-    return dataset['train'], dataset['validation'], dataset['test']
\ No newline at end of file
+def load_local_dataset(data_files: Union[str, List[str]], split: str, cache_dir: Optional[str] = None) -> Dataset:
+    """Loads a dataset saved with `save_to_disk` or JSONL/Parquet files"""
+    if isinstance(data_files, str) and os.path.isdir(data_files):
+        dataset = load_from_disk(data_files)
+        return dataset[split] if isinstance(dataset, DatasetDict) else dataset
+    files = [data_files] if isinstance(data_files, str) else list(data_files)
+    builder = 'parquet' if all(file.endswith('.parquet') for file in files) else 'json'
+    return load_dataset(builder, data_files=files, split='train', cache_dir=cache_dir)
+
+
+@contextmanager
+def offline_mode(offline: bool):
+    """Uses only locally cached hub files inside the block if `offline`, the flags are process-wide and restored"""
+    was_hub_offline = huggingface_hub.constants.HF_HUB_OFFLINE
+    was_datasets_offline = datasets.config.HF_DATASETS_OFFLINE, datasets.config.HF_HUB_OFFLINE
+    was_environ = os.environ.get('HF_HUB_OFFLINE')
+    if offline:
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        huggingface_hub.constants.HF_HUB_OFFLINE = True
+        datasets.config.HF_DATASETS_OFFLINE = datasets.config.HF_HUB_OFFLINE = True
+    try:
+        yield
+    finally:
+        huggingface_hub.constants.HF_HUB_OFFLINE = was_hub_offline
+        datasets.config.HF_DATASETS_OFFLINE, datasets.config.HF_HUB_OFFLINE = was_datasets_offline
+        if was_environ is None:
+            os.environ.pop('HF_HUB_OFFLINE', None)
+        else:
+            os.environ['HF_HUB_OFFLINE'] = was_environ
+
+
+def dataset_loading(cache_dir: Optional[str] = None, offline: bool = False) -> Tuple[Dataset, Dataset, Dataset]:
+    """Loads the train, validation and test splits of CNN/DailyMail"""
+    with offline_mode(offline):
+        dataset = load_dataset("cnn_dailymail", "3.0.0", cache_dir=cache_dir)
+    return dataset['train'], dataset['validation'], dataset['test']
+
+
+@gin.configurable
+def dataset_split_loading(split: str = 'train', start: Optional[int] = None, end: Optional[int] = None,
+                          sample_size: Optional[int] = None, seed: int = 42,
+                          data_files: Optional[Union[str, List[str]]] = None, cache_dir: Optional[str] = None,
+                          offline: bool = False, num_shards: int = 1, shard_index: int = 0) -> Dataset:
+    """Loads one split of CNN/DailyMail as a memory-mapped Arrow dataset.
+
+    Rows are selected in order: the `start`:`end` range, then a seeded random sample of `sample_size` rows (kept in
+    dataset order), then contiguous shard `shard_index` of `num_shards`. Selection only builds an indices mapping,
+    rows are read when the dataset is iterated. `data_files` loads a `save_to_disk` directory or local JSONL/Parquet
+    files instead of the hub dataset, `offline` uses only the locally cached copy of the hub dataset.
+    """
+    if data_files is not None:
+        dataset = load_local_dataset(data_files, split, cache_dir=cache_dir)
+    else:
+        with offline_mode(offline):
+            dataset = load_dataset("cnn_dailymail", "3.0.0", split=split, cache_dir=cache_dir)
+
+    if start is not None or end is not None:
+        dataset = dataset.select(range(*slice(start, end).indices(len(dataset))))
+    if sample_size is not None and sample_size < len(dataset):
+        indices = np.random.default_rng(seed).choice(len(dataset), size=sample_size, replace=False)
+        dataset = dataset.select(np.sort(indices))
+    if num_shards > 1:
+        dataset = dataset.shard(num_shards=num_shards, index=shard_index, contiguous=True)
+    return dataset
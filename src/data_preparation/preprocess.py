@@ -1,25 +1,48 @@
+import os
 import re
-import spacy
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List
+from src.utils.model_registry import get_spacy_model
+
+SENTENCE_MODEL = "en_core_web_sm"
+# components that sentence boundaries depend on, everything else is skipped during segmentation
+SENTENCE_PIPES = ("tok2vec", "parser", "senter", "sentencizer")
+
+COPYWRITE_PATTERNS = [
+    re.compile(r"Copyright \d{4} Reuters."),
+    re.compile(r"All rights reserved."),
+    re.compile(r"This material may not be published, broadcast, rewritten, or redistributed."),
+    re.compile(r"E-mail to a friend."),
+]
+# matches wherever any of the copywrite patterns does, most articles are not from Reuters and skip them all
+ANY_COPYWRITE_PATTERN = re.compile("|".join(f"(?:{pattern.pattern})" for pattern in COPYWRITE_PATTERNS))
+# a single space is left as it is, only runs of spaces are replaced
+MULTIPLE_SPACES_PATTERN = re.compile(r" {2,}")
+PUBLISHING_DATES_PATTERN = re.compile(
+    r'By . (\w+ |\w+, ){1,}. (PUBLISHED: . \d+:\d+ EST, \d+ \w+ \d+ )?(. \| . )?(UPDATED: . \d+:\d+ EST, \d+ \w+ \d+ . )?')
+CNN_LINES_PATTERN = re.compile(r'(\w+)?( |, )?(\w+)?( )?\(CNN\)( -- )?')
 
 
 def delete_copywrite(text):
     """Delete copywrite from text for research purposes"""
     # E-mail to a friend . Copyright 2007 Reuters. All rights reserved.This material may not be published, broadcast, rewritten, or redistributed.
-    text = re.sub(r"Copyright \d{4} Reuters.", "", text)
-    text = re.sub(r"All rights reserved.", "", text)
-    text = re.sub(r"This material may not be published, broadcast, rewritten, or redistributed.", "", text)
-    text = re.sub(r"E-mail to a friend.", "", text)
+    if ANY_COPYWRITE_PATTERN.search(text) is None:
+        return text
+    for pattern in COPYWRITE_PATTERNS:
+        text = pattern.sub("", text)
     return text
 
 
 def delete_new_lines(text):
     """Delete new lines from text for research purposes"""
-    text = re.sub(r"\n", "", text)
-    return text
+    return text.replace("\n", "")
 
 
 def delete_click_here_sentences(text):
     """Delete sentences with click here"""
+    if "CLICK HERE" not in text:
+        # splitting on "." and joining with ". " without dropping any sentence
+        return text.replace(".", ". ")
     sentences = text.split(".")
     sentences = [sentence for sentence in sentences if "CLICK HERE" not in sentence]
     return ". ".join(sentences)
@@ -27,23 +50,46 @@ def delete_click_here_sentences(text):
 
 def remove_multiple_spaces(text):
     """Remove multiple spaces from text"""
-    text = re.sub(r" +", " ", text)
-    return text
+    return MULTIPLE_SPACES_PATTERN.sub(" ", text)
 
 
 def remove_publishing_dates(text):
-    expression = r'By . (\w+ |\w+, ){1,}. (PUBLISHED: . \d+:\d+ EST, \d+ \w+ \d+ )?(. \| . )?(UPDATED: . \d+:\d+ EST, \d+ \w+ \d+ . )?'
-    text = re.sub(expression, "", text)
-    return text
+    if "By " not in text:
+        return text
+    return PUBLISHING_DATES_PATTERN.sub("", text)
+
+
+def cnn_line_search_start(text, marker):
+    """Earliest position a CNN line ending at `marker` can start: a match before "(CNN)" only spans word
+    characters, spaces and commas"""
+    start = marker
+    while start > 0 and (text[start - 1].isalnum() or text[start - 1] in "_ ,"):
+        start -= 1
+    return start
 
 
 def remove_cnn_lines(text):
-    expression = r'(\w+)?( |, )?(\w+)?( )?\(CNN\)( -- )?'
-    text = re.sub(expression, "", text)
-    return text
+    # every group before "(CNN)" is optional, so the pattern is only tried from the run of words right before each
+    # "(CNN)" instead of at every position of the text
+    parts = []
+    position = 0
+    while True:
+        marker = text.find("(CNN)", position)
+        if marker == -1:
+            break
+        match = CNN_LINES_PATTERN.search(text, max(position, cnn_line_search_start(text, marker)))
+        parts.append(text[position:match.start()])
+        position = match.end()
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return "".join(parts)
 
 
 def clean_text(text):
+    # the rules stay separate passes: later rules match what earlier ones produce (". " runs, spaces collapsed around
+    # a removed copyright notice), and the spacing rules are faster as str.replace calls than fused into one regex
+    # with a replacement callback per dot
     text = delete_copywrite(text)
     text = delete_new_lines(text)
     text = delete_click_here_sentences(text)
@@ -53,15 +99,42 @@ def clean_text(text):
     return text
 
 
+def clean_texts(texts: Iterable[str], n_process: int = 1, chunksize: int = 256) -> List[str]:
+    """Cleans many texts, `n_process > 1` spreads them over a process pool (`-1` uses all available cores)"""
+    texts = list(texts)
+    if n_process == -1:
+        n_process = os.cpu_count() or 1
+    if n_process <= 1 or len(texts) <= chunksize:
+        return [clean_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=n_process) as executor:
+        return list(executor.map(clean_text, texts, chunksize=chunksize))
+
+
+def sentence_disabled_pipes(nlp) -> List[str]:
+    """Names of the pipeline components that are not needed for sentence splitting"""
+    return [name for name in nlp.pipe_names if name not in SENTENCE_PIPES]
+
+
 def get_sentences(text):
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(text)
+    nlp = get_spacy_model(SENTENCE_MODEL)
+    doc = nlp(text, disable=sentence_disabled_pipes(nlp))
     sentences = [sent.text for sent in doc.sents]
     return sentences
 
 
+def pipe_sentences(texts: Iterable[str], batch_size: int = 64, n_process: int = 1) -> Iterator[List[str]]:
+    """Split many texts into sentences, streaming one list of sentences per text.
+
+    Texts are parsed with nlp.pipe, `n_process=-1` uses all available cores.
+    """
+    nlp = get_spacy_model(SENTENCE_MODEL)
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=sentence_disabled_pipes(nlp))
+    for doc in docs:
+        yield [sent.text for sent in doc.sents]
+
+
 def text_normalization(text: str):
-    text = re.sub(r"\n", " ", text)
+    text = text.replace("\n", " ")
     # delete multiple spaces
-    text = re.sub(r" +", " ", text)
+    text = MULTIPLE_SPACES_PATTERN.sub(" ", text)
     return text
\ No newline at end of file
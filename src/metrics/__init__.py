@@ -9,6 +9,7 @@ def configure_class(class_object):
 Rouge1 = configure_class(metrics_summary_to_summary.Rouge1)
 Rouge2 = configure_class(metrics_summary_to_summary.Rouge2)
 RougeL = configure_class(metrics_summary_to_summary.RougeL)
+RougeScore = configure_class(metrics_summary_to_summary.RougeScore)
 BERTScore = configure_class(metrics_summary_to_summary.BERTScore)
 FactSummScore = configure_class(metrics_summary_to_text.FactSummScore)
 SentimentScore = configure_class(metrics_summary_to_summary.SentimentScore)
@@ -1,18 +1,95 @@
 from abc import ABC
-from rouge import Rouge
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
 import bert_score
-from transformers import AutoTokenizer, AutoModelForTokenClassification, AutoModelForSequenceClassification
-from transformers import pipeline
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from transformers import AutoModelForTokenClassification, AutoModelForSequenceClassification
+from src.utils.cache import text_hash
+from src.utils.model_registry import get_hf_pipeline, model_registry
 
 
 class MetricSummarytoSummary(ABC):
-    def __init__(self):
+    # metrics that compare summaries through a representation computed by `represent` (a class label, a number of
+    # named entities, embeddings) compute it only once per reference summary
+    has_reference_representation = False
+
+    def __init__(self, max_cached_references: int = 100000, max_cached_bytes: Optional[int] = None):
         self.name = None
         self.type = None
+        self.max_cached_references = max_cached_references
+        self.max_cached_bytes = max_cached_bytes
+        self.reference_cache = OrderedDict()
+        self.cached_bytes = 0
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
         pass
 
+    def represent(self, summaries: List[str]) -> List[Any]:
+        """Representation of the summaries that `compare` uses"""
+        raise NotImplementedError
+
+    def compare(self, generated_summaries: List[str], reference_representations: List[Any]) -> List[float]:
+        """Scores generated summaries against the representations of their references"""
+        raise NotImplementedError
+
+    def representation_size(self, representation: Any) -> int:
+        """Bytes a cached representation holds, counted against `max_cached_bytes`"""
+        return 0
+
+    def clear_reference_cache(self) -> None:
+        self.reference_cache.clear()
+        self.cached_bytes = 0
+
+    def prepare_references(self, reference_summaries: List[str]) -> Optional[List[Any]]:
+        """Representations of the reference summaries, memoized by text hash. None for metrics without them."""
+        if not self.has_reference_representation:
+            return None
+
+        keys = [text_hash(reference) if isinstance(reference, str) else None for reference in reference_summaries]
+        missing = {}
+        for key, reference in zip(keys, reference_summaries):
+            if key is not None and key not in self.reference_cache:
+                missing[key] = reference
+        if missing:
+            for key, representation in zip(missing, self.represent(list(missing.values()))):
+                self.reference_cache[key] = representation
+                self.cached_bytes += self.representation_size(representation)
+
+        representations = []
+        for key in keys:
+            if key is None:
+                representations.append(None)
+            else:
+                self.reference_cache.move_to_end(key)
+                representations.append(self.reference_cache[key])
+        while self.reference_cache and (len(self.reference_cache) > self.max_cached_references or (
+                self.max_cached_bytes is not None and self.cached_bytes > self.max_cached_bytes)):
+            _, representation = self.reference_cache.popitem(last=False)
+            self.cached_bytes -= self.representation_size(representation)
+        return representations
+
+    def compute_batch(self, generated_summaries: List[str], reference_summaries: List[str],
+                      reference_representations: Optional[List[Any]] = None) -> List[float]:
+        if reference_representations is None:
+            reference_representations = self.prepare_references(reference_summaries)
+        if reference_representations is None:
+            return [self.compute(generated, reference) for generated, reference in zip(generated_summaries,
+                                                                                       reference_summaries)]
+
+        # rows without a summary (failed generation) are left as NaN
+        scores = [float('nan')] * len(generated_summaries)
+        valid = [index for index, (generated, reference) in enumerate(zip(generated_summaries,
+                                                                          reference_representations))
+                 if isinstance(generated, str) and reference is not None]
+        if valid:
+            values = self.compare([generated_summaries[index] for index in valid],
+                                  [reference_representations[index] for index in valid])
+            for index, value in zip(valid, values):
+                scores[index] = value
+        return scores
+
     def __call__(self, generated_summary: str, reference_summary: str) -> float:
         return self.compute(generated_summary, reference_summary)
 
@@ -20,91 +97,309 @@ class MetricSummarytoSummary(ABC):
         return self.name
 
 
-class Rouge1(MetricSummarytoSummary):
+class RougeTokens:
+    """Sentences, words and word n-grams of a text, split the same way as in the rouge package"""
+
+    def __init__(self, text: str, ngram_sizes: List[int]):
+        sentences = [" ".join(_.split()) for _ in text.split(".") if len(_) > 0]
+        self.sentence_words = [sentence.split(" ") for sentence in sentences]
+        self.words = [word for words in self.sentence_words for word in words]
+        self.unique_words = len(set(self.words))
+        self.ngrams = {n: {tuple(self.words[i:i + n]) for i in range(len(self.words) - n + 1)} for n in ngram_sizes}
+
+
+def lcs_words(x: List[str], y: List[str]) -> set:
+    """Words of the longest common subsequence of x and y, reconstructed with the same tie-breaking as rouge"""
+    n, m = len(x), len(y)
+    table = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        x_i = x[i - 1]
+        row, previous_row = table[i], table[i - 1]
+        for j in range(1, m + 1):
+            if x_i == y[j - 1]:
+                row[j] = previous_row[j - 1] + 1
+            else:
+                row[j] = max(previous_row[j], row[j - 1])
+
+    words = set()
+    i, j = n, m
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.add(x[i - 1])
+            i -= 1
+            j -= 1
+        elif table[i - 1][j] > table[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+def f_r_p(overlap: float, evaluated_count: int, reference_count: int) -> Dict[str, float]:
+    precision = overlap / evaluated_count if evaluated_count else 0.0
+    recall = overlap / reference_count if reference_count else 0.0
+    f1_score = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+    return {"f": f1_score, "p": precision, "r": recall}
+
+
+class RougeScore(MetricSummarytoSummary):
+    """ROUGE-N and ROUGE-L computed in one pass, every text is tokenized once and every requested variant and
+    statistic becomes its own result column, e.g. `rouge-1_f`. Scores are the same as `rouge.Rouge().get_scores`."""
+    has_reference_representation = True
+
+    def __init__(self, variants: List[str] = None, stats: List[str] = None, max_cached_references: int = 100000):
+        super().__init__(max_cached_references=max_cached_references)
+        self.name = "RougeScore"
+        self.type = "occurrence"
+        self.variants = [variant.lower() for variant in (variants or ["rouge-1", "rouge-2", "rouge-l"])]
+        self.stats = [stat.lower() for stat in (stats or ["f", "p", "r"])]
+        for variant in self.variants:
+            if variant != "rouge-l" and not (variant.startswith("rouge-") and variant[6:].isdigit()):
+                raise ValueError(f"Unknown ROUGE variant '{variant}'")
+        for stat in self.stats:
+            if stat not in ("f", "p", "r"):
+                raise ValueError(f"Unknown ROUGE statistic '{stat}'")
+        self.ngram_sizes = [int(variant[6:]) for variant in self.variants if variant != "rouge-l"]
+        self.columns = [f"{variant}_{stat}" for variant in self.variants for stat in self.stats]
+
+    def represent(self, summaries: List[str]) -> List[Optional[RougeTokens]]:
+        tokens = [RougeTokens(summary, self.ngram_sizes) for summary in summaries]
+        # rouge refuses texts without any sentence
+        return [token if token.sentence_words else None for token in tokens]
+
+    def score(self, generated: RougeTokens, reference: RougeTokens) -> Dict[str, float]:
+        scores = {}
+        for variant in self.variants:
+            if variant == "rouge-l":
+                union = set()
+                for reference_words in reference.sentence_words:
+                    for generated_words in generated.sentence_words:
+                        union |= lcs_words(reference_words, generated_words)
+                values = f_r_p(len(union), generated.unique_words, reference.unique_words)
+            else:
+                n = int(variant[6:])
+                values = f_r_p(len(generated.ngrams[n] & reference.ngrams[n]), len(generated.ngrams[n]),
+                               len(reference.ngrams[n]))
+            for stat in self.stats:
+                scores[f"{variant}_{stat}"] = values[stat]
+        return scores
+
+    def compare(self, generated_summaries: List[str],
+                reference_representations: List[RougeTokens]) -> List[Optional[Dict[str, float]]]:
+        return [self.score(generated, reference) if generated is not None else None
+                for generated, reference in zip(self.represent(generated_summaries), reference_representations)]
+
+    def compute_batch(self, generated_summaries: List[str], reference_summaries: List[str],
+                      reference_representations: Optional[List[Any]] = None) -> Dict[str, List[float]]:
+        rows = super().compute_batch(generated_summaries, reference_summaries, reference_representations)
+        return {column: [row[column] if isinstance(row, dict) else float('nan') for row in rows]
+                for column in self.columns}
+
+    def compute(self, generated_summary: str, reference_summary: str) -> Dict[str, float]:
+        return {column: values[0] for column, values in
+                self.compute_batch([generated_summary], [reference_summary]).items()}
+
+
+class Rouge1(RougeScore):
     def __init__(self):
-        super().__init__()
+        super().__init__(variants=["rouge-1"], stats=["f"])
         self.name = "Rouge1"
-        self.type = "occurrence"
-        self.rouge = Rouge()
+
+    def compute_batch(self, generated_summaries: List[str], reference_summaries: List[str],
+                      reference_representations: Optional[List[Any]] = None) -> List[float]:
+        return super().compute_batch(generated_summaries, reference_summaries, reference_representations)["rouge-1_f"]
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        scores = self.rouge.get_scores(generated_summary, reference_summary)
-        return scores[0]["rouge-1"]["f"]
+        return self.compute_batch([generated_summary], [reference_summary])[0]
 
 
-class Rouge2(MetricSummarytoSummary):
+class Rouge2(RougeScore):
     def __init__(self):
-        super().__init__()
+        super().__init__(variants=["rouge-2"], stats=["f"])
         self.name = "Rouge2"
-        self.type = "occurrence"
-        self.rouge = Rouge()
+
+    def compute_batch(self, generated_summaries: List[str], reference_summaries: List[str],
+                      reference_representations: Optional[List[Any]] = None) -> List[float]:
+        return super().compute_batch(generated_summaries, reference_summaries, reference_representations)["rouge-2_f"]
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        scores = self.rouge.get_scores(generated_summary, reference_summary)
-        return scores[0]["rouge-2"]["f"]
+        return self.compute_batch([generated_summary], [reference_summary])[0]
 
 
-class RougeL(MetricSummarytoSummary):
+class RougeL(RougeScore):
     def __init__(self):
-        super().__init__()
+        super().__init__(variants=["rouge-l"], stats=["f"])
         self.name = "RougeL"
-        self.type = "occurrence"
-        self.rouge = Rouge()
+
+    def compute_batch(self, generated_summaries: List[str], reference_summaries: List[str],
+                      reference_representations: Optional[List[Any]] = None) -> List[float]:
+        return super().compute_batch(generated_summaries, reference_summaries, reference_representations)["rouge-l_f"]
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        scores = self.rouge.get_scores(generated_summary, reference_summary)
-        return scores[0]["rouge-l"]["f"]
+        return self.compute_batch([generated_summary], [reference_summary])[0]
 
 
 class BERTScore(MetricSummarytoSummary):
-    def __init__(self):
-        super().__init__()
+    """BERTScore F1. Reference embeddings are cached, the cache is bounded by `max_cached_references` and by
+    `max_cached_bytes` (an embedding of roberta-large takes about 250 KB per reference)."""
+    has_reference_representation = True
+
+    def __init__(self, lang: str = 'en', batch_size: int = 64, max_cached_references: int = 500,
+                 max_cached_bytes: int = 256 * 2 ** 20):
+        super().__init__(max_cached_references=max_cached_references, max_cached_bytes=max_cached_bytes)
         self.name = "BERTScore"
         self.type = "generation"
+        self.lang = lang
+        self.batch_size = batch_size
+        self.scorer = None
+
+    def get_scorer(self) -> bert_score.BERTScorer:
+        # the model is loaded once and kept for all the following calls
+        if self.scorer is None:
+            self.scorer = model_registry.get(('bert_score', self.lang),
+                                             lambda: bert_score.BERTScorer(lang=self.lang, batch_size=self.batch_size))
+            self.idf_dict = defaultdict(lambda: 1.0)
+            self.idf_dict[self.scorer._tokenizer.sep_token_id] = 0
+            self.idf_dict[self.scorer._tokenizer.cls_token_id] = 0
+        return self.scorer
+
+    def embed(self, sentences: List[str]) -> dict:
+        scorer = self.get_scorer()
+        # sentences of similar length are embedded together, as in bert_score
+        unique = sorted(set(sentences), key=lambda x: len(x.split(" ")), reverse=True)
+        stats = {}
+        for start in range(0, len(unique), self.batch_size):
+            batch = unique[start:start + self.batch_size]
+            embeddings, masks, padded_idf = get_bert_embedding(batch, scorer._model, scorer._tokenizer, self.idf_dict,
+                                                               device=scorer.device)
+            embeddings, masks, padded_idf = embeddings.cpu(), masks.cpu(), padded_idf.cpu()
+            for i, sentence in enumerate(batch):
+                length = masks[i].sum().item()
+                # copies, a view would keep the whole padded batch alive in the reference cache
+                stats[sentence] = (embeddings[i, :length].clone(), padded_idf[i, :length].clone())
+        return stats
+
+    def represent(self, summaries: List[str]) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        stats = self.embed(summaries)
+        return [stats[summary] for summary in summaries]
+
+    def representation_size(self, representation: Tuple[torch.Tensor, torch.Tensor]) -> int:
+        return sum(tensor.element_size() * tensor.nelement() for tensor in representation)
+
+    @staticmethod
+    def pad_stats(stats: List[Tuple[torch.Tensor, torch.Tensor]], device) -> Tuple[torch.Tensor, ...]:
+        embeddings = [embedding.to(device) for embedding, _ in stats]
+        idf = [weights.to(device) for _, weights in stats]
+        lengths = torch.tensor([embedding.size(0) for embedding in embeddings], dtype=torch.long)
+        mask = torch.arange(lengths.max(), dtype=torch.long).expand(len(lengths), lengths.max()) < lengths.unsqueeze(1)
+        return (pad_sequence(embeddings, batch_first=True, padding_value=2.0), mask.to(device),
+                pad_sequence(idf, batch_first=True))
+
+    def compare(self, generated_summaries: List[str],
+                reference_representations: List[Tuple[torch.Tensor, torch.Tensor]]) -> List[float]:
+        scorer = self.get_scorer()
+        device = next(scorer._model.parameters()).device
+        scores = []
+        with torch.no_grad():
+            # generated summaries are embedded one batch at a time, only the embeddings of a batch are held
+            for start in range(0, len(generated_summaries), self.batch_size):
+                batch_references = reference_representations[start:start + self.batch_size]
+                batch_generated = self.represent(generated_summaries[start:start + self.batch_size])
+                _, _, f1 = greedy_cos_idf(*self.pad_stats(batch_references, device),
+                                          *self.pad_stats(batch_generated, device), scorer.all_layers)
+                scores.extend(f1.cpu().tolist())
+        return scores
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        return bert_score.score([generated_summary], [reference_summary], lang='en')[2].item()
+        return self.compute_batch([generated_summary], [reference_summary])[0]
 
 
 class SentimentScore(MetricSummarytoSummary):
-    def __init__(self):
+    has_reference_representation = True
+
+    def __init__(self, batch_size: int = 32, truncation: bool = True):
         super().__init__()
         self.name = "SentimentScore"
         self.type = "sentiment"
-        tokenizer = AutoTokenizer.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment-latest")
-        model = AutoModelForSequenceClassification.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment-latest")
-        self.sentiment_classifier = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+        self.batch_size = batch_size
+        self.truncation = truncation
+        self.sentiment_classifier = get_hf_pipeline("sentiment-analysis",
+                                                    "cardiffnlp/twitter-roberta-base-sentiment-latest",
+                                                    AutoModelForSequenceClassification)
 
     def predict_class(self, text: str):
-        return self.sentiment_classifier(text)[0]
+        return self.sentiment_classifier(text, truncation=self.truncation)[0]
+
+    def predict_classes(self, texts: List[str]) -> List[dict]:
+        if not texts:
+            return []
+        return self.sentiment_classifier(texts, batch_size=self.batch_size, truncation=self.truncation)
+
+    def represent(self, summaries: List[str]) -> List[str]:
+        return [prediction["label"] for prediction in self.predict_classes(summaries)]
+
+    def compare(self, generated_summaries: List[str], reference_representations: List[str]) -> List[float]:
+        generated_labels = self.represent(generated_summaries)
+        return [1 if reference_label == generated_label else 0
+                for reference_label, generated_label in zip(reference_representations, generated_labels)]
 
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        scores_referece = self.predict_class(reference_summary)
-        scores_generated = self.predict_class(generated_summary)
-        if scores_referece["label"] == scores_generated["label"]:
-            return 1
-        else:
-            return 0
+        return self.compute_batch([generated_summary], [reference_summary])[0]
 
 
 class NamedEntitiesScore(MetricSummarytoSummary):
-    def __init__(self):
+    """Ratio of the number of named entities in the generated summary to the number in the reference summary.
+    NaN when the reference has no named entities."""
+    has_reference_representation = True
+
+    def __init__(self, batch_size: int = 32, truncation: bool = True):
         super().__init__()
         self.name = "NamedEntitiesScore"
         self.type = "named_entities"
-        ner_tokenizer = AutoTokenizer.from_pretrained("dslim/bert-base-NER")
-        ner_model = AutoModelForTokenClassification.from_pretrained("dslim/bert-base-NER")
-        self.ner = pipeline("ner", model=ner_model, tokenizer=ner_tokenizer)
+        self.batch_size = batch_size
+        self.truncation = truncation
+        # the same pipeline as the NamedEntities attack with this model, loaded once per process
+        self.ner = get_hf_pipeline("ner", "dslim/bert-base-NER", AutoModelForTokenClassification)
 
-    def number_of_named_entities(self, summary: str) -> int:
+    def truncate(self, texts: List[str]) -> List[str]:
+        """Cuts texts after the last character that fits in the model input, the NER pipeline does not truncate"""
+        if not self.truncation or not self.ner.tokenizer.is_fast:
+            return texts
+        tokenizer = self.ner.tokenizer
+        max_length = min(tokenizer.model_max_length, self.ner.model.config.max_position_embeddings)
+        encoded = tokenizer(texts, truncation=True, max_length=max_length, return_offsets_mapping=True)
+        truncated = []
+        for text, input_ids, offsets in zip(texts, encoded["input_ids"], encoded["offset_mapping"]):
+            if len(input_ids) < max_length:
+                truncated.append(text)
+            else:
+                truncated.append(text[:max(offset_end for _, offset_end in offsets)])
+        return truncated
+
+    @staticmethod
+    def count_entities(entities: List[dict]) -> int:
         number_of_ne = 0
-        entities = self.ner(summary)
         for entity in entities:
             if entity["entity"] != "O":
                 number_of_ne += 1
         return number_of_ne
 
+    def number_of_named_entities(self, summary: str) -> int:
+        return self.count_entities(self.ner(self.truncate([summary])[0]))
+
+    def numbers_of_named_entities(self, summaries: List[str]) -> List[int]:
+        if not summaries:
+            return []
+        return [self.count_entities(entities)
+                for entities in self.ner(self.truncate(summaries), batch_size=self.batch_size)]
+
+    def represent(self, summaries: List[str]) -> List[int]:
+        return self.numbers_of_named_entities(summaries)
+
+    def compare(self, generated_summaries: List[str], reference_representations: List[int]) -> List[float]:
+        return [number_of_ne_generated / number_of_ne_reference if number_of_ne_reference else float('nan')
+                for number_of_ne_reference, number_of_ne_generated
+                in zip(reference_representations, self.represent(generated_summaries))]
+
     def compute(self, generated_summary: str, reference_summary: str) -> float:
-        number_of_ne_reference = self.number_of_named_entities(reference_summary)
-        number_of_ne_generated = self.number_of_named_entities(generated_summary)
-        return number_of_ne_generated / number_of_ne_reference
+        return self.compute_batch([generated_summary], [reference_summary])[0]
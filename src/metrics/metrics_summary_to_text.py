@@ -1,11 +1,9 @@
 from abc import ABC
 from factsumm import FactSumm
 import stylo_metrix
-import spacy
-from typing import List, Dict
-from collections import Counter
-from nltk import ngrams
-from nltk.tokenize import word_tokenize
+from typing import List, Dict, Optional
+from src.metrics.ngram_index import NGramIndex
+from src.utils.model_registry import model_registry
 
 
 class MetricOriginalTextToSummary(ABC):
@@ -16,6 +14,9 @@ class MetricOriginalTextToSummary(ABC):
     def compute(self, generated_summary: str, original_text: str) -> float:
         pass
 
+    def compute_batch(self, generated_summaries: List[str], original_texts: List[str]) -> list:
+        return [self.compute(generated, original) for generated, original in zip(generated_summaries, original_texts)]
+
     def __call__(self, generated_summary: str, original_text: str) -> float:
         return self.compute(generated_summary, original_text)
 
@@ -36,36 +37,30 @@ class FactSummScore(MetricOriginalTextToSummary):
 
 
 class NovelNGrams(MetricOriginalTextToSummary):
-    def __init__(self, n=None):
+    """Number of summary n-grams that occur more often in the summary than in the original text.
+
+    Original texts are tokenized once into an `NGramIndex` shared by all attacks, at most `index_max_memory_bytes`
+    of it are kept in memory. With `index_path` set, the index is kept on disk so repeated runs over the same dataset
+    skip tokenizing the articles, the texts of every batch are appended to it as one part.
+    """
+
+    def __init__(self, n=None, index_path: Optional[str] = None, index_max_memory_bytes: int = 512 * 2 ** 20):
         super().__init__()
         if n is None:
             n = [3, 4, 5]
         self.name = "NovelNGrams"
         self.type = "occurrence"
         self.n = n
+        self.index = NGramIndex(n, path=index_path, max_memory_bytes=index_max_memory_bytes)
 
     def compute(self, generated_summary: str, original_text: str) -> dict[int, int]:
-        novel_ngrams_count = dict()
-        original_tokens = word_tokenize(original_text)
-        summary_tokens = word_tokenize(generated_summary)
-        for n in self.n:
-            # Generate n-grams for the original text and the generated summary
-            original_ngrams = list(ngrams(original_tokens, n))
-            summary_ngrams = list(ngrams(summary_tokens, n))
-
-            # Count the occurrences of n-grams in the original text and the generated summary
-            original_ngram_counts = Counter(original_ngrams)
-            summary_ngram_counts = Counter(summary_ngrams)
-
-            # Compute the number of novel n-grams
-            novel_ngrams = 0
-            for ngram, count in summary_ngram_counts.items():
-                if original_ngram_counts[ngram] < count:
-                    novel_ngrams += 1
-
-            novel_ngrams_count[n] = novel_ngrams
+        return self.index.novel_ngrams(generated_summary, original_text)
 
-        return novel_ngrams_count
+    def compute_batch(self, generated_summaries: List[str], original_texts: List[str]) -> List[Dict[int, int]]:
+        self.index.add_many(original_texts)
+        if self.index.path is not None and self.index.modified:
+            self.index.save()
+        return [self.compute(generated, original) for generated, original in zip(generated_summaries, original_texts)]
 
 
 class Stylometrix(MetricOriginalTextToSummary):
@@ -75,9 +70,10 @@ class Stylometrix(MetricOriginalTextToSummary):
         super().__init__()
         self.name = "Stylometrix"
         self.type = "stylometry"
-        nlp = spacy.load("en_core_web_trf")
-        self.sm = stylo_metrix.StyloMetrix('eng')
-        self.nlp = self.sm._nlp
+        # StyloMetrix adds its own pipes to the spaCy model it gets, so it loads its own copy instead of the shared
+        # one, the instance itself is shared by the runs of the process
+        self.sm = model_registry.get(('stylometrix', 'eng'), lambda: stylo_metrix.StyloMetrix('eng'))
+        self.nlp = self.sm.nlp
 
     def compute(self, text:str) -> str:
         stylo = self.sm.transform(text)
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import numpy as np
+from nltk.tokenize import word_tokenize
+from src.utils.cache import text_hash
+
+# odd 64-bit multiplier used to mix token hashes into n-gram hashes, arithmetic wraps modulo 2**64
+NGRAM_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_tokens(tokens: List[str]) -> np.ndarray:
+    """64-bit hash of every token"""
+    return np.array([int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for token in tokens], dtype=np.uint64)
+
+
+def hash_ngrams(token_hashes: np.ndarray, n: int) -> np.ndarray:
+    """64-bit hash of every n-gram of consecutive tokens"""
+    if len(token_hashes) < n:
+        return np.empty(0, dtype=np.uint64)
+    hashes = token_hashes[:len(token_hashes) - n + 1].copy()
+    for offset in range(1, n):
+        hashes *= NGRAM_MULTIPLIER
+        hashes ^= token_hashes[offset:len(token_hashes) - n + 1 + offset]
+    return hashes
+
+
+def count_ngrams(token_hashes: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted unique n-gram hashes and their counts"""
+    return np.unique(hash_ngrams(token_hashes, n), return_counts=True)
+
+
+class NGramIndex:
+    """Hashed n-gram counts of source documents, built once per document and keyed by its text hash.
+
+    Every document is stored as sorted arrays of unique n-gram hashes and their counts, so looking up the n-grams of
+    a summary is a `searchsorted` call. Documents kept in memory are bounded by `max_memory_bytes`, least recently
+    used ones are dropped first.
+
+    With `path` set, the index is kept in a directory of `.npz` parts. `save` appends the documents added since the
+    previous save as a new part, and documents dropped from memory are read back from their part when needed.
+    """
+
+    def __init__(self, n: Iterable[int] = (3, 4, 5), path: Optional[str] = None,
+                 tokenizer: Callable[[str], List[str]] = word_tokenize, max_memory_bytes: Optional[int] = 512 * 2 ** 20):
+        self.n = list(n)
+        self.path = path
+        self.tokenizer = tokenizer
+        self.max_memory_bytes = max_memory_bytes
+        self.documents: OrderedDict = OrderedDict()
+        self.memory_bytes = 0
+        # documents added since the last save, kept in memory until they are saved
+        self.pending: Dict[str, None] = {}
+        # part file of every saved document
+        self.parts: Dict[str, str] = {}
+        self.number_of_parts = 0
+        if path is not None and os.path.isdir(path):
+            self.load(path)
+
+    @property
+    def modified(self) -> bool:
+        return bool(self.pending)
+
+    def count(self, text: str) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        token_hashes = hash_tokens(self.tokenizer(text))
+        return {n: count_ngrams(token_hashes, n) for n in self.n}
+
+    @staticmethod
+    def document_size(document: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> int:
+        return sum(hashes.nbytes + counts.nbytes for hashes, counts in document.values())
+
+    def get(self, text: str) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        key = text_hash(text)
+        document = self.documents.get(key)
+        if document is not None:
+            self.documents.move_to_end(key)
+            return document
+        if key in self.parts:
+            return self.load_part(self.parts[key], key)
+        document = self.count(text)
+        if self.path is not None:
+            # without a path, documents dropped from memory are counted again when needed
+            self.pending[key] = None
+        self.add(key, document)
+        return document
+
+    def add(self, key: str, document: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> None:
+        self.documents[key] = document
+        self.memory_bytes += self.document_size(document)
+        self.evict()
+
+    def evict(self) -> None:
+        """Drops least recently used saved documents until the documents in memory fit in `max_memory_bytes`"""
+        if self.max_memory_bytes is None:
+            return
+        while self.memory_bytes > self.max_memory_bytes and len(self.documents) > len(self.pending) + 1:
+            oldest = next(key for key in self.documents if key not in self.pending)
+            self.memory_bytes -= self.document_size(self.documents.pop(oldest))
+
+    def add_many(self, texts: Iterable[str]) -> None:
+        for text in texts:
+            self.get(text)
+
+    @staticmethod
+    def lookup(document: Tuple[np.ndarray, np.ndarray], ngram_hashes: np.ndarray) -> np.ndarray:
+        """Counts of the given n-gram hashes in the document, 0 for n-grams it does not contain"""
+        hashes, counts = document
+        if len(hashes) == 0:
+            return np.zeros(len(ngram_hashes), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(hashes, ngram_hashes), len(hashes) - 1)
+        return np.where(hashes[positions] == ngram_hashes, counts[positions], 0)
+
+    def novel_ngrams(self, summary: str, text: str) -> Dict[int, int]:
+        """Number of distinct summary n-grams occurring more often in the summary than in the text"""
+        document = self.get(text)
+        summary_hashes = hash_tokens(self.tokenizer(summary))
+        novel_ngrams_count = {}
+        for n in self.n:
+            ngram_hashes, counts = count_ngrams(summary_hashes, n)
+            novel_ngrams_count[n] = int(np.count_nonzero(self.lookup(document[n], ngram_hashes) < counts))
+        return novel_ngrams_count
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Appends the documents added since the previous save to the index directory as a new part"""
+        path = path or self.path
+        if not self.pending:
+            return
+        keys = list(self.pending)
+        arrays = {'keys': np.array(keys, dtype=str), 'n': np.array(self.n, dtype=np.int64)}
+        for n in self.n:
+            documents = [self.documents[key][n] for key in keys]
+            arrays[f'offsets_{n}'] = np.cumsum([0] + [len(hashes) for hashes, _ in documents], dtype=np.int64)
+            arrays[f'hashes_{n}'] = np.concatenate([hashes for hashes, _ in documents]).astype(np.uint64)
+            arrays[f'counts_{n}'] = np.concatenate([counts for _, counts in documents]).astype(np.int64)
+        os.makedirs(path, exist_ok=True)
+        part_path = os.path.join(path, f"part_{self.number_of_parts:05d}.npz")
+        # np.savez appends .npz to paths without it, write to a temporary file and move it in place
+        temporary_path = part_path + '.tmp.npz'
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, part_path)
+        self.number_of_parts += 1
+        for key in keys:
+            self.parts[key] = part_path
+        self.pending = {}
+        self.evict()
+
+    def load(self, path: str) -> None:
+        """Reads the document keys of every part, documents themselves are read when they are looked up"""
+        for file in sorted(os.listdir(path)):
+            if not (file.startswith('part_') and file.endswith('.npz')) or file.endswith('.tmp.npz'):
+                continue
+            self.number_of_parts += 1
+            part_path = os.path.join(path, file)
+            with np.load(part_path) as data:
+                if sorted(data['n'].tolist()) != sorted(self.n):
+                    print(f"N-gram index part {part_path} was built for n={data['n'].tolist()}, ignoring it...")
+                    continue
+                for key in data['keys'].tolist():
+                    self.parts[key] = part_path
+
+    def load_part(self, part_path: str, key: str) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Adds the documents of a part that are not in memory, documents of a part tend to be looked up together.
+        Returns the document of `key`."""
+        documents = {}
+        with np.load(part_path) as data:
+            keys = data['keys'].tolist()
+            for n in self.n:
+                offsets, hashes, counts = data[f'offsets_{n}'], data[f'hashes_{n}'], data[f'counts_{n}']
+                for index, part_key in enumerate(keys):
+                    start, end = offsets[index], offsets[index + 1]
+                    # copies, views would keep the arrays of the whole part alive
+                    documents.setdefault(part_key, {})[n] = (hashes[start:end].copy(), counts[start:end].copy())
+        # the requested document is added last, so it is the most recently used one
+        document = documents.pop(key)
+        for part_key, part_document in documents.items():
+            if part_key not in self.documents:
+                self.add(part_key, part_document)
+        self.add(key, document)
+        return document
+
+    def __contains__(self, text: str) -> bool:
+        key = text_hash(text)
+        return key in self.documents or key in self.parts
+
+    def __len__(self) -> int:
+        return len(self.parts.keys() | self.documents.keys())
@@ -0,0 +1,120 @@
+from typing import List, Optional, Tuple
+import asyncio
+import random
+import time
+from src.summarization.summarizer import Summarizer
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`, holding at most one minute worth of tokens"""
+
+    def __init__(self, rate_per_minute: float, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # a single request larger than the bucket would never fit, it is allowed once the bucket is full
+        amount = min(amount, self.capacity)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class AsyncSummarizationEngine:
+    """Summarizes many texts concurrently with a summarizer that implements `agenerate`.
+
+    `max_concurrency` workers take texts from a queue, every request waits for requests-per-minute and
+    tokens-per-minute token buckets. Summaries are cached as soon as they are generated.
+    Retryable errors are retried with exponential backoff and full jitter, every attempt has its own timeout.
+    """
+
+    def __init__(self, summarizer: Summarizer, max_concurrency: int = 8, requests_per_minute: int = 3500,
+                 tokens_per_minute: int = 90000, timeout: float = 60.0, max_retries: int = 6,
+                 initial_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.summarizer = summarizer
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self.failures = 0
+
+    def run(self, texts: List[str]) -> List[Optional[str]]:
+        """Returns one summary per text, None for texts that could not be summarized"""
+        return asyncio.run(self.arun(texts))
+
+    async def arun(self, texts: List[str]) -> List[Optional[str]]:
+        results: List[Optional[str]] = [None] * len(texts)
+        cache = self.summarizer.cache
+
+        pending = list(range(len(texts)))
+        keys = []
+        if cache is not None:
+            keys = [self.summarizer.cache_key(text) for text in texts]
+            cached = cache.get_many(keys)
+            pending = []
+            for index, key in enumerate(keys):
+                if key in cached:
+                    results[index] = cached[key]['summary']
+                else:
+                    pending.append(index)
+
+        queue = asyncio.Queue()
+        for index in pending:
+            queue.put_nowait(index)
+        request_bucket = TokenBucket(self.requests_per_minute)
+        token_bucket = TokenBucket(self.tokens_per_minute)
+
+        async def worker():
+            # only `max_concurrency` workers wait on the buckets, not every pending text
+            while not queue.empty():
+                index = queue.get_nowait()
+                try:
+                    summary, latency, usage = await self._summarize(texts[index], request_bucket, token_bucket)
+                except Exception as e:
+                    print(e)
+                    print("Couldn't generate summary...")
+                    self.failures += 1
+                    continue
+                results[index] = summary
+                # cached as soon as it is generated, an interrupted run does not pay for it again
+                if cache is not None:
+                    cache.set(keys[index], {'summary': summary, 'latency': latency, 'usage': usage})
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(pending)))))
+        return results
+
+    async def _summarize(self, text: str, request_bucket: TokenBucket,
+                         token_bucket: TokenBucket) -> Tuple[str, float, dict]:
+        retryable_errors = tuple(self.summarizer.retryable_errors) + (asyncio.TimeoutError,)
+        for attempt in range(self.max_retries + 1):
+            await request_bucket.acquire(1)
+            await token_bucket.acquire(self.summarizer.estimate_tokens(text))
+            try:
+                start = time.perf_counter()
+                summary, usage = await asyncio.wait_for(self.summarizer.agenerate(text), self.timeout)
+                return summary, time.perf_counter() - start, usage
+            except retryable_errors as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                delay = random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+                print(f"{type(e).__name__}: {e}, retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
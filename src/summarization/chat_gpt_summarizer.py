@@ -1,34 +1,53 @@
+from typing import Any, Dict, Tuple
 from src.summarization import Summarizer
 import openai
 
 
 class ChatGPTSummarizer(Summarizer):
-    def __init__(self, prompt: str, temperature: float, openai_apikey: str):
-        super().__init__()
+    retryable_errors = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                        openai.error.ServiceUnavailableError, openai.error.APIConnectionError)
+
+    def __init__(self, prompt: str, temperature: float, openai_apikey: str, model_name: str = "gpt-3.5-turbo",
+                 max_tokens: int = 50, cache_path: str = None, cache_max_size: int = None, api_base: str = None):
+        super().__init__(cache_path=cache_path, cache_max_size=cache_max_size)
         self.name = "Chat GPT Summarizer"
         self.prompt = prompt
         self.temperature = temperature
         self.openai_apikey = openai_apikey
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.api_base = api_base
 
-    def generate_summary(self, text: str) -> str:
+    def build_prompt(self, text: str) -> str:
         text_length = len(text)
         prompt_length = len(self.prompt)
         if text_length + prompt_length > 4097:
             text = text[:4097 - prompt_length]
 
-        full_prompt = f"{self.prompt} {text} \n"
-
-        openai.api_key = self.openai_apikey
+        return f"{self.prompt} {text} \n"
 
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
+    def request_params(self, text: str) -> Dict[str, Any]:
+        params = dict(
+            model=self.model_name,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": f"{full_prompt}"},
+                {"role": "user", "content": f"{self.build_prompt(text)}"},
             ],
             temperature=self.temperature,
-            max_tokens=50,
+            max_tokens=self.max_tokens,
             n=1,
+            api_key=self.openai_apikey,
         )
+        if self.api_base is not None:
+            params['api_base'] = self.api_base
+        return params
+
+    def generate_summary(self, text: str) -> str:
+        response = openai.ChatCompletion.create(**self.request_params(text))
         summary = response.choices[0]['message']['content']
+        self.last_usage = dict(response.get('usage', {}))
         return summary
+
+    async def agenerate(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        response = await openai.ChatCompletion.acreate(**self.request_params(text))
+        return response.choices[0]['message']['content'], dict(response.get('usage', {}))
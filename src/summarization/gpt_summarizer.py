@@ -1,36 +1,54 @@
+from typing import Any, Dict, Tuple
 from src.summarization import Summarizer
 import openai
 
 
 class GPTSummarizer(Summarizer):
-    def __init__(self, prompt: str, temperature: float, model_name: str, openai_apikey: str):
-        super().__init__()
+    retryable_errors = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                        openai.error.ServiceUnavailableError, openai.error.APIConnectionError)
+
+    def __init__(self, prompt: str, temperature: float, model_name: str, openai_apikey: str, max_tokens: int = 80,
+                 cache_path: str = None, cache_max_size: int = None, api_base: str = None):
+        super().__init__(cache_path=cache_path, cache_max_size=cache_max_size)
         self.name = "GPT Summarizer"
         self.prompt = prompt
         self.temperature = temperature
         self.model_name = model_name
         self.openai_apikey = openai_apikey
+        self.max_tokens = max_tokens
+        self.api_base = api_base
 
-    def generate_summary(self, text: str) -> str:
+    def build_prompt(self, text: str) -> str:
         text_length = len(text)
         prompt_length = len(self.prompt)
         if text_length + prompt_length > 4097:
             text = text[:4097 - prompt_length]
 
-        full_prompt = f"{self.prompt} {text} \n"
-
-        openai.api_key = self.openai_apikey
+        return f"{self.prompt} {text} \n"
 
-        response = openai.Completion.create(
+    def request_params(self, text: str) -> Dict[str, Any]:
+        params = dict(
             engine=self.model_name,
-            prompt=full_prompt,
+            prompt=self.build_prompt(text),
             temperature=self.temperature,
-            max_tokens=80,
+            max_tokens=self.max_tokens,
             top_p=1,
             n=1,
             stop=None,
             frequency_penalty=0,
             presence_penalty=0,
+            api_key=self.openai_apikey,
         )
+        if self.api_base is not None:
+            params['api_base'] = self.api_base
+        return params
+
+    def generate_summary(self, text: str) -> str:
+        response = openai.Completion.create(**self.request_params(text))
         summary = response.choices[0].text.strip()
+        self.last_usage = dict(response.get('usage', {}))
         return summary
+
+    async def agenerate(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        response = await openai.Completion.acreate(**self.request_params(text))
+        return response.choices[0].text.strip(), dict(response.get('usage', {}))
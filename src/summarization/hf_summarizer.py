@@ -1,43 +1,112 @@
+from typing import List, Tuple
+import importlib.util
 from src.summarization import Summarizer
 from transformers import AutoTokenizer, AutoModelForCausalLM
-import transformers
 import torch
+from src.utils.cache import make_key
+from src.utils.model_registry import model_registry
 
 
 class HfSummarizer(Summarizer):
-    def __init__(self, prompt: str, temperature: float, model_name: str = "t5-base"):
-        super().__init__()
+    def __init__(self, prompt: str, temperature: float, model_name: str = "t5-base", max_tokens: int = 200,
+                 batch_size: int = 8, cache_path: str = None, cache_max_size: int = None, torch_dtype: str = None,
+                 device_map: str = None, return_full_text: bool = True):
+        super().__init__(cache_path=cache_path, cache_max_size=cache_max_size)
         self.name = "Huggingface Summarizer"
         self.prompt = prompt
         self.temperature = temperature
-        self.model = model_name
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model)
-        self.model = AutoModelForCausalLM.from_pretrained(self.model)
-        self.pipeline = transformers.pipeline(
-            "text-generation",
-            model=self.model,
-            tokenizer=self.tokenizer,
-            torch_dtype=torch.bfloat16,
-            trust_remote_code=True,
-            device_map="auto",
-            )        
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.torch_dtype = torch_dtype
+        self.device_map = device_map
+        # like the text-generation pipeline, the summary starts with the prompt unless this is False
+        self.return_full_text = return_full_text
+        # summarizers with other prompts or temperatures in the same process share the tokenizer and the model
+        self.tokenizer, self.model = model_registry.get(('causal-lm', self.model_name, torch_dtype, device_map),
+                                                        self.load_model)
+        self.model.eval()
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # the prompt is built as f"{prompt} {text} \n", its fixed parts are tokenized only once
+        self.prefix_ids = self.tokenizer(f"{self.prompt} ")["input_ids"]
+        self.suffix_ids = self.tokenizer(" \n", add_special_tokens=False)["input_ids"]
+        self.context_length = self.get_context_length()
+
+    def load_model(self):
+        """Loads the model with the default dtype on the CPU unless `torch_dtype` or `device_map` are configured"""
+        kwargs = {}
+        if self.torch_dtype is not None:
+            kwargs['torch_dtype'] = getattr(torch, self.torch_dtype)
+        if self.device_map is not None:
+            # transformers places the model with accelerate, which is not a dependency of the project
+            if importlib.util.find_spec('accelerate') is not None:
+                kwargs['device_map'] = self.device_map
+            else:
+                print(f"accelerate is not installed, ignoring device_map={self.device_map!r}")
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, **kwargs)
+        if 'device_map' not in kwargs and self.device_map is not None and torch.cuda.is_available():
+            model = model.to('cuda')
+        return tokenizer, model
+
+    def get_context_length(self) -> int:
+        lengths = [getattr(self.model.config, 'max_position_embeddings', None), self.tokenizer.model_max_length]
+        # tokenizers without a limit report a huge sentinel value
+        lengths = [length for length in lengths if length is not None and length < 1_000_000]
+        return min(lengths) if lengths else 1024
+
+    def cache_key(self, text: str) -> str:
+        return make_key(super().cache_key(text), self.return_full_text)
+
+    def encode(self, texts: List[str]) -> Tuple[List[List[int]], List[str]]:
+        """Tokenizes the prompts, truncating each text so that the prompt and `max_tokens` new tokens fit in the
+        context, and returns them with the prompts as text"""
+        budget = max(self.context_length - self.max_tokens - len(self.prefix_ids) - len(self.suffix_ids), 0)
+        text_ids = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        encoded = [self.prefix_ids + ids[:budget] + self.suffix_ids for ids in text_ids]
+        prompts = [f"{self.prompt} {text if len(ids) <= budget else self.tokenizer.decode(ids[:budget])} \n"
+                   for text, ids in zip(texts, text_ids)]
+        return encoded, prompts
+
+    def generate_summaries(self, texts: List[str]) -> List[str]:
+        encoded, prompts = self.encode(texts)
+        # length buckets: consecutive prompts of similar length share a batch, which keeps padding small
+        order = sorted(range(len(encoded)), key=lambda index: len(encoded[index]))
+        summaries = [None] * len(texts)
+        usage = [None] * len(texts)
+        pad_id = self.tokenizer.pad_token_id
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            longest = max(len(encoded[index]) for index in batch)
+            # left padding so that generation continues right after every prompt
+            input_ids = torch.tensor([[pad_id] * (longest - len(encoded[index])) + encoded[index] for index in batch])
+            attention_mask = torch.tensor([[0] * (longest - len(encoded[index])) + [1] * len(encoded[index])
+                                           for index in batch])
+            with torch.inference_mode():
+                sequences = self.model.generate(
+                    input_ids=input_ids.to(self.model.device),
+                    attention_mask=attention_mask.to(self.model.device),
+                    max_new_tokens=self.max_tokens,
+                    do_sample=True,
+                    top_k=1,
+                    num_return_sequences=1,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    pad_token_id=pad_id,
+                    )
+            generated = sequences[:, longest:].tolist()
+            for index, tokens in zip(batch, generated):
+                completion = [token for token in tokens if token != pad_id]
+                summary = self.tokenizer.decode(completion, skip_special_tokens=True)
+                if self.return_full_text:
+                    summary = prompts[index] + summary
+                summaries[index] = summary.strip()
+                usage[index] = {'prompt_tokens': len(encoded[index]), 'completion_tokens': len(completion),
+                                'total_tokens': len(encoded[index]) + len(completion)}
+        self.last_batch_usage = usage
+        return summaries
 
     def generate_summary(self, text: str) -> str:
-        text_length = len(text)
-        prompt_length = len(self.prompt)
-        if text_length + prompt_length > 4097:
-            text = text[:4097 - prompt_length]
-
-        full_prompt = f"{self.prompt} {text} \n"
-
-        sequences = self.pipeline(
-            full_prompt,
-            max_length=200,
-            do_sample=True,
-            top_k=1,
-            num_return_sequences=1,
-            eos_token_id=self.tokenizer.eos_token_id,
-            )
-
-        summary = sequences[0]["generated_text"].strip()
+        summary = self.generate_summaries([text])[0]
+        self.last_usage = self.last_batch_usage[0]
         return summary
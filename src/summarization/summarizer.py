@@ -1,15 +1,87 @@
 from abc import ABC
+from typing import Any, Dict, List, Optional
+import time
+from src.utils.cache import DiskCache, make_key, text_hash
 
 
 class Summarizer(ABC):
-    def __init__(self):
+    # errors after which a request can be retried, used by the async summarization engine
+    retryable_errors = ()
+
+    def __init__(self, cache_path: Optional[str] = None, cache_max_size: Optional[int] = None):
         self.name = None
+        self.model_name = None
+        self.prompt = None
+        self.temperature = None
+        self.max_tokens = None
+        # token usage of the last generate_summary call, set by the subclasses
+        self.last_usage: Optional[Dict[str, Any]] = None
+        # token usage of every text of the last generate_summaries call
+        self.last_batch_usage: Optional[List[Optional[Dict[str, Any]]]] = None
+        self.cache = None
+        if cache_path is not None:
+            self.cache = DiskCache(cache_path, max_size_bytes=cache_max_size)
 
     def generate_summary(self, text: str) -> str:
         pass
 
+    def generate_summaries(self, texts: List[str]) -> List[str]:
+        summaries = []
+        usage = []
+        for text in texts:
+            self.last_usage = None
+            summaries.append(self.generate_summary(text))
+            usage.append(self.last_usage)
+        self.last_batch_usage = usage
+        return summaries
+
+    def estimate_tokens(self, text: str) -> int:
+        """Rough number of tokens a request for `text` consumes, about four characters per token"""
+        return (len(self.prompt or '') + len(text)) // 4 + (self.max_tokens or 0)
+
+    def cache_key(self, text: str) -> str:
+        return make_key(type(self).__name__, self.model_name, self.prompt, self.temperature, self.max_tokens,
+                        text_hash(text))
+
+    def summarize(self, text: str) -> str:
+        """Returns a cached summary if there is one, otherwise generates and caches it with latency and usage"""
+        if self.cache is None:
+            return self.generate_summary(text)
+
+        key = self.cache_key(text)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry['summary']
+
+        self.last_usage = None
+        start = time.perf_counter()
+        summary = self.generate_summary(text)
+        latency = time.perf_counter() - start
+        self.cache.set(key, {'summary': summary, 'latency': latency, 'usage': self.last_usage})
+        return summary
+
+    def summarize_batch(self, texts: List[str]) -> List[str]:
+        """Batch version of summarize, only the texts missing from the cache are passed to generate_summaries"""
+        if self.cache is None:
+            return self.generate_summaries(texts)
+
+        keys = [self.cache_key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = [index for index, key in enumerate(keys) if key not in cached]
+        if missing:
+            self.last_batch_usage = None
+            start = time.perf_counter()
+            summaries = self.generate_summaries([texts[index] for index in missing])
+            latency = (time.perf_counter() - start) / len(missing)
+            usage = self.last_batch_usage or [None] * len(missing)
+            new_entries = {keys[index]: {'summary': summary, 'latency': latency, 'usage': item_usage}
+                           for index, summary, item_usage in zip(missing, summaries, usage)}
+            self.cache.set_many(new_entries.items())
+            cached.update(new_entries)
+        return [cached[key]['summary'] for key in keys]
+
     def __call__(self, text: str) -> str:
         return self.summarize(text)
 
     def __name__(self):
-        return self.name
\ No newline at end of file
+        return self.name
@@ -0,0 +1,142 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_key(*parts: Any) -> str:
+    """Stable content hash of JSON-serializable key parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def text_hash(text: Any) -> str:
+    return make_key(text)
+
+
+class DiskCache:
+    """Persistent key-value store backed by SQLite.
+
+    Values are stored as JSON. When `max_size_bytes` is set, the least recently accessed entries are evicted once
+    the stored values exceed it. Hits and misses are counted per instance.
+    """
+
+    def __init__(self, path: str, max_size_bytes: Optional[int] = None):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            if found:
+                now = time.time()
+                self._connection.executemany("UPDATE cache SET accessed = ? WHERE key = ?",
+                                             [(now, key) for key in found])
+                self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: Any) -> None:
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        now = time.time()
+        rows = []
+        for key, value in items:
+            encoded = json.dumps(value, ensure_ascii=False)
+            rows.append((key, encoded, len(encoded.encode('utf-8')), now))
+        if not rows:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+            self._connection.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone() is not None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self),
+            'size_bytes': self.size(),
+        }
+
+    def merge(self, paths: Iterable[str]) -> None:
+        """Copies the entries of other caches that are missing from this one"""
+        with self._lock:
+            for path in paths:
+                if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(self.path):
+                    continue
+                self._connection.execute("ATTACH DATABASE ? AS other", (path,))
+                try:
+                    self._connection.execute("INSERT OR IGNORE INTO cache SELECT key, value, size, accessed "
+                                             "FROM other.cache")
+                    self._connection.commit()
+                finally:
+                    self._connection.execute("DETACH DATABASE other")
+            self._evict()
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _evict(self) -> None:
+        if self.max_size_bytes is None:
+            return
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        to_delete = []
+        for key, size in self._connection.execute("SELECT key, size FROM cache ORDER BY accessed ASC"):
+            if total <= self.max_size_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM cache WHERE key = ?", to_delete)
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_size_bytes': self.max_size_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['max_size_bytes'])
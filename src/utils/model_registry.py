@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional, Tuple
+import threading
+import spacy
+
+
+class ModelRegistry:
+    """Process-wide store of loaded models keyed by what they were loaded from.
+
+    spaCy pipelines, attacks, metrics and summarizers of every run in a process (e.g. the runs of a sweep) share one
+    copy of each model. Models are loaded lazily on first request. When `max_models` is set, the least recently used
+    model is evicted once the cap is exceeded.
+    """
+
+    def __init__(self, max_models: Optional[int] = None):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            model = loader()
+            self._models[key] = model
+            self._evict()
+            return model
+
+    def set_max_models(self, max_models: Optional[int]) -> None:
+        with self._lock:
+            self.max_models = max_models
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def _evict(self) -> None:
+        if self.max_models is None:
+            return
+        while len(self._models) > max(self.max_models, 1):
+            self._models.popitem(last=False)
+
+
+model_registry = ModelRegistry()
+
+
+def spacy_key(model_name: str, disable: Iterable[str] = ()) -> Tuple[str, str, frozenset]:
+    return 'spacy', model_name, frozenset(disable)
+
+
+def get_spacy_model(model_name: str, disable: Iterable[str] = ()):
+    """Returns a shared spaCy pipeline, loading it on first use"""
+    key = spacy_key(model_name, disable)
+    return model_registry.get(key, lambda: spacy.load(model_name, disable=sorted(key[2])))
+
+
+def get_hf_pipeline(task: str, model_name: str, model_class: Optional[type] = None):
+    """Returns a shared transformers pipeline of a task, loading its tokenizer and model (`model_class`) on first use"""
+    def load():
+        from transformers import AutoTokenizer, pipeline
+        if model_class is None:
+            return pipeline(task, model=model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = model_class.from_pretrained(model_name)
+        return pipeline(task, model=model, tokenizer=tokenizer)
+
+    return model_registry.get(('pipeline', task, model_name), load)
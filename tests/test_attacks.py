@@ -79,4 +79,186 @@ def test_exclamation_mark():
     sentences = ["This is a sentence."]
     attacked_sentences, changes = attack.attack(sentences)
     assert (attacked_sentences == "This is a sentence!") or (attacked_sentences == "This is a sentence.")
-    assert changes == 1 or changes == 0
\ No newline at end of file
+    assert changes == 1 or changes == 0
+
+def test_attack_batch_matches_attack():
+    from src.attacks.attack import BritishToAmericanEnglish
+    attack = BritishToAmericanEnglish("data/additional_data/british_to_american.json")
+    documents = [['This is my aesthetic.', 'I do not recognise this colour.'], ['Nothing to change here.']]
+    assert attack.attack_batch(documents) == [attack.attack(sentences) for sentences in documents]
+
+
+def legacy_replace_entities(sentence, entities, entity_types):
+    import re
+    for entity in entities:
+        entity_types.add(entity['entity'].split('-')[1])
+    new_sentence = ""
+    characters_to_pass = 0
+    for i, character in enumerate(sentence):
+        if i in [entity['start'] for entity in entities]:
+            current_entity = [entity for entity in entities if entity['start'] == i][0]
+            new_sentence += current_entity['entity'].split('-')[1]
+            characters_to_pass = current_entity['end'] - current_entity['start'] - 1
+        elif characters_to_pass > 0:
+            characters_to_pass -= 1
+        else:
+            new_sentence += character
+    for entity_type in entity_types:
+        new_sentence = re.sub(rf'({entity_type}){{2,}}', entity_type, new_sentence)
+    changes = 0
+    for w, w_ in zip(sentence.split(), new_sentence.split()):
+        if w != w_:
+            changes += 1
+    return new_sentence, changes
+
+
+def test_named_entities_replacement_matches_legacy():
+    import random
+    from src.attacks.attack import NamedEntities
+    rng = random.Random(0)
+    sentence = "Wolfgang and Angela met John Doe in New York and Berlin last week."
+    for _ in range(200):
+        entities = []
+        for _ in range(rng.randint(0, 6)):
+            start = rng.randint(0, len(sentence) + 2)
+            end = start + rng.randint(0, 8)
+            entities.append({'entity': rng.choice(['B-PER', 'I-PER', 'B-LOC', 'I-ORG']), 'start': start, 'end': end})
+        assert NamedEntities.replace_entities(sentence, entities, set()) == \
+            legacy_replace_entities(sentence, entities, set())
+
+
+def test_named_entities_batch():
+    from src.attacks.attack import NamedEntities
+    tagged = {
+        "My name is John Doe.": [{'entity': 'B-PER', 'start': 11, 'end': 15}, {'entity': 'I-PER', 'start': 16, 'end': 19}],
+        "I live in New York.": [{'entity': 'B-LOC', 'start': 10, 'end': 13}, {'entity': 'I-LOC', 'start': 14, 'end': 18}],
+        "Wolfgang is here.": [{'entity': 'B-PER', 'start': 0, 'end': 4}, {'entity': 'I-PER', 'start': 4, 'end': 8}],
+    }
+    attack = NamedEntities.__new__(NamedEntities)
+    attack.batch_size = 2
+    attack.ner = lambda sentences, batch_size: [tagged[sentence] for sentence in sentences]
+    results = attack.attack_batch([["My name is John Doe.", "I live in New York."], ["Wolfgang is here."]])
+    assert results == [("My name is PER PER. I live in LOC LOC.", 4), ("PER is here.", 1)]
+
+
+def legacy_dictionary_attack(dictionary, sentences):
+    new_sentences = []
+    changes = 0
+    for sentence in sentences:
+        new_sentence = []
+        for word in sentence.split():
+            org_word = word
+            stripped = word.strip('.,?!')
+            if stripped in dictionary:
+                new_sentence.append(dictionary[stripped] + org_word.strip(stripped) if stripped != word
+                                    else dictionary[stripped])
+                changes += 1
+            else:
+                new_sentence.append(org_word)
+        new_sentences.append(" ".join(new_sentence))
+    return ' '.join(new_sentences), changes
+
+
+def test_dictionary_attacks_match_legacy_loop():
+    import random
+    from src.attacks.attack import AmericanToBritishEnglish, BritishToAmericanEnglish
+    rng = random.Random(0)
+    for attack_class, path in [(BritishToAmericanEnglish, "data/additional_data/british_to_american.json"),
+                               (AmericanToBritishEnglish, "data/additional_data/american_to_british.json")]:
+        attack = attack_class(path)
+        words = list(attack.dictionary)[:20] + ["the", "report", "said", "", "  "]
+        for _ in range(500):
+            sentences = [" ".join(rng.choice(words) + rng.choice(["", ".", ",", "?!", "\n"])
+                                  for _ in range(rng.randint(0, 8))) for _ in range(rng.randint(0, 4))]
+            assert attack.attack(sentences) == legacy_dictionary_attack(attack.dictionary, sentences)
+
+
+def test_dictionary_attack_keeps_punctuation_and_case():
+    from src.attacks.attack import BritishToAmericanEnglish
+    from src.attacks.substitution import load_dictionary
+    attack = BritishToAmericanEnglish("data/additional_data/british_to_american.json")
+    attacked_sentences, changes = attack.attack(['"Colour," she said... ?colour! COLOUR cOLOUR'])
+    assert attacked_sentences == '"Colour," she said... ?color! COLOR cOLOUR'
+    assert changes == 2
+    assert BritishToAmericanEnglish("data/additional_data/british_to_american.json").dictionary is attack.dictionary
+    assert load_dictionary.cache_info().hits >= 1
+
+
+def test_seeded_attacks_do_not_depend_on_chunking_or_order():
+    from src.attacks.attack import LetterMasking, ShuffleAttack, WordCorruption
+    documents = [[f"Sentence {i} of document {j} has a few more words." for i in range(5)] for j in range(8)]
+    keys = list(range(len(documents)))
+    attacks = {WordCorruption: dict(percent_of_words_to_corrupt=0.1, corrupted_word='MASK'),
+               LetterMasking: dict(percentage_of_letters_to_mask=0.2), ShuffleAttack: {}}
+    for attack_class, params in attacks.items():
+        whole = attack_class(seed=11, **params).attack_batch(documents, keys)
+        chunked = attack_class(seed=11, **params).attack_batch(documents[:3], keys[:3]) + \
+            attack_class(seed=11, **params).attack_batch(documents[3:], keys[3:])
+        reversed_ = attack_class(seed=11, **params).attack_batch(documents[::-1], keys[::-1])[::-1]
+        assert whole == chunked == reversed_
+        attack = attack_class(seed=11, **params)
+        assert [attack.attack(sentences, key=key) for sentences, key in zip(documents, keys)] == whole
+        assert attack_class(seed=12, **params).attack_batch(documents, keys) != whole
+
+
+def test_word_corruption_splits_budget_over_sentences_and_keeps_punctuation():
+    from src.attacks.attack import WordCorruption
+    attack = WordCorruption(percent_of_words_to_corrupt=1.0, corrupted_word='MASK', seed=0)
+    sentences = ["Short one.", "", "A much longer sentence, with several words!", "Why?"]
+    original = ' '.join(' '.join(sentence.split()) for sentence in sentences)
+    for key in range(20):
+        # the draws of sentences are clamped to their length, the whole budget never fits in the first sentence
+        attacked_sentences, changes = attack.attack(sentences, key=key)
+        assert changes <= len(original.split())
+        assert len(attacked_sentences.split(' ')) == len(original.split(' '))
+        corrupted = 0
+        for word, attacked_word in zip(original.split(' '), attacked_sentences.split(' ')):
+            if attacked_word != word:
+                corrupted += 1
+                assert attacked_word == 'MASK' + word.strip(word.strip('.,?!'))
+        assert corrupted == changes
+
+
+def test_letter_masking_replaces_letters_from_dictionary():
+    import re
+    from src.attacks.attack import LetterMasking
+    attack = LetterMasking(percentage_of_letters_to_mask=0.3, seed=0)
+    sentences = ["The quick brown fox jumps over the lazy dog.", "Zoë met the Kelvin family, 42 times!"]
+    original = ' '.join(sentences).split()
+    for key in range(20):
+        attacked_sentences, changes = attack.attack(sentences, key=key)
+        assert changes <= int(len(original) * 0.3)
+        masked = 0
+        for word, attacked_word in zip(original, attacked_sentences.split(' ')):
+            pattern = ''.join('(?:' + '|'.join(map(re.escape, attack.masking_dictionary[letter.lower()])) + ')'
+                              if letter.lower() in attack.masking_dictionary else re.escape(letter) for letter in word)
+            assert attacked_word == word or re.fullmatch(pattern, attacked_word)
+            masked += attacked_word != word
+        assert masked <= changes
+
+
+def test_corruption_budget_follows_the_per_sentence_split():
+    import numpy as np
+    from src.attacks.attack import WordCorruption
+    from src.attacks.corruption import BUDGET_STREAM, counter_uniform
+    attack = WordCorruption(percent_of_words_to_corrupt=0.5, corrupted_word='MASK', seed=5)
+    documents = [["One two three four five six.", "", "Seven eight nine ten.", "Eleven twelve!"],
+                 ["A  b\tc d.", "E f g h i j k l."], []]
+    keys = ['x', 'y', 'z']
+    results = attack.attack_batch(documents, keys)
+    for sentences, seed, (attacked_sentences, changes) in zip(documents, attack.stream_seeds(documents, keys),
+                                                              results):
+        # the legacy split: every sentence takes randint(0, left) words, at most as many as it has
+        left = int(len(' '.join(sentences).split()) * 0.5)
+        attacked_words = attacked_sentences.split(' ')
+        expected = 0
+        for position, sentence in enumerate(sentences):
+            draw = counter_uniform(np.array([seed]), np.array([position]), BUDGET_STREAM)[0]
+            taken = min(int(draw * (left + 1)), len(sentence.split()))
+            left -= taken
+            words = max(len(sentence.split()), 1)
+            assert sum(word.startswith('MASK') for word in attacked_words[:words]) == taken
+            attacked_words = attacked_words[words:]
+            expected += taken
+        assert changes == expected
+    assert results[2] == ('', 0)
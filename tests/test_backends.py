@@ -0,0 +1,137 @@
+import pandas as pd
+
+
+def test_shard_config_splits_outputs_and_rate_limits():
+    import os
+    from carl.backends.local_parallel import config_value, shard_config
+    config = {'jobs.FullPipeline.output_dir': "'data/out.csv'", 'jobs.FullPipeline.stylometrix_path': "'data/stylo'",
+              'jobs.FullPipeline.requests_per_minute': 1000, 'jobs.FullPipeline.attack_workers': 8}
+    shard = shard_config(config, 2, 4)
+    assert shard['dataset_split_loading.num_shards'] == 4 and shard['dataset_split_loading.shard_index'] == 2
+    assert config_value(shard, 'jobs.FullPipeline.output_dir') == os.path.join('data', 'out_shards', 'shard_00002.csv')
+    assert config_value(shard, 'jobs.FullPipeline.stylometrix_path') == os.path.join('data', 'out_shards',
+                                                                                    'shard_00002_stylometrix')
+    assert shard['jobs.FullPipeline.requests_per_minute'] == 250
+    assert shard['jobs.FullPipeline.tokens_per_minute'] == 90000 // 4
+    assert shard['jobs.FullPipeline.attack_workers'] == 1
+    assert shard['jobs.FullPipeline.run_analysis'] is False
+    assert 'jobs.FullPipeline.checkpoint_dir' not in shard
+    assert config['jobs.FullPipeline.attack_workers'] == 8
+
+
+def test_shard_config_separates_shared_checkpoints_and_caches():
+    import os
+    from carl.backends.local_parallel import config_value, shard_config
+    config = {'jobs.FullPipeline.output_dir': "'data/out.csv'",
+              'jobs.FullPipeline.preparation_checkpoint_dir': "'data/preparation'",
+              'jobs.FullPipeline.attack_cache_path': "'data/attacks.sqlite'"}
+    shards = [shard_config(config, index, 2) for index in range(2)]
+    assert [config_value(shard, 'jobs.FullPipeline.preparation_checkpoint_dir') for shard in shards] == [
+        os.path.join('data', 'preparation', 'shard_00000'), os.path.join('data', 'preparation', 'shard_00001')]
+    assert [config_value(shard, 'jobs.FullPipeline.attack_cache_path') for shard in shards] == [
+        'data/attacks_shard_00000.sqlite', 'data/attacks_shard_00001.sqlite']
+
+
+def test_merge_csv_matches_single_output(tmp_path):
+    from carl.backends.local_parallel import merge_csv
+    df = pd.DataFrame({'text': ["First, \"quoted\"\nline.", "Second.", "Third, with 'commas'.", ""],
+                       'score': [0.1, 1 / 3, float('nan'), 2.5e-12], 'sentences': [['a'], ['b', 'c'], [], ['d']]})
+    paths = []
+    for index, (start, end) in enumerate([(0, 1), (1, 1), (1, 4)]):
+        path = str(tmp_path / f"shard_{index}.csv")
+        df.iloc[start:end].reset_index(drop=True).to_csv(path)
+        paths.append(path)
+    expected = str(tmp_path / "expected.csv")
+    df.to_csv(expected)
+    assert merge_csv(paths + [str(tmp_path / "missing.csv")], str(tmp_path / "merged.csv")) == 4
+    with open(str(tmp_path / "merged.csv")) as merged, open(expected) as single:
+        assert merged.read() == single.read()
+
+
+def test_merge_result_stores_shifts_indices(tmp_path):
+    from carl.backends.local_parallel import merge_result_stores
+    from jobs.result_store import ResultStore
+    stores = [ResultStore(str(tmp_path / f"shard_{index}")) for index in range(2)]
+    frames = [pd.DataFrame({'id': ['a', 'b'], 'sentences': [['A.'], ['B.', 'b.']]}),
+              pd.DataFrame({'id': ['c'], 'sentences': [['C.']]}),
+              pd.DataFrame({'id': ['d', 'e'], 'sentences': [[], ['E.']]})]
+    stores[0].write('documents', frames[0], part=0)
+    stores[0].write('documents', frames[1], part=1)
+    stores[1].write('documents', frames[2], part=0)
+    for store, changes in zip(stores, ([1, 2], [3, 4])):
+        store.write('metrics', pd.DataFrame({'changes': changes}), partition='NoAttack', part=0)
+    target = ResultStore(str(tmp_path / "merged"))
+    target.write('documents', frames[0], part=7)
+    merge_result_stores(stores, target)
+    documents = target.read('documents')
+    assert documents['id'].tolist() == ['a', 'b', 'c', 'd', 'e']
+    assert documents.index.tolist() == [0, 1, 2, 3, 4]
+    assert [list(sentences) for sentences in documents['sentences']] == [['A.'], ['B.', 'b.'], ['C.'], [], ['E.']]
+    assert target.read('metrics', 'NoAttack').index.tolist() == [0, 1, 2, 3]
+    assert len(target.parts('documents')) == 3
+
+
+def test_sweep_experiment_expands_grid():
+    from carl.experiments.experiment import SweepExperiment
+    from carl.backends.local_sweep import preparation_key
+    experiment = SweepExperiment(
+        name='sweep', base_config={'jobs.FullPipeline.output_dir': "'data/out.csv'",
+                                   'jobs.FullPipeline.stylometrix_path': "'data/stylo'",
+                                   'HfSummarizer.temperature': 0.7},
+        grid={'HfSummarizer.temperature': [0.1, 0.9], 'HfSummarizer.prompt': ["'Summarize: '", "'Summarize:'"]})
+    runs = experiment.expand()
+    assert len(runs) == 4
+    assert [run.base_config['HfSummarizer.temperature'] for run in runs] == [0.1, 0.1, 0.9, 0.9]
+    assert runs[0].base_config['jobs.FullPipeline.output_dir'] == "'data/out_temperature-0.1_prompt-Summarize.csv'"
+    # both prompts have the same slug, the index keeps their outputs apart
+    assert runs[1].base_config['jobs.FullPipeline.output_dir'] == \
+        "'data/out_temperature-0.1_prompt-Summarize_001.csv'"
+    assert runs[0].base_config['jobs.FullPipeline.stylometrix_path'] == "'data/stylo/temperature-0.1_prompt-Summarize'"
+    assert len({run.base_config['jobs.FullPipeline.output_dir'] for run in runs}) == 4
+    assert {run.base_config['jobs.FullPipeline.preparation_checkpoint_dir'] for run in runs} == {
+        "'data/out_sweep_preparation'"}
+    assert len({preparation_key(run.base_config) for run in runs}) == 1
+    assert experiment.base_config['HfSummarizer.temperature'] == 0.7
+
+
+def test_sweep_workers_write_their_own_attack_caches(tmp_path, monkeypatch):
+    import json
+    import os
+    import jobs.full_pipeline as full_pipeline
+    from carl.backends.local_parallel import worker_cache_path
+    from carl.backends.local_sweep import LocalSweepBackend, worker_names
+    from carl.experiments.experiment import SweepExperiment
+    from src.utils.cache import DiskCache
+    data_path = tmp_path / "articles.jsonl"
+    with open(data_path, "w") as f:
+        for index in range(4):
+            f.write(json.dumps({'article': f"Article {index} has a few words. It ends here.",
+                                'highlights': "Summary.", 'id': str(index)}) + "\n")
+    # the workers read the segmented articles from the preparation checkpoints filled here
+    monkeypatch.setattr(full_pipeline, 'pipe_sentences',
+                        lambda texts, batch_size=64, n_process=1: [text.split(". ") for text in texts])
+    experiment = SweepExperiment(
+        name='sweep', base_config={
+            'jobs.FullPipeline.output_dir': repr(str(tmp_path / "out.csv")),
+            'jobs.FullPipeline.attacks': '[@attacks.WordCorruption]',
+            'WordCorruption.percent_of_words_to_corrupt': 0.5, 'WordCorruption.corrupted_word': "'MASK'",
+            'WordCorruption.seed': 1, 'jobs.FullPipeline.metrics_sum': '[]', 'jobs.FullPipeline.metrics_org': '[]',
+            'jobs.FullPipeline.produce_summaries': False, 'jobs.FullPipeline.summarizer': None,
+            'jobs.FullPipeline.stylometrix_path': None, 'jobs.FullPipeline.run_analysis': False,
+            'dataset_split_loading.data_files': repr(str(data_path)),
+            'dataset_split_loading.cache_dir': repr(str(tmp_path))},
+        grid={'jobs.FullPipeline.attack_chunk_size': [1, 2]})
+    runs = experiment.expand()
+    shared_path = str(tmp_path / "out_sweep_attack_cache.sqlite")
+    DiskCache(shared_path).set('earlier', ['from an earlier sweep', 0])
+
+    backend = LocalSweepBackend(n_workers=2)
+    backend.prepare(runs)
+    backend.run_pool(runs)
+
+    assert all(os.path.exists(tmp_path / f"out_attack_chunk_size-{size}.csv") for size in (1, 2))
+    worker_caches = [DiskCache(worker_cache_path(shared_path, name)) for name in worker_names(2)]
+    # workers start from the shared cache and the runs of every worker are merged back into it
+    assert all('earlier' in cache for cache in worker_caches)
+    assert sum(len(cache) > 1 for cache in worker_caches) >= 1
+    assert len(DiskCache(shared_path)) == 1 + 4
@@ -0,0 +1,90 @@
+import pytest
+
+
+def test_disk_cache_roundtrip_and_counters(tmp_path):
+    from src.utils.cache import DiskCache
+    cache = DiskCache(str(tmp_path / "cache.sqlite"))
+    cache.set("a", ["text", 1])
+    assert cache.get("a") == ["text", 1]
+    assert cache.get("b") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+    reopened = DiskCache(str(tmp_path / "cache.sqlite"))
+    assert reopened.get("a") == ["text", 1]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    from src.utils.cache import DiskCache
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_size_bytes=25)
+    cache.set("a", "x" * 8)
+    cache.set("b", "y" * 8)
+    cache.get("a")
+    cache.set("c", "z" * 8)
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.size() <= 25
+
+
+class CountingAttack:
+    deterministic = True
+
+    def __init__(self):
+        from src.attacks.attack import NoAttack
+        self.inner = NoAttack()
+        self.name = "Counting"
+        self.seed = None
+        self.calls = 0
+
+    def get_params(self):
+        return {}
+
+    def model_revision(self):
+        return None
+
+    def is_cacheable(self):
+        return self.deterministic or self.seed is not None
+
+    def document_key(self, sentences, key=None):
+        return self.inner.document_key(sentences, key)
+
+    def attack_batch(self, documents, keys=None):
+        self.calls += len(documents)
+        return self.inner.attack_batch(documents)
+
+
+def test_attack_cache_only_computes_misses(tmp_path):
+    from src.attacks.cache import AttackCache
+    cache = AttackCache(str(tmp_path / "attacks.sqlite"))
+    attack = CountingAttack()
+    documents = [["One sentence.", "Second sentence."], ["Another one."]]
+    assert cache.attack_batch(attack, documents) == [("One sentence. Second sentence.", 0), ("Another one.", 0)]
+    assert attack.calls == 2
+    documents.append(["New document."])
+    assert cache.attack_batch(attack, documents)[2] == ("New document.", 0)
+    assert attack.calls == 3
+    assert cache.hits == 2
+
+
+def test_attack_cache_skips_unseeded_stochastic_attacks(tmp_path):
+    from src.attacks.cache import AttackCache
+    cache = AttackCache(str(tmp_path / "attacks.sqlite"))
+    attack = CountingAttack()
+    attack.deterministic = False
+    cache.attack_batch(attack, [["One."]])
+    cache.attack_batch(attack, [["One."]])
+    assert attack.calls == 2
+    assert len(cache.store) == 0
+
+
+def test_attack_cache_stores_seeded_stochastic_attacks_per_document_key(tmp_path):
+    from src.attacks.cache import AttackCache
+    from src.attacks.attack import WordCorruption
+    cache = AttackCache(str(tmp_path / "attacks.sqlite"))
+    documents = [["My name is John Doe."], ["My name is John Doe."]]
+    first = cache.attack_batch(WordCorruption(0.4, 'MASK', seed=5), documents, ["a", "b"])
+    assert len(cache.store) == 2
+    assert cache.attack_batch(WordCorruption(0.4, 'MASK', seed=5), documents, ["a", "b"]) == first
+    assert cache.hits == 2
+    cache.attack_batch(WordCorruption(0.4, 'MASK', seed=6), documents, ["a", "b"])
+    assert len(cache.store) == 4
@@ -0,0 +1,72 @@
+import json
+
+
+def write_articles(path, count):
+    with open(path, "w") as f:
+        for index in range(count):
+            f.write(json.dumps({'article': f"Article {index}.", 'highlights': f"Summary {index}.", 'id': str(index)}))
+            f.write("\n")
+
+
+def test_dataset_split_loading_selects_rows_from_local_files(tmp_path):
+    from src.data_preparation.dataset_loading import dataset_split_loading
+    path = str(tmp_path / "articles.jsonl")
+    write_articles(path, 20)
+
+    dataset = dataset_split_loading(data_files=path, cache_dir=str(tmp_path / "cache"))
+    assert len(dataset) == 20
+
+    subset = dataset_split_loading(data_files=path, start=5, end=15, cache_dir=str(tmp_path / "cache"))
+    assert subset['id'] == [str(index) for index in range(5, 15)]
+
+    sample = dataset_split_loading(data_files=path, sample_size=6, seed=1, cache_dir=str(tmp_path / "cache"))
+    assert len(sample) == 6
+    assert sample['id'] == dataset_split_loading(data_files=path, sample_size=6, seed=1,
+                                                 cache_dir=str(tmp_path / "cache"))['id']
+    assert [int(index) for index in sample['id']] == sorted(int(index) for index in sample['id'])
+
+    shards = [dataset_split_loading(data_files=path, num_shards=3, shard_index=index,
+                                    cache_dir=str(tmp_path / "cache"))
+              for index in range(3)]
+    assert sum((shard['id'] for shard in shards), []) == dataset['id']
+
+
+def test_dataset_split_loading_reads_saved_datasets(tmp_path):
+    from datasets import Dataset, DatasetDict
+    from src.data_preparation.dataset_loading import dataset_split_loading
+    splits = DatasetDict({
+        'train': Dataset.from_dict({'article': ["a", "b"], 'highlights': ["x", "y"], 'id': ["1", "2"]}),
+        'test': Dataset.from_dict({'article': ["c"], 'highlights': ["z"], 'id': ["3"]}),
+    })
+    splits.save_to_disk(str(tmp_path / "saved"))
+    assert dataset_split_loading(split='test', data_files=str(tmp_path / "saved"))['id'] == ["3"]
+    batches = dataset_split_loading(data_files=str(tmp_path / "saved")).iter(batch_size=1)
+    assert [batch['id'] for batch in batches] == [["1"], ["2"]]
+
+
+def test_dataset_loading_offline_only_during_the_call(monkeypatch):
+    import os
+    import datasets
+    import huggingface_hub
+    from datasets import Dataset, DatasetDict
+    from src.data_preparation import dataset_loading as module
+    flags = []
+
+    def load_dataset(*args, split=None, **kwargs):
+        flags.append((datasets.config.HF_DATASETS_OFFLINE, huggingface_hub.constants.HF_HUB_OFFLINE,
+                      os.environ.get('HF_HUB_OFFLINE')))
+        splits = DatasetDict({name: Dataset.from_dict({'article': ["a"], 'highlights': ["x"], 'id': [name]})
+                              for name in ('train', 'validation', 'test')})
+        return splits if split is None else splits[split]
+
+    monkeypatch.setattr(module, "load_dataset", load_dataset)
+    monkeypatch.setattr(datasets.config, "HF_DATASETS_OFFLINE", False)
+    monkeypatch.setattr(huggingface_hub.constants, "HF_HUB_OFFLINE", False)
+    monkeypatch.delenv('HF_HUB_OFFLINE', raising=False)
+    assert module.dataset_split_loading(split='validation', offline=True)['id'] == ["validation"]
+    train, validation, test = module.dataset_loading(offline=True)
+    assert (train['id'], validation['id'], test['id']) == (["train"], ["validation"], ["test"])
+    assert flags == [(True, True, '1')] * 2
+    assert datasets.config.HF_DATASETS_OFFLINE is False
+    assert huggingface_hub.constants.HF_HUB_OFFLINE is False
+    assert 'HF_HUB_OFFLINE' not in os.environ
@@ -0,0 +1,211 @@
+import pytest
+
+
+@pytest.fixture
+def tiny_bert_scorer(tmp_path):
+    from types import SimpleNamespace
+    from transformers import BertConfig, BertModel, BertTokenizer
+    import torch
+    words = "the cat dog sat on mat a was house big small red blue ran home".split()
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ".", ","] + words
+    (tmp_path / "vocab.txt").write_text("\n".join(vocab))
+    tokenizer = BertTokenizer(str(tmp_path / "vocab.txt"))
+    torch.manual_seed(0)
+    model = BertModel(BertConfig(vocab_size=len(vocab), hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                                 intermediate_size=32))
+    model.eval()
+    return SimpleNamespace(_model=model, _tokenizer=tokenizer, device="cpu", all_layers=False)
+
+
+def test_bert_score_batch_matches_bert_score(tiny_bert_scorer):
+    from collections import defaultdict
+    from bert_score.utils import bert_cos_score_idf
+    from src.metrics.metrics_summary_to_summary import BERTScore
+
+    metric = BERTScore(batch_size=2)
+    metric.scorer = tiny_bert_scorer
+    metric.idf_dict = defaultdict(lambda: 1.0)
+    metric.idf_dict[tiny_bert_scorer._tokenizer.sep_token_id] = 0
+    metric.idf_dict[tiny_bert_scorer._tokenizer.cls_token_id] = 0
+
+    generated = ["the cat sat on the mat.", "a dog ran home.", "the big red house.", None]
+    references = ["the cat sat on a mat.", "the dog ran home.", "a small blue house.", "the cat."]
+    expected = bert_cos_score_idf(tiny_bert_scorer._model, references[:3], generated[:3],
+                                  tiny_bert_scorer._tokenizer, metric.idf_dict, device="cpu")[:, 2].tolist()
+
+    scores = metric.compute_batch(generated, references)
+    assert scores[:3] == pytest.approx(expected, abs=1e-5)
+    assert scores[3] != scores[3]
+    assert len(metric.reference_cache) == 4
+    assert metric.compute(generated[0], references[0]) == pytest.approx(expected[0], abs=1e-5)
+
+
+
+def test_reference_representations_are_memoized():
+    from src.metrics.metrics_summary_to_summary import MetricSummarytoSummary
+
+    class WordCount(MetricSummarytoSummary):
+        has_reference_representation = True
+
+        def __init__(self):
+            super().__init__(max_cached_references=2)
+            self.represented = []
+
+        def represent(self, summaries):
+            self.represented.extend(summaries)
+            return [len(summary.split()) for summary in summaries]
+
+        def compare(self, generated_summaries, reference_representations):
+            return [len(generated.split()) / reference for generated, reference in
+                    zip(generated_summaries, reference_representations)]
+
+    metric = WordCount()
+    references = ["one two", "one two three", None]
+    representations = metric.prepare_references(references)
+    assert representations == [2, 3, None]
+    assert metric.represented == ["one two", "one two three"]
+
+    scores = metric.compute_batch(["a", "a b c", "a"], references, representations)
+    assert scores[:2] == [0.5, 1.0]
+    assert scores[2] != scores[2]
+
+    # ad-hoc calls reuse the memoized references
+    assert metric.compute_batch(["a"], ["one two"]) == [0.5]
+    assert metric.represented == ["one two", "one two three"]
+    metric.prepare_references(["x"])
+    assert len(metric.reference_cache) == 2
+
+
+ROUGE_PAIRS = [
+    ("The cat sat on the mat. It was happy.", "A cat was sitting on the mat. The cat was happy."),
+    ("Police arrested two men in London on Monday.", "Two men were arrested by police in London."),
+    ("the the the.", "the cat. the dog. the."),
+    ("Nothing in common here", "Completely different words. Yes."),
+    ("U.S. officials said . . the talks will resume", "Officials in the U.S. said talks resume  next week."),
+]
+
+
+def test_rouge_score_matches_rouge_package():
+    from rouge import Rouge
+    from src.metrics.metrics_summary_to_summary import RougeScore
+    metric = RougeScore()
+    generated, references = zip(*ROUGE_PAIRS)
+    columns = metric.compute_batch(list(generated), list(references))
+    expected = Rouge().get_scores(list(generated), list(references))
+    for row, scores in enumerate(expected):
+        for variant, values in scores.items():
+            for stat, value in values.items():
+                assert columns[f"{variant}_{stat}"][row] == pytest.approx(value, abs=1e-12)
+
+
+def test_single_rouge_metrics_match_rouge_package():
+    from rouge import Rouge
+    from src.metrics.metrics_summary_to_summary import Rouge1, Rouge2, RougeL
+    for generated, reference in ROUGE_PAIRS:
+        expected = Rouge().get_scores(generated, reference)[0]
+        assert Rouge1().compute(generated, reference) == pytest.approx(expected["rouge-1"]["f"], abs=1e-12)
+        assert Rouge2().compute(generated, reference) == pytest.approx(expected["rouge-2"]["f"], abs=1e-12)
+        assert RougeL().compute(generated, reference) == pytest.approx(expected["rouge-l"]["f"], abs=1e-12)
+    assert Rouge1().compute_batch([None, "a."], ["a.", "a."])[1] == pytest.approx(1.0, abs=1e-7)
+
+
+def test_named_entities_score_batches_and_guards_empty_references(monkeypatch):
+    from src.metrics import metrics_summary_to_summary
+    calls = []
+
+    def ner(texts, batch_size):
+        calls.append(list(texts))
+        return [[{'entity': 'B-PER'}] * text.count("Anna") for text in texts]
+
+    monkeypatch.setattr(metrics_summary_to_summary, "get_hf_pipeline", lambda task, model_name, model_class: ner)
+    metric = metrics_summary_to_summary.NamedEntitiesScore(batch_size=8, truncation=False)
+
+    references = ["Anna met Anna.", "Nobody here.", "Anna."]
+    representations = metric.prepare_references(references)
+    scores = metric.compute_batch(["Anna.", "Anna.", "Anna and Anna."], references, representations)
+    assert scores[0] == 0.5
+    assert scores[1] != scores[1]
+    assert scores[2] == 2.0
+    assert calls == [references, ["Anna.", "Anna.", "Anna and Anna."]]
+
+
+def legacy_novel_ngrams(summary_tokens, original_tokens, ns):
+    from collections import Counter
+    from nltk import ngrams
+    result = {}
+    for n in ns:
+        original_counts = Counter(ngrams(original_tokens, n))
+        summary_counts = Counter(ngrams(summary_tokens, n))
+        result[n] = sum(1 for ngram, count in summary_counts.items() if original_counts[ngram] < count)
+    return result
+
+
+def test_ngram_index_matches_legacy_counts(tmp_path):
+    import random
+    from src.metrics.ngram_index import NGramIndex
+    rng = random.Random(0)
+    vocabulary = ["the", "cat", "sat", "on", "a", "mat", "dog", "ran", "."]
+    path = str(tmp_path / "ngrams")
+    index = NGramIndex([1, 3, 4, 5], path=path, tokenizer=str.split)
+    pairs = []
+    for _ in range(50):
+        original = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(0, 40)))
+        summary = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(0, 15)))
+        pairs.append((summary, original))
+        assert index.novel_ngrams(summary, original) == legacy_novel_ngrams(summary.split(), original.split(),
+                                                                            [1, 3, 4, 5])
+    index.save()
+
+    reloaded = NGramIndex([1, 3, 4, 5], path=path, tokenizer=str.split)
+    assert len(reloaded) == len(index)
+    for summary, original in pairs:
+        assert original in reloaded
+        assert reloaded.novel_ngrams(summary, original) == index.novel_ngrams(summary, original)
+    assert not reloaded.modified
+
+
+def test_ngram_index_appends_parts_and_bounds_memory(tmp_path):
+    import os
+    from src.metrics.ngram_index import NGramIndex
+    path = str(tmp_path / "ngrams")
+    texts = [f"word{index} " * 20 + f"end{index}" for index in range(6)]
+    index = NGramIndex([1, 2], path=path, tokenizer=str.split, max_memory_bytes=200)
+    index.add_many(texts[:3])
+    index.save()
+    index.add_many(texts[3:])
+    index.save()
+    index.save()
+    assert sorted(os.listdir(path)) == ["part_00000.npz", "part_00001.npz"]
+    # only the saved documents above the memory limit were dropped, all of them are still found
+    assert index.memory_bytes <= 200 or len(index.documents) == 1
+    assert len(index) == 6
+
+    reloaded = NGramIndex([1, 2], path=path, tokenizer=str.split, max_memory_bytes=200)
+    assert len(reloaded.documents) == 0 and len(reloaded) == 6
+    for text in texts:
+        assert reloaded.novel_ngrams("word0 word0", text) == NGramIndex([1, 2], tokenizer=str.split).novel_ngrams(
+            "word0 word0", text)
+    assert not reloaded.modified
+
+
+def test_reference_cache_is_bounded_by_bytes():
+    from src.metrics.metrics_summary_to_summary import MetricSummarytoSummary
+
+    class Characters(MetricSummarytoSummary):
+        has_reference_representation = True
+
+        def __init__(self):
+            super().__init__(max_cached_bytes=10)
+
+        def represent(self, summaries):
+            return list(summaries)
+
+        def representation_size(self, representation):
+            return len(representation)
+
+    metric = Characters()
+    assert metric.prepare_references(["aaaa", "bbbb", "cccc"]) == ["aaaa", "bbbb", "cccc"]
+    assert list(metric.reference_cache.values()) == ["bbbb", "cccc"]
+    assert metric.cached_bytes == 8
+    metric.clear_reference_cache()
+    assert len(metric.reference_cache) == 0 and metric.cached_bytes == 0
@@ -0,0 +1,62 @@
+import pytest
+
+
+@pytest.fixture
+def spacy_loads(monkeypatch):
+    import spacy
+    from src.utils import model_registry
+    calls = []
+
+    def loader(model_name, disable=()):
+        calls.append(model_name)
+        return {'name': model_name, 'disable': tuple(disable)}
+
+    monkeypatch.setattr(spacy, "load", loader)
+    monkeypatch.setattr(model_registry, "model_registry", model_registry.ModelRegistry())
+    return model_registry, calls
+
+
+def test_registry_loads_once(spacy_loads):
+    registry, calls = spacy_loads
+    first = registry.get_spacy_model("en_core_web_sm")
+    second = registry.get_spacy_model("en_core_web_sm")
+    assert first is second
+    assert calls == ["en_core_web_sm"]
+
+
+def test_registry_key_includes_disabled_pipes(spacy_loads):
+    registry, _ = spacy_loads
+    full = registry.get_spacy_model("en_core_web_sm")
+    parser_only = registry.get_spacy_model("en_core_web_sm", disable=["ner", "lemmatizer"])
+    assert full is not parser_only
+    assert parser_only is registry.get_spacy_model("en_core_web_sm", disable=("lemmatizer", "ner"))
+    assert len(registry.model_registry) == 2
+
+
+def test_registry_evicts_least_recently_used(spacy_loads):
+    registry, _ = spacy_loads
+    registry.model_registry.set_max_models(2)
+    registry.get_spacy_model("a")
+    registry.model_registry.get('b', lambda: 'model b')
+    registry.get_spacy_model("a")
+    registry.get_spacy_model("c")
+    assert registry.spacy_key("a") in registry.model_registry
+    assert 'b' not in registry.model_registry
+    assert registry.spacy_key("c") in registry.model_registry
+
+
+def test_model_registry_shares_hf_pipelines():
+    from src.utils.model_registry import ModelRegistry, get_hf_pipeline, model_registry
+    registry = ModelRegistry(max_models=1)
+    loads = []
+    assert registry.get('a', lambda: loads.append('a') or 'model a') == 'model a'
+    assert registry.get('a', lambda: loads.append('a') or 'other') == 'model a'
+    registry.get('b', lambda: loads.append('b') or 'model b')
+    assert 'a' not in registry and loads == ['a', 'b']
+
+    sentinel = object()
+    model_registry.get(('pipeline', 'ner', 'test/shared-ner'), lambda: sentinel)
+    try:
+        assert get_hf_pipeline("ner", "test/shared-ner") is sentinel
+    finally:
+        model_registry.clear()
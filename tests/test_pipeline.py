@@ -0,0 +1,245 @@
+import os
+import pytest
+
+
+ARTICLES = [
+    "The cat sat on the mat. It was warm. Nobody moved it.",
+    "Stocks fell sharply on Monday. Investors were worried. Markets closed lower.",
+    "A new bridge was opened. The mayor cut the ribbon. Traffic started at noon.",
+]
+
+
+@pytest.fixture
+def pipeline_factory(tmp_path, monkeypatch):
+    import jobs.full_pipeline as full_pipeline
+    from src.attacks.attack import NoAttack
+    from src.metrics.metrics_summary_to_summary import RougeScore
+    from src.summarization.summarizer import Summarizer
+
+    calls = {'load': 0, 'segment': 0, 'summaries': 0, 'attacks': 0}
+
+    def dataset_split_loading():
+        calls['load'] += 1
+        train = {'article': ARTICLES, 'highlights': ["summary"] * len(ARTICLES), 'id': ['a', 'b', 'c']}
+        return train
+
+    def pipe_sentences(texts, batch_size=64, n_process=1):
+        calls['segment'] += 1
+        return [text.split(". ") for text in texts]
+
+    monkeypatch.setattr(full_pipeline, 'dataset_split_loading', dataset_split_loading)
+    monkeypatch.setattr(full_pipeline, 'pipe_sentences', pipe_sentences)
+
+    class FirstSentenceSummarizer(Summarizer):
+        failing = ()
+
+        def __init__(self):
+            super().__init__()
+            self.model_name = "first-sentence"
+
+        def generate_summary(self, text: str) -> str:
+            if text.startswith(self.failing):
+                raise RuntimeError("generation failed")
+            calls['summaries'] += 1
+            return text.split(".")[0]
+
+    class CountedNoAttack(NoAttack):
+        def __init__(self):
+            calls['attacks'] += 1
+            super().__init__()
+
+    CountedNoAttack.__name__ = "NoAttack"
+
+    def make(attacks=(CountedNoAttack,), output_dir=str(tmp_path / "results.csv"), metrics_sum=(RougeScore,),
+             metrics_org=(), stylometrix_path=None, **kwargs):
+        return full_pipeline.FullPipeline(
+            attacks=list(attacks), metrics_sum=list(metrics_sum), metrics_org=list(metrics_org), produce_summaries=True,
+            summarizer=FirstSentenceSummarizer, output_dir=output_dir, stylometrix_path=stylometrix_path,
+            summarization_chunk_size=2, **kwargs)
+
+    return make, calls, FirstSentenceSummarizer
+
+
+def test_pipeline_rerun_skips_unchanged_stages(pipeline_factory, tmp_path):
+    import pandas as pd
+    make, calls, _ = pipeline_factory
+    make().run()
+    first = pd.read_csv(tmp_path / "results_metrics.csv")
+    assert calls == {'load': 1, 'segment': 1, 'summaries': 3, 'attacks': 1}
+    assert (tmp_path / "results_raport.txt").exists()
+
+    make().run()
+    assert calls == {'load': 1, 'segment': 1, 'summaries': 3, 'attacks': 1}
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "results_metrics.csv"), first)
+
+
+def test_pipeline_retries_only_missing_summaries(pipeline_factory, tmp_path):
+    import pandas as pd
+    make, calls, summarizer_class = pipeline_factory
+    summarizer_class.failing = ("Stocks",)
+    make().run()
+    generated = calls['summaries']
+    assert pd.isna(pd.read_csv(tmp_path / "results.csv")['NoAttack_summary'][1])
+
+    summarizer_class.failing = ()
+    make().run()
+    assert calls['summaries'] == generated + 1
+    assert calls['attacks'] == 1
+    assert pd.read_csv(tmp_path / "results.csv")['NoAttack_summary'].tolist() == [
+        text.split(".")[0] for text in pd.read_csv(tmp_path / "results.csv")['NoAttack']]
+
+
+def test_pipeline_streaming_matches_full_run(pipeline_factory, tmp_path):
+    import pandas as pd
+    make, calls, _ = pipeline_factory
+    make().run()
+    full = pd.read_csv(tmp_path / "results.csv", index_col=0)
+    full_metrics = pd.read_csv(tmp_path / "results_metrics.csv", index_col=0)
+
+    make(chunk_size=2, output_dir=str(tmp_path / "streamed.csv")).run()
+    assert calls['attacks'] == 2
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "streamed.csv", index_col=0), full)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "streamed_metrics.csv", index_col=0), full_metrics)
+    assert sorted(os.listdir(tmp_path / "streamed_checkpoints")) == ["analyze.pkl", "chunk_00000", "chunk_00001"]
+
+
+def test_pipeline_chunked_run_matches_unchunked_run_with_seeded_attacks(pipeline_factory, tmp_path):
+    import gin
+    import pandas as pd
+    from src.attacks import ExclamationMark, LetterMasking, ShuffleAttack, WordCorruption
+    make, _, _ = pipeline_factory
+    no_attack = make().attacks[0]
+    attacks = [no_attack, ShuffleAttack, WordCorruption, LetterMasking, ExclamationMark]
+    gin.parse_config("attacks.WordCorruption.percent_of_words_to_corrupt = 0.5\n"
+                     "attacks.WordCorruption.corrupted_word = 'MASK'\n"
+                     "attacks.LetterMasking.percentage_of_letters_to_mask = 0.3")
+    try:
+        make(attacks=attacks, attack_seed=5).run()
+        make(attacks=attacks, attack_seed=5, chunk_size=2, attack_chunk_size=1,
+             output_dir=str(tmp_path / "chunked.csv")).run()
+    finally:
+        gin.clear_config()
+    # seeded attacks draw per document, so chunking changes neither the attacked texts nor the scores
+    for suffix in (".csv", "_metrics.csv"):
+        unchunked = pd.read_csv(tmp_path / f"results{suffix}", index_col=0)
+        chunked = pd.read_csv(tmp_path / f"chunked{suffix}", index_col=0)
+        pd.testing.assert_frame_equal(chunked, unchunked)
+    assert len(unchunked) == len(ARTICLES)
+    assert pd.read_csv(tmp_path / "chunked.csv")['WordCorruption'].str.contains("MASK").any()
+
+
+def test_pipeline_metrics_score_in_bounded_batches(pipeline_factory, tmp_path):
+    import pandas as pd
+    from src.metrics.metrics_summary_to_summary import RougeScore
+    make, _, _ = pipeline_factory
+    make().run()
+    full_metrics = pd.read_csv(tmp_path / "results_metrics.csv", index_col=0)
+    sizes = []
+
+    class BatchedRougeScore(RougeScore):
+        batch_size = 2
+
+        def represent(self, summaries):
+            sizes.append(len(summaries))
+            return super().represent(summaries)
+
+    BatchedRougeScore.__name__ = "RougeScore"
+    make(metrics_sum=[BatchedRougeScore], output_dir=str(tmp_path / "batched.csv")).run()
+    # references, then the generated summaries of every batch of two rows
+    assert sizes == [2, 2, 1, 1]
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "batched_metrics.csv", index_col=0), full_metrics)
+
+
+def test_pipeline_parquet_store_matches_csv(pipeline_factory, tmp_path):
+    import pandas as pd
+    from jobs.result_store import ResultStore
+    make, calls, _ = pipeline_factory
+
+    class Stylometrix:
+        def compute(self, texts):
+            return pd.DataFrame({'text': texts, 'length': texts.str.len(), 'words': texts.str.count(" ") + 1})
+
+    make(metrics_org=[Stylometrix], stylometrix_path=str(tmp_path / "stylo")).run()
+    csv_metrics = pd.read_csv(tmp_path / "results_metrics.csv", index_col=0)
+    csv_stylo = pd.read_csv(tmp_path / "stylo" / "NoAttack_summary.csv", index_col=0)
+
+    make(metrics_org=[Stylometrix], stylometrix_path=None, output_dir=str(tmp_path / "stored.csv"),
+         output_format='parquet', chunk_size=2).run()
+    store = ResultStore(str(tmp_path / "stored"))
+    assert store.partitions('results') == ['NoAttack']
+    assert len(store.parts('metrics', 'NoAttack')) == 2
+    metrics = store.read('metrics', 'NoAttack').add_prefix("NoAttack_")
+    pd.testing.assert_frame_equal(metrics, csv_metrics, check_names=False, check_index_type=False)
+    stylo = store.read('stylometrix', 'NoAttack_summary', columns=['length'])
+    assert stylo.columns.tolist() == ['length']
+    assert stylo['length'].tolist() == csv_stylo['length'].tolist()
+    assert (tmp_path / "stored_raport.txt").exists()
+
+
+def test_pipeline_attack_workers_match_in_process_run(pipeline_factory, tmp_path):
+    import gin
+    import pandas as pd
+    from src.attacks import BritishToAmericanEnglish, ExclamationMark, ShuffleAttack
+    make, calls, _ = pipeline_factory
+    no_attack = make().attacks[0]
+    # workers are spawned, they get the dictionary path from the gin config of this process
+    gin.parse_config("attacks.BritishToAmericanEnglish.dictionary_path = "
+                     "'data/additional_data/british_to_american.json'")
+    try:
+        attacks = [no_attack, ShuffleAttack, ExclamationMark, BritishToAmericanEnglish]
+        make(attacks=attacks, attack_seed=3, attack_chunk_size=2).run()
+        in_process = pd.read_csv(tmp_path / "results.csv", index_col=0)
+
+        make(attacks=attacks, attack_seed=3, attack_chunk_size=2, attack_workers=2,
+             output_dir=str(tmp_path / "parallel.csv")).run()
+    finally:
+        gin.clear_config()
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "parallel.csv", index_col=0), in_process)
+
+
+def test_pipeline_runs_share_preparation_checkpoints(pipeline_factory, tmp_path):
+    make, calls, _ = pipeline_factory
+    preparation_dir = str(tmp_path / "preparation")
+    make(preparation_checkpoint_dir=preparation_dir, output_dir=str(tmp_path / "first.csv")).prepare()
+    assert calls['load'] == 1 and calls['segment'] == 1
+    make(preparation_checkpoint_dir=preparation_dir, output_dir=str(tmp_path / "first.csv")).run()
+    make(preparation_checkpoint_dir=preparation_dir, output_dir=str(tmp_path / "second.csv")).run()
+    assert calls['load'] == 1 and calls['segment'] == 1
+    assert (tmp_path / "second_metrics.csv").exists()
+
+
+def test_pipeline_writes_stage_profile(pipeline_factory, tmp_path):
+    import json
+    import pandas as pd
+    make, calls, _ = pipeline_factory
+    make(profiler='cprofile').run()
+    with open(tmp_path / "results_profile.json") as f:
+        profile = json.load(f)
+    stages = {(stage['stage'], stage['name']): stage for stage in profile['stages']}
+    assert {('load', None), ('clean', None), ('segment', None), ('attack', None), ('attack', 'NoAttack'),
+            ('summarize', None), ('summarize', 'NoAttack'), ('metric', None), ('metric', 'RougeScore'),
+            ('analyze', None)} <= set(stages)
+    assert stages[('summarize', 'NoAttack')]['items'] == 3
+    assert stages[('summarize', 'NoAttack')]['failures'] == 0
+    assert not stages[('segment', None)]['from_checkpoint']
+    assert profile['wall_time'] >= sum(stage['wall_time'] for stage in profile['stages'] if stage['name'] is None)
+    assert (tmp_path / "results_profile" / "segment.prof").exists()
+
+    make(chunk_size=2, checkpoint_dir=str(tmp_path / "chunked")).run()
+    records = pd.read_csv(tmp_path / "results_profile.csv")
+    assert records[records['stage'] == 'segment']['chunk'].tolist() == [0, 1]
+    assert records[records['stage'] == 'load']['items'].sum() == 3
+
+
+def test_checkpoint_columns_are_stored_in_separate_files(tmp_path):
+    from jobs.checkpoint import CheckpointStore
+    store = CheckpointStore(str(tmp_path))
+    store.save_column('metric', 'Stylometrix/original_text', 'a', [1, 2])
+    store.save_column('metric', 'NovelNGrams', 'b', [3])
+    first_path = store.column_path('metric', 'Stylometrix/original_text')
+    written = os.stat(first_path).st_mtime_ns
+    store.save_column('metric', 'NovelNGrams', 'c', [4])
+    assert os.stat(first_path).st_mtime_ns == written
+    assert store.load_columns('metric') == {'Stylometrix/original_text': ('a', [1, 2]), 'NovelNGrams': ('c', [4])}
+    store.clear('metric')
+    assert store.load_columns('metric') == {}
@@ -0,0 +1,67 @@
+import pytest
+
+
+@pytest.fixture
+def sentence_model(monkeypatch):
+    import spacy
+    from src.data_preparation import preprocess
+    from src.utils.model_registry import ModelRegistry
+
+    def loader(model_name, disable=()):
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        return nlp
+
+    monkeypatch.setattr(spacy, "load", loader)
+    monkeypatch.setattr("src.utils.model_registry.model_registry", ModelRegistry())
+    return preprocess
+
+
+def test_get_sentences(sentence_model):
+    assert sentence_model.get_sentences("One sentence. Second sentence.") == ["One sentence.", "Second sentence."]
+
+
+def test_pipe_sentences_matches_get_sentences(sentence_model):
+    texts = ["One sentence. Second sentence.", "Only one here!", "A? B. C!"]
+    piped = list(sentence_model.pipe_sentences(iter(texts), batch_size=2))
+    assert piped == [sentence_model.get_sentences(text) for text in texts]
+
+
+CLEANING_FRAGMENTS = [
+    "LONDON, England (Reuters) -- ", "Atlanta (CNN) -- ", "(CNN)", "By . Daily Mail Reporter . ",
+    "By . John Smith, . PUBLISHED: . 10:15 EST, 3 May 2013 . | . UPDATED: . 11:20 EST, 3 May 2013 . ",
+    "E-mail to a friend . ", "E-mail to a friend.", "Copyright 2007 Reuters. ", "All rights reserved.",
+    "This material may not be published, broadcast, rewritten, or redistributed.", "CLICK HERE to read more. ",
+    "Harry Potter star Daniel Radcliffe gains access to a fortune. ", "He said:  'I am fine.'\n", "\n\n",
+    "Mr. Smith paid $3.5 million. ", "  ", "By the way, it rained. ", "U.S. officials said. ", "...",
+    "Zürich, Switzerland (CNN)", "word,(CNN)", "(CNN)(CNN) -- ", "a b c d e (CNN) -- ", "_x_ ",
+]
+
+
+def test_clean_text_matches_legacy_chain():
+    import random
+    from benchmarks.clean_text import legacy_clean_text
+    from src.data_preparation.preprocess import clean_text
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choice(CLEANING_FRAGMENTS) for _ in range(rng.randint(0, 12)))
+        assert clean_text(text) == legacy_clean_text(text), text
+
+
+def test_clean_texts_process_pool_matches_clean_text():
+    import random
+    from src.data_preparation.preprocess import clean_text, clean_texts
+    rng = random.Random(1)
+    texts = ["".join(rng.choice(CLEANING_FRAGMENTS) for _ in range(8)) for _ in range(40)]
+    assert clean_texts(texts, n_process=2, chunksize=8) == [clean_text(text) for text in texts]
+
+
+def test_remove_cnn_lines_matches_regex_on_random_text():
+    import random
+    import re
+    from src.data_preparation.preprocess import remove_cnn_lines
+    rng = random.Random(2)
+    alphabet = ["a", "B", "7", "_", " ", ",", ", ", "-", " -- ", "(CNN)", "(CNN", "é", "."]
+    for _ in range(5000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert remove_cnn_lines(text) == re.sub(r'(\w+)?( |, )?(\w+)?( )?\(CNN\)( -- )?', "", text), text
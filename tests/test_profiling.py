@@ -0,0 +1,39 @@
+def test_stage_profiler_accumulates_records(tmp_path):
+    import csv
+    import json
+    from jobs.profiling import StageProfiler
+    profiler = StageProfiler()
+    with profiler.stage('attack', 'WordCorruption', items=10) as record:
+        record.count('cache_hits', 3)
+        record.count('cache_misses', 1)
+    with profiler.stage('attack', 'WordCorruption', items=5):
+        sum(range(10000))
+    profiler.chunk = 1
+    with profiler.stage('attack', 'WordCorruption', items=4) as record:
+        record.from_checkpoint = True
+    assert [record.items for record in profiler.records] == [15, 4]
+
+    summary = profiler.summary()
+    assert len(summary['stages']) == 1
+    stage = summary['stages'][0]
+    assert stage['items'] == 19 and stage['cache_hits'] == 3 and stage['cache_hit_rate'] == 0.75
+    assert not stage['from_checkpoint']
+    assert stage['wall_time'] >= stage['items'] / stage['items_per_second'] - 1e-9
+
+    profiler.write(str(tmp_path / "profile.json"), str(tmp_path / "profile.csv"))
+    with open(tmp_path / "profile.json") as f:
+        written = json.load(f)
+    assert written['stages'][0]['name'] == 'WordCorruption'
+    # the peak is the high-water mark of the whole process, the growth is what the stage added to it
+    stage = written['stages'][0]
+    assert stage['process_peak_rss_mb'] <= written['process_peak_rss_mb']
+    assert 0 <= stage['rss_growth_mb'] <= stage['process_peak_rss_mb']
+    with open(tmp_path / "profile.csv") as f:
+        assert [row['chunk'] for row in csv.DictReader(f)] == ['', '1']
+
+
+def test_stage_profiler_rejects_unknown_profiler():
+    import pytest
+    from jobs.profiling import StageProfiler
+    with pytest.raises(ValueError):
+        StageProfiler('perf', 'profile')
@@ -0,0 +1,235 @@
+import pytest
+
+
+def make_summarizer(cache_path):
+    from src.summarization.summarizer import Summarizer
+
+    class EchoSummarizer(Summarizer):
+        def __init__(self):
+            super().__init__(cache_path=cache_path)
+            self.name = "Echo Summarizer"
+            self.model_name = "echo"
+            self.prompt = "Summarize: "
+            self.temperature = 0.0
+            self.max_tokens = 10
+            self.calls = 0
+
+        def generate_summary(self, text: str) -> str:
+            self.calls += 1
+            self.last_usage = {'total_tokens': len(text.split())}
+            return text.split('.')[0]
+
+    return EchoSummarizer()
+
+
+def test_summary_cache_reuses_summaries(tmp_path):
+    summarizer = make_summarizer(str(tmp_path / "summaries.sqlite"))
+    assert summarizer.summarize("First. Second.") == "First"
+    assert summarizer.summarize("First. Second.") == "First"
+    assert summarizer.calls == 1
+
+    entry = summarizer.cache.get(summarizer.cache_key("First. Second."))
+    assert entry['usage'] == {'total_tokens': 2}
+    assert entry['latency'] >= 0
+
+    rerun = make_summarizer(str(tmp_path / "summaries.sqlite"))
+    assert rerun.summarize("First. Second.") == "First"
+    assert rerun.calls == 0
+
+
+def test_summary_cache_key_depends_on_generation_settings(tmp_path):
+    summarizer = make_summarizer(str(tmp_path / "summaries.sqlite"))
+    key = summarizer.cache_key("Text.")
+    summarizer.temperature = 0.7
+    assert summarizer.cache_key("Text.") != key
+
+
+@pytest.fixture
+def stub_openai_server():
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = {'requests': 0, 'in_flight': 0, 'max_in_flight': 0, 'rate_limited': set()}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            text = body['messages'][1]['content'].split(': ', 1)[1].strip()
+            with lock:
+                state['requests'] += 1
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+                # every text is rate limited once before it succeeds
+                first_attempt = text not in state['rate_limited']
+                state['rate_limited'].add(text)
+            time.sleep(0.05)
+            with lock:
+                state['in_flight'] -= 1
+            if first_attempt:
+                status, payload = 429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}
+            else:
+                status, payload = 200, {
+                    'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': f"summary of {text}"}}],
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': 3, 'total_tokens': 13},
+                }
+            encoded = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1", state
+    server.shutdown()
+
+
+def test_async_engine_retries_and_limits_concurrency(stub_openai_server, tmp_path):
+    from src.summarization.async_engine import AsyncSummarizationEngine
+    from src.summarization.chat_gpt_summarizer import ChatGPTSummarizer
+    api_base, state = stub_openai_server
+    summarizer = ChatGPTSummarizer(prompt="Summarize:", temperature=0.0, openai_apikey="test", api_base=api_base,
+                                   cache_path=str(tmp_path / "summaries.sqlite"))
+    engine = AsyncSummarizationEngine(summarizer, max_concurrency=3, initial_backoff=0.01, max_backoff=0.05)
+    texts = [f"text {i}" for i in range(8)]
+
+    assert engine.run(texts) == [f"summary of {text}" for text in texts]
+    assert engine.retries == len(texts)
+    assert engine.failures == 0
+    assert state['max_in_flight'] <= 3
+    entry = summarizer.cache.get(summarizer.cache_key("text 0"))
+    assert entry['usage']['total_tokens'] == 13
+
+    requests = state['requests']
+    assert engine.run(texts) == [f"summary of {text}" for text in texts]
+    assert state['requests'] == requests
+
+
+def test_async_engine_caches_summaries_before_interrupt(tmp_path):
+    import pytest
+    from src.summarization.async_engine import AsyncSummarizationEngine
+    from src.summarization.summarizer import Summarizer
+
+    class Interrupted(BaseException):
+        pass
+
+    class EchoSummarizer(Summarizer):
+        async def agenerate(self, text):
+            if text == "stop":
+                raise Interrupted()
+            return f"summary of {text}", None
+
+    summarizer = EchoSummarizer(cache_path=str(tmp_path / "summaries.sqlite"))
+    engine = AsyncSummarizationEngine(summarizer, max_concurrency=1)
+    with pytest.raises(Interrupted):
+        engine.run(["a", "b", "stop", "c"])
+    assert summarizer.cache.get(summarizer.cache_key("a"))['summary'] == "summary of a"
+    assert summarizer.cache.get(summarizer.cache_key("b"))['summary'] == "summary of b"
+
+def test_token_bucket_waits_for_refill():
+    import asyncio
+    from src.summarization.async_engine import TokenBucket
+
+    async def acquire_all():
+        bucket = TokenBucket(rate_per_minute=600)
+        bucket.tokens = 0
+        start = asyncio.get_running_loop().time()
+        await bucket.acquire(2)
+        return asyncio.get_running_loop().time() - start
+
+    assert asyncio.run(acquire_all()) >= 0.15
+
+
+def test_hf_summarizer_batches_by_length_and_truncates():
+    import torch
+    from types import SimpleNamespace
+    from src.summarization.hf_summarizer import HfSummarizer
+
+    class WordTokenizer:
+        pad_token_id = 0
+        eos_token_id = 1
+        model_max_length = 12
+
+        def __call__(self, texts, add_special_tokens=True):
+            if isinstance(texts, str):
+                return {"input_ids": [len(word) + 10 for word in texts.split()]}
+            return {"input_ids": [[len(word) + 10 for word in text.split()] for text in texts]}
+
+        def decode(self, tokens, skip_special_tokens=True):
+            return " ".join(f"w{token}" for token in tokens)
+
+    class EchoModel:
+        config = SimpleNamespace(max_position_embeddings=64)
+        device = torch.device("cpu")
+
+        def __init__(self):
+            self.batch_shapes = []
+            self.max_new_tokens = []
+
+        def generate(self, input_ids, attention_mask, max_new_tokens, **kwargs):
+            self.batch_shapes.append(tuple(input_ids.shape))
+            self.max_new_tokens.append(max_new_tokens)
+            # the "summary" is the number of real prompt tokens
+            lengths = attention_mask.sum(dim=1, keepdim=True)
+            return torch.cat([input_ids, lengths, torch.zeros_like(lengths)], dim=1)
+
+    summarizer = HfSummarizer.__new__(HfSummarizer)
+    summarizer.prompt = "Summarize"
+    summarizer.max_tokens = 4
+    summarizer.batch_size = 2
+    summarizer.return_full_text = False
+    summarizer.tokenizer = WordTokenizer()
+    summarizer.model = EchoModel()
+    summarizer.prefix_ids = summarizer.tokenizer("Summarize ")["input_ids"]
+    summarizer.suffix_ids = []
+    summarizer.context_length = summarizer.get_context_length()
+
+    texts = ["a b c d e f g h i j", "a", "a b c", "a b"]
+    summaries = summarizer.generate_summaries(texts)
+
+    # context of 12 tokens minus 4 new tokens and the 1 token prompt leaves 7 tokens of text
+    assert summaries == ["w8", "w2", "w4", "w3"]
+    assert summarizer.model.batch_shapes == [(2, 3), (2, 8)]
+    assert summarizer.last_batch_usage[0] == {'prompt_tokens': 8, 'completion_tokens': 1, 'total_tokens': 9}
+    # max_tokens bounds the new tokens, not the prompt and the summary together
+    assert summarizer.model.max_new_tokens == [4, 4]
+
+    # by default the summary starts with the prompt, as the text-generation pipeline returns it
+    summarizer.return_full_text = True
+    summaries = summarizer.generate_summaries(texts)
+    assert summaries[1] == "Summarize a \nw2"
+    assert summaries[0] == "Summarize w11 w11 w11 w11 w11 w11 w11 \nw8"
+
+
+def test_hf_summarizer_loads_tiny_model_on_cpu(tmp_path):
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+    from src.summarization.hf_summarizer import HfSummarizer
+    from src.utils.model_registry import model_registry
+
+    vocabulary = {word: index for index, word in enumerate(["<eos>", "<unk>", "Summarize:", "a", "short", "text"])}
+    tokenizer = Tokenizer(models.WordLevel(vocabulary, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", unk_token="<unk>",
+                            model_max_length=32).save_pretrained(str(tmp_path))
+    GPT2LMHeadModel(GPT2Config(vocab_size=len(vocabulary), n_positions=32, n_embd=8, n_layer=1, n_head=2,
+                               eos_token_id=0, bos_token_id=0)).save_pretrained(str(tmp_path))
+
+    try:
+        summarizer = HfSummarizer(prompt="Summarize:", temperature=0.0, model_name=str(tmp_path), max_tokens=3)
+        assert summarizer.model.dtype == torch.float32
+        assert summarizer.model.device.type == "cpu"
+        assert isinstance(summarizer.generate_summary("a short text"), str)
+    finally:
+        model_registry.clear()